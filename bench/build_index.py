@@ -0,0 +1,37 @@
+"""
+Build the on-disk BM25 index once, ahead of runs.
+
+Usage:
+  PYTHONPATH=. python3 bench/build_index.py [corpus.jsonl] [index_dir]
+
+run.py / tune_threshold.py load the index from index/bm25 (memory-mapped)
+and only rebuild it when the corpus file changes.
+"""
+import sys
+import time
+
+from bench.retrieval import load_or_build_retriever
+
+
+def main():
+    corpus_path = sys.argv[1] if len(sys.argv) > 1 else "corpus/corpus.jsonl"
+    index_path = sys.argv[2] if len(sys.argv) > 2 else "index/bm25"
+
+    t0 = time.perf_counter()
+    retriever = load_or_build_retriever(corpus_path, index_path)
+    elapsed = time.perf_counter() - t0
+
+    print(f"Index: {index_path}")
+    print(f"  docs: {retriever.index.num_docs}")
+    print(f"  terms: {len(retriever.index.vocab)}")
+    print(f"  postings: {retriever.index.num_postings}")
+    mem = retriever.index.memory_bytes()
+    n_tokens = max(1, retriever.index.num_tokens)
+    print(f"  memory: {mem['total'] / 2**20:.1f} MiB "
+          f"({mem['total'] / n_tokens:.1f} bytes per indexed token; "
+          f"postings {mem['postings'] / n_tokens:.1f}, vocab {mem['vocab'] / n_tokens:.1f})")
+    print(f"  ready in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+Multi-stage (cascaded) gating: cheap checks first, expensive ones last.
+
+A GateCascade runs stages in order. Each stage returns
+  ("stop", reason)   stop here (no LLM call)
+  ("answer", None)   call the LLM, skip the remaining stages
+  ("defer", None)    undecided, ask the next stage
+and if every stage defers the cascade answers. Stages carry a rough cost
+estimate (est_cost_us) and the cascade counts calls, exits and measured
+time per stage, so an expensive stage (cross-encoder, verifier) can be
+placed where it only sees the ambiguous slice.
+
+Stages with needs_retrieval = False (e.g. the OOV check) only look at the
+query; RAGStopFirst runs them before retrieval when it retrieves itself,
+so they can stop a query before it is scored. It then retrieves with
+min_score=score_floor, so queries whose BM25 upper bound is below the
+max_score stage's tau are not scored either.
+
+default_cascade() reproduces the single-function stop-first gate exactly:
+  oov        all query tokens unknown to the index -> stop "no_data"
+             (such a query scores 0 < tau anyway)
+  max_score  max_score < tau -> stop "no_data"
+  gap        conflict candidate -> stop "conflict"; weak top-1 with a tiny
+             top-1/top-2 gap -> stop "low_confidence"
+With a verifier, gap-ambiguous queries defer to it and clear ones answer
+right away, so the verifier runs on the ambiguous slice only.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+from collections import Counter
+from time import perf_counter_ns
+from typing import Callable, Dict, List, Optional, Protocol, Tuple
+
+from bench.retrieval import BM25Retriever, RetrievalResult
+
+
+# tau calibrated for BM25 score meaningfulness
+# answerable min=2.58, all pass at τ=2.0
+TAU_THRESHOLD = 2.0      # BM25 score threshold (recall=1.0)
+TAU_STOP = 2.0           # stop-first uses same base threshold
+
+STOP = "stop"
+ANSWER = "answer"
+DEFER = "defer"
+
+# exit "stage" when every stage deferred
+FINAL_STAGE = "final"
+
+StageResult = Tuple[str, Optional[str]]
+# verifier(query, retrieval) -> (decision, stop_reason)
+Verifier = Callable[[str, RetrievalResult], StageResult]
+
+
+class GateStage(Protocol):
+    name: str
+    est_cost_us: float
+    # False: check() only looks at the query and is called with r=None
+    needs_retrieval: bool
+
+    def check(self, query: str, r: Optional[RetrievalResult]) -> StageResult:
+        """-> (STOP, reason) / (ANSWER, None) / (DEFER, None)"""
+        ...
+
+    @property
+    def params(self) -> tuple:
+        """Every setting that can change a decision (memo / cache keys)."""
+        ...
+
+
+class _BaseStage:
+    name = "stage"
+    est_cost_us = 1.0
+    needs_retrieval = True
+
+    @property
+    def params(self) -> tuple:
+        return ()
+
+
+class OOVStage(_BaseStage):
+    """
+    Stop when at least max_oov_ratio of the query tokens have no live
+    postings. A retrieved query's ratio comes from the token counts on its
+    RetrievalResult; only query-only checks (r=None) tokenize here.
+    """
+
+    name = "oov"
+    est_cost_us = 2.0
+    needs_retrieval = False
+
+    def __init__(self, retriever: BM25Retriever, max_oov_ratio: float = 1.0, reason: str = "no_data"):
+        self.retriever = retriever
+        self.max_oov_ratio = max_oov_ratio
+        self.reason = reason
+
+    def oov_ratio(self, query: str, r: Optional[RetrievalResult] = None) -> float:
+        if r is not None and r.oov_tokens is not None:
+            n, oov = r.query_tokens, r.oov_tokens
+        else:
+            ids = self.retriever.term_ids_from_text(query)
+            n, oov = ids.size, self.retriever.index.oov_count(ids)
+        if n == 0:
+            return 1.0
+        return 1.0 - (n - oov) / n
+
+    def check(self, query: str, r: Optional[RetrievalResult]) -> StageResult:
+        if self.oov_ratio(query, r) >= self.max_oov_ratio:
+            return STOP, self.reason
+        return DEFER, None
+
+    @property
+    def params(self) -> tuple:
+        return (self.max_oov_ratio, self.reason)
+
+
+class MaxScoreStage(_BaseStage):
+    """No data: retrieval confidence too low."""
+
+    name = "max_score"
+    est_cost_us = 0.1
+
+    def __init__(self, tau: float, reason: str = "no_data"):
+        self.tau = tau
+        self.reason = reason
+
+    def check(self, query: str, r: Optional[RetrievalResult]) -> StageResult:
+        if r.max_score < self.tau:
+            return STOP, self.reason
+        return DEFER, None
+
+    @property
+    def params(self) -> tuple:
+        return (self.tau, self.reason)
+
+
+class GapStage(_BaseStage):
+    """
+    Ambiguous top evidence: a conflict candidate (top-1/top-2 too close),
+    or a top-1 score below strong_factor * tau with a gap under min_gap.
+    on_ambiguous: "stop" (with the typed reason) or "defer";
+    on_clear: "defer" or "answer".
+    """
+
+    name = "gap"
+    est_cost_us = 0.2
+
+    def __init__(
+        self,
+        tau: float,
+        strong_factor: float = 1.2,
+        min_gap: float = 0.01,
+        on_ambiguous: str = STOP,
+        on_clear: str = DEFER,
+    ):
+        self.tau = tau
+        self.strong_factor = strong_factor
+        self.min_gap = min_gap
+        self.on_ambiguous = on_ambiguous
+        self.on_clear = on_clear
+
+    def check(self, query: str, r: Optional[RetrievalResult]) -> StageResult:
+        if r.conflict_candidate:
+            reason = "conflict"
+        elif r.top1_score < (self.tau * self.strong_factor) and r.score_gap_12 < self.min_gap:
+            reason = "low_confidence"
+        else:
+            return self.on_clear, None
+        if self.on_ambiguous == STOP:
+            return STOP, reason
+        return self.on_ambiguous, None
+
+    @property
+    def params(self) -> tuple:
+        return (self.tau, self.strong_factor, self.min_gap, self.on_ambiguous, self.on_clear)
+
+
+class VerifierStage(_BaseStage):
+    """Hook for an expensive check (cross-encoder, NLI, LLM judge, ...)."""
+
+    def __init__(self, verify: Verifier, name: str = "verifier", est_cost_us: float = 1000.0):
+        self.verify = verify
+        self.name = name
+        self.est_cost_us = est_cost_us
+
+    def check(self, query: str, r: Optional[RetrievalResult]) -> StageResult:
+        return self.verify(query, r)
+
+    @property
+    def params(self) -> tuple:
+        return (self.name, getattr(self.verify, "__module__", None),
+                getattr(self.verify, "__qualname__", repr(self.verify)))
+
+
+class _StageStats:
+    __slots__ = ("calls", "exits", "total_ns")
+
+    def __init__(self):
+        self.calls = 0
+        self.exits: Counter = Counter()
+        self.total_ns = 0
+
+
+class GateCascade:
+    """
+    Ordered stages + per-stage counters. Stages run in the given order,
+    which should be cheap -> expensive; no reordering by est_cost_us, since
+    order also decides which stop_reason wins.
+    """
+
+    def __init__(self, stages: List[GateStage], final: str = ANSWER):
+        names = [s.name for s in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate stage names: {names}")
+        self.stages = stages
+        self.final = final
+        self.reset_stats()
+        # leading stages that only need the query
+        self.n_pre = 0
+        while self.n_pre < len(stages) and not stages[self.n_pre].needs_retrieval:
+            self.n_pre += 1
+
+    def reset_stats(self) -> None:
+        """Zero every counter (e.g. at the start of a run_sharded shard)."""
+        self._stats = {s.name: _StageStats() for s in self.stages}
+        self.final_exits = 0
+        self.retrievals_skipped = 0
+        # decisions replayed from a gate memo (no stage ran), by exit stage
+        self.memo_exits: Counter = Counter()
+
+    def counters(self) -> Dict:
+        """Raw counters as plain data, to send to another process."""
+        return {
+            "stages": {name: (st.calls, dict(st.exits), st.total_ns)
+                       for name, st in self._stats.items()},
+            "final_exits": self.final_exits,
+            "retrievals_skipped": self.retrievals_skipped,
+            "memo_exits": dict(self.memo_exits),
+        }
+
+    def merge_counters(self, counters: Dict) -> None:
+        """Add counters() of a cascade with the same stages (e.g. a worker's)."""
+        for name, (calls, exits, total_ns) in counters["stages"].items():
+            st = self._stats[name]
+            st.calls += calls
+            st.exits.update(exits)
+            st.total_ns += total_ns
+        self.final_exits += counters["final_exits"]
+        self.retrievals_skipped += counters["retrievals_skipped"]
+        self.memo_exits.update(counters["memo_exits"])
+
+    @property
+    def params(self) -> tuple:
+        return tuple((type(s).__name__, s.name, s.params) for s in self.stages) + (self.final,)
+
+    @property
+    def score_floor(self) -> Optional[float]:
+        """
+        tau of a MaxScoreStage right after the query-only stages, else None.
+        It stops every query whose max_score is below tau, so retrieval may
+        skip scoring queries whose score bound is already below it.
+        """
+        if self.n_pre < len(self.stages) and isinstance(self.stages[self.n_pre], MaxScoreStage):
+            return self.stages[self.n_pre].tau
+        return None
+
+    def _run(self, stages, query: str, r: Optional[RetrievalResult]) -> Optional[Tuple[str, Optional[str], str]]:
+        for stage in stages:
+            t0 = perf_counter_ns()
+            decision, reason = stage.check(query, r)
+            st = self._stats[stage.name]
+            st.total_ns += perf_counter_ns() - t0
+            st.calls += 1
+            st.exits[decision] += 1
+            if decision != DEFER:
+                return decision, reason, stage.name
+        return None
+
+    def decide(self, query: str, r: RetrievalResult) -> Tuple[str, Optional[str], str]:
+        """All stages on a retrieved query. Returns (decision, stop_reason, exit stage)."""
+        out = self._run(self.stages, query, r)
+        if out is None:
+            self.final_exits += 1
+            return self.final, None, FINAL_STAGE
+        return out
+
+    def pre_retrieval(self, query: str) -> Optional[Tuple[str, Optional[str], str]]:
+        """
+        Leading query-only stages. A non-None result is final and the query
+        need not be retrieved; None means continue with post_retrieval().
+        """
+        out = self._run(self.stages[:self.n_pre], query, None)
+        if out is not None:
+            self.retrievals_skipped += 1
+        return out
+
+    def post_retrieval(self, query: str, r: RetrievalResult) -> Tuple[str, Optional[str], str]:
+        """The stages after the query-only prefix."""
+        out = self._run(self.stages[self.n_pre:], query, r)
+        if out is None:
+            self.final_exits += 1
+            return self.final, None, FINAL_STAGE
+        return out
+
+    def record_memo_hit(self, exit_stage: Optional[str]) -> None:
+        """
+        A decision served from query_cache.cached_gate's memo. No stage ran,
+        so stage counters miss it; it is counted under "memo" by the stage
+        that originally decided (None: the memoized gate_fn did not say).
+        """
+        self.memo_exits[exit_stage or "unknown"] += 1
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Per stage: estimated and measured cost, calls and exits by decision;
+        memoized decisions are under "memo" (hits, exits by stage).
+        """
+        out = {}
+        for s in self.stages:
+            st = self._stats[s.name]
+            out[s.name] = {
+                "est_cost_us": s.est_cost_us,
+                "calls": st.calls,
+                "avg_us": round(st.total_ns / st.calls / 1e3, 3) if st.calls else None,
+                "total_us": round(st.total_ns / 1e3, 1),
+                "stop": st.exits[STOP],
+                "answer": st.exits[ANSWER],
+                "defer": st.exits[DEFER],
+            }
+        out[FINAL_STAGE] = {"decision": self.final, "exits": self.final_exits}
+        out["memo"] = {"hits": sum(self.memo_exits.values()), "exits": dict(self.memo_exits)}
+        out["retrievals_skipped"] = self.retrievals_skipped
+        return out
+
+
+def default_cascade(
+    retriever: BM25Retriever,
+    tau: float,
+    verifier: Optional[Verifier] = None,
+) -> GateCascade:
+    """The stop-first gate as a cascade (+ an optional verifier on the ambiguous slice)."""
+    stages: List[GateStage] = []
+    if tau > 0:
+        # all-OOV queries score 0; only equivalent to max_score < tau for tau > 0
+        stages.append(OOVStage(retriever))
+    stages.append(MaxScoreStage(tau))
+    if verifier is None:
+        stages.append(GapStage(tau))
+    else:
+        stages.append(GapStage(tau, on_ambiguous=DEFER, on_clear=ANSWER))
+        stages.append(VerifierStage(verifier))
+    return GateCascade(stages)
+
+
+def load_verifier(spec: str) -> Verifier:
+    """'package.module:function' -> the function."""
+    module, _, attr = spec.partition(":")
+    if not module or not attr:
+        raise ValueError(f"Verifier must be 'module:function', got {spec!r}")
+    return getattr(importlib.import_module(module), attr)
+
+
+def add_gate_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--gate-verifier", default=None, metavar="MODULE:FUNCTION",
+                        help="stop-first: verifier(query, retrieval) -> (decision, stop_reason), "
+                             "run only on gap-ambiguous queries")
+
+
+def cascade_from_args(args, retriever) -> GateCascade:
+    verifier = load_verifier(args.gate_verifier) if args.gate_verifier else None
+    return default_cascade(retriever, TAU_STOP, verifier)
@@ -0,0 +1,202 @@
+"""
+Gate-only evaluation: stop rate, false-stop rate and gate throughput.
+
+Streams query files through batched retrieval (retrieve_many) and the
+gates of all three variants without generating, so large query sets
+(n >= 100 up to millions) can be evaluated on one CPU.
+
+Inputs are JSONL with a "question" field. Labels come from the file flag
+(--answerable / --unanswerable) or a per-row boolean "answerable" field,
+which takes precedence; --queries files are unlabeled unless rows say so.
+
+  false_stop_rate:  answerable queries stopped (lost answers)
+  correct_stop_rate: unanswerable queries stopped (hallucinations avoided)
+
+Usage:
+  PYTHONPATH=. python3 bench/gate_eval.py --answerable datasets/answerable.jsonl
+  PYTHONPATH=. python3 bench/gate_eval.py --queries big.jsonl --batch-size 1024
+"""
+import argparse
+import json
+import time
+from collections import Counter, defaultdict
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from bench.retrieval import load_or_build_retriever
+from bench.rag_baseline_naive import RAGBaselineNaive
+from bench.rag_baseline_threshold import RAGBaselineThreshold
+from bench.rag_stop_first import RAGStopFirst
+from bench.gate_cascade import TAU_THRESHOLD, TAU_STOP, add_gate_args, cascade_from_args
+
+
+VARIANT_NAMES = ("baseline_naive", "baseline_score_threshold", "stop_first")
+LABELS = {True: "answerable", False: "unanswerable", None: "unlabeled"}
+
+
+def iter_queries(path: str, answerable: Optional[bool]) -> Iterator[Tuple[str, Optional[bool]]]:
+    """(question, label) per line of a JSONL file, read lazily."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            yield row["question"], row.get("answerable", answerable)
+
+
+class GateStats:
+    """Per-variant, per-label decision counters."""
+
+    def __init__(self):
+        self.total = Counter()                    # label -> n
+        self.stopped = Counter()                  # label -> n stopped
+        self.reasons = defaultdict(Counter)       # label -> stop_reason counts
+
+    def add(self, label: Optional[bool], decision: str, stop_reason: Optional[str]) -> None:
+        self.total[label] += 1
+        if decision == "stop":
+            self.stopped[label] += 1
+            self.reasons[label][stop_reason] += 1
+
+    def summary(self) -> dict:
+        n = sum(self.total.values())
+        n_stop = sum(self.stopped.values())
+
+        def rate(label):
+            return round(self.stopped[label] / self.total[label], 4) if self.total[label] else None
+
+        reasons = Counter()
+        for c in self.reasons.values():
+            reasons.update(c)
+
+        return {
+            "total_queries": n,
+            "stopped": n_stop,
+            "stop_rate": round(n_stop / n, 4) if n else 0.0,
+            "false_stop_rate": rate(True),
+            "correct_stop_rate": rate(False),
+            "by_label": {
+                LABELS[label]: {
+                    "n": self.total[label],
+                    "stopped": self.stopped[label],
+                    "stop_reason_breakdown": dict(self.reasons[label]),
+                }
+                for label in self.total
+            },
+            "stop_reason_breakdown": dict(reasons),
+        }
+
+
+def evaluate(retriever, sources, batch_size: int = 1024, top_k: int = 5, cascade=None):
+    """
+    sources: iterables of (question, label).
+    cascade: stop-first GateCascade (default: default_cascade).
+    Returns (per-variant summaries, timing dict, stop-first cascade stats).
+    """
+    variants = [
+        RAGBaselineNaive(retriever, None),
+        RAGBaselineThreshold(retriever, TAU_THRESHOLD, None),
+        RAGStopFirst(retriever, TAU_STOP, None, cascade=cascade),
+    ]
+    stats = {name: GateStats() for name in VARIANT_NAMES}
+    gates = [(stats[name], rag.gate) for name, rag in zip(VARIANT_NAMES, variants)]
+    # naive's gate ignores the retrieval and the others stop every query
+    # below their floor, so queries bounded below the lowest floor are not scored
+    floors = [rag.score_floor for rag in variants[1:]]
+    min_score = None if None in floors else min(floors)
+    n_unscored = 0
+
+    n = 0
+    retrieval_s = 0.0
+    gate_s = 0.0
+    t0 = time.perf_counter()
+    for source in sources:
+        it = iter(source)
+        while True:
+            batch = list(islice(it, batch_size))
+            if not batch:
+                break
+            questions = [q for q, _ in batch]
+
+            t_r = time.perf_counter()
+            retrievals = retriever.retrieve_many(
+                questions, top_k=top_k, batch_size=batch_size, min_score=min_score
+            )
+            t_g = time.perf_counter()
+            n_unscored += sum(r.skipped_scoring for r in retrievals)
+            for (_, label), r in zip(batch, retrievals):
+                for st, gate in gates:
+                    decision, stop_reason = gate(r)
+                    st.add(label, decision, stop_reason)
+            t_end = time.perf_counter()
+
+            retrieval_s += t_g - t_r
+            gate_s += t_end - t_g
+            n += len(batch)
+    wall_s = time.perf_counter() - t0
+
+    timing = {
+        "queries": n,
+        "scoring_skipped": n_unscored,
+        "wall_s": round(wall_s, 3),
+        "retrieval_s": round(retrieval_s, 3),
+        "gate_s": round(gate_s, 3),
+        "queries_per_sec": round(n / wall_s, 1) if wall_s else 0.0,
+        "gate_queries_per_sec": round(n / gate_s, 1) if gate_s else 0.0,
+    }
+    return {name: st.summary() for name, st in stats.items()}, timing, variants[-1].cascade.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gate-only evaluation (no LLM calls)")
+    parser.add_argument("--answerable", nargs="*", default=[],
+                        help="JSONL files of answerable queries")
+    parser.add_argument("--unanswerable", nargs="*", default=[],
+                        help="JSONL files of unanswerable queries")
+    parser.add_argument("--queries", nargs="*", default=[],
+                        help="JSONL files, labeled per row via 'answerable' (optional)")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--output", default="results/gate_eval.json")
+    add_gate_args(parser)
+    args = parser.parse_args()
+
+    sources = (
+        [iter_queries(p, True) for p in args.answerable]
+        + [iter_queries(p, False) for p in args.unanswerable]
+        + [iter_queries(p, None) for p in args.queries]
+    )
+    if not sources:
+        sources = [iter_queries("datasets/answerable.jsonl", True)]
+
+    retriever = load_or_build_retriever("corpus/corpus.jsonl", "index/bm25")
+    summaries, timing, cascade_stats = evaluate(
+        retriever, sources, args.batch_size, args.top_k, cascade_from_args(args, retriever)
+    )
+
+    print("\n=== Gate-only Summary ===")
+    for name, s in summaries.items():
+        print(f"\n[{name}]")
+        for k in ("total_queries", "stop_rate", "false_stop_rate",
+                  "correct_stop_rate", "stop_reason_breakdown"):
+            print(f"  {k}: {s[k]}")
+    print("\n=== Stop-first gate cascade ===")
+    for stage, s in cascade_stats.items():
+        print(f"  {stage}: {s}")
+    print(f"\nScoring skipped (score bound below every gate's floor): "
+          f"{timing['scoring_skipped']} of {timing['queries']} queries")
+    print(f"\nThroughput: {timing['queries_per_sec']} queries/s "
+          f"(gates alone: {timing['gate_queries_per_sec']} queries/s, "
+          f"{timing['queries']} queries in {timing['wall_s']}s)")
+
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "timing": timing, "variants": summaries,
+                   "stop_first_cascade": cascade_stats}, f, indent=2)
+    print(f"Saved {output_path}")
+
+
+if __name__ == "__main__":
+    main()
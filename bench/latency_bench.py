@@ -0,0 +1,307 @@
+"""
+Repeated-measurement latency benchmark: cold vs warm, bootstrap CIs.
+
+run.py times every (query, variant) once, so latency_speedup in
+metrics.compare_variants mixes one-off costs (LLM model load, page faults
+on the memory-mapped index) into an average over a handful of queries.
+This harness runs, in one fresh process:
+
+  cold round     every query once; reported on its own (the first LLM
+                 call pays model load)
+  warmup rounds  run and discarded
+  repetitions    every query N more times; the warm numbers
+
+Within each (round, query) the variants run in a freshly shuffled order,
+so drift (background load, thermal throttling, server-side state) is
+spread over all variants instead of landing on whichever runs last.
+
+Speedup and token/call reductions vs baseline_naive get percentile
+bootstrap confidence intervals from resampling queries (paired: each
+resample uses the same queries for both variants; warm values are
+per-query means over the repetitions). The Ollama generation cache is
+off unless --llm-cache is given, otherwise repetitions are cache hits.
+
+Usage:
+  PYTHONPATH=. python3 bench/latency_bench.py --warmup 2 --repeats 10
+  PYTHONPATH=. python3 bench/latency_bench.py --backend fake --repeats 20
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from bench.retrieval import load_or_build_retriever
+from bench.run import (
+    add_backend_args, add_retrieval_args, backend_from_args, context_from_args, load_queries,
+    make_variants,
+)
+
+
+CORPUS_PATH = "corpus/corpus.jsonl"
+INDEX_PATH = "index/bm25"
+REFERENCE = "baseline_naive"
+
+# per-sample measurements kept for every (round, query, variant)
+SAMPLE_FIELDS = ("total_latency_ms", "gen_latency_ms", "llm_called", "prompt_tokens", "gen_tokens")
+
+
+def _cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
+
+
+def _memory_bytes() -> Optional[int]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def environment_metadata(backend_name: str) -> Dict[str, Any]:
+    """Machine / software description stored next to the numbers."""
+    env = {
+        "timestamp_utc": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": f"{platform.python_implementation()} {platform.python_version()}",
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "memory_bytes": _memory_bytes(),
+        "numpy": np.__version__,
+        "perf_counter_resolution_s": time.get_clock_info("perf_counter").resolution,
+        "git_commit": _git_commit(),
+        "backend": backend_name,
+    }
+    if backend_name == "ollama":
+        from bench.llm_ollama import GEN_OPTIONS, MODEL_NAME
+        env["model"] = MODEL_NAME
+        env["gen_options"] = GEN_OPTIONS
+    return env
+
+
+def run_round(
+    variants,
+    query_texts: List[str],
+    rng: np.random.Generator,
+    order: Optional[List[Tuple[int, str]]] = None,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Run every query once through every variant (shuffled variant order per
+    query; each variant retrieves for itself). Returns
+    {variant: {field: array over queries}}; order, if given, is extended
+    with the (query index, variant) pairs in execution order.
+    """
+    out = {
+        rag.name: {f: np.zeros(len(query_texts)) for f in SAMPLE_FIELDS}
+        for rag in variants
+    }
+    for qi, query in enumerate(query_texts):
+        for vi in rng.permutation(len(variants)):
+            rag = variants[vi]
+            row = rag.run(query)
+            if order is not None:
+                order.append((qi, rag.name))
+            for f in SAMPLE_FIELDS:
+                out[rag.name][f][qi] = getattr(row, f)
+    return out
+
+
+def stack_rounds(rounds: List[Dict[str, Dict[str, np.ndarray]]]) -> Dict[str, Dict[str, np.ndarray]]:
+    """{variant: {field: (n_rounds, n_queries) array}}."""
+    return {
+        v: {f: np.stack([r[v][f] for r in rounds]) for f in SAMPLE_FIELDS}
+        for v in rounds[0]
+    }
+
+
+def bootstrap_ci(
+    stat: Callable[[np.ndarray], np.ndarray],
+    n_items: int,
+    n_resamples: int = 2000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Percentile bootstrap interval. stat maps an (n_resamples, n_items)
+    array of resampled item indices to one value per resample; undefined
+    (non-finite) resamples, e.g. a zero denominator, are dropped.
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n_items, size=(n_resamples, n_items))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vals = stat(idx)
+    vals = vals[np.isfinite(vals)]
+    if len(vals) == 0:
+        return None, None
+    alpha = (1 - confidence) / 2
+    lo, hi = np.quantile(vals, [alpha, 1 - alpha])
+    return round(float(lo), 4), round(float(hi), 4)
+
+
+def _ratio(num: np.ndarray, den: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+    return lambda idx: num[idx].sum(axis=1) / den[idx].sum(axis=1)
+
+
+def _estimate(num: np.ndarray, den: np.ndarray, reduction: bool, args) -> Dict[str, Any]:
+    """num.sum()/den.sum() (or 1 - that for reductions) with its bootstrap CI."""
+    point = None
+    if den.sum() > 0:
+        point = float(num.sum() / den.sum())
+    lo, hi = bootstrap_ci(_ratio(num, den), len(num), args.bootstrap, args.confidence, args.seed)
+    if reduction:
+        point = None if point is None else 1 - point
+        lo, hi = (None, None) if lo is None else (1 - hi, 1 - lo)
+    return {
+        "estimate": None if point is None else round(point, 4),
+        "ci": [None if lo is None else round(lo, 4), None if hi is None else round(hi, 4)],
+    }
+
+
+def compare_to_reference(per_query: Dict[str, Dict[str, np.ndarray]], args) -> Dict[str, Any]:
+    """
+    per_query: {variant: {field: array over queries}} (means over rounds).
+    Speedup = ratio of mean total latency (reference / variant); reductions
+    = 1 - variant total / reference total.
+    """
+    ref = per_query[REFERENCE]
+    out = {}
+    for v, cols in per_query.items():
+        if v == REFERENCE:
+            continue
+        out[v] = {
+            "latency_speedup": _estimate(ref["total_latency_ms"], cols["total_latency_ms"], False, args),
+            "llm_call_reduction": _estimate(cols["llm_called"], ref["llm_called"], True, args),
+            "prompt_token_reduction": _estimate(cols["prompt_tokens"], ref["prompt_tokens"], True, args),
+            "gen_token_reduction": _estimate(cols["gen_tokens"], ref["gen_tokens"], True, args),
+        }
+    return out
+
+
+def latency_stats(lat: np.ndarray) -> Dict[str, Any]:
+    lat = lat.ravel()
+    p50, p90, p99 = np.percentile(lat, [50, 90, 99])
+    return {
+        "n": int(lat.size),
+        "mean_ms": round(float(lat.mean()), 4),
+        "std_ms": round(float(lat.std(ddof=1)), 4) if lat.size > 1 else None,
+        "p50_ms": round(float(p50), 4),
+        "p90_ms": round(float(p90), 4),
+        "p99_ms": round(float(p99), 4),
+        "min_ms": round(float(lat.min()), 4),
+        "max_ms": round(float(lat.max()), 4),
+    }
+
+
+def summarize_phase(samples: Dict[str, Dict[str, np.ndarray]], args) -> Dict[str, Any]:
+    """samples: {variant: {field: (n_rounds, n_queries)}} of one phase."""
+    per_query = {v: {f: a.mean(axis=0) for f, a in cols.items()} for v, cols in samples.items()}
+    return {
+        "rounds": int(next(iter(samples.values()))["total_latency_ms"].shape[0]),
+        "variants": {
+            v: {
+                "total_latency": latency_stats(cols["total_latency_ms"]),
+                "llm_calls_per_round": round(float(cols["llm_called"].sum(axis=1).mean()), 3),
+            }
+            for v, cols in samples.items()
+        },
+        f"vs_{REFERENCE}": compare_to_reference(per_query, args),
+    }
+
+
+def first_llm_call(cold: Dict[str, Dict[str, np.ndarray]], order: List[Tuple[int, str]]) -> Optional[Dict[str, Any]]:
+    """The first generation of the process (pays model load, if any)."""
+    for qi, v in order:
+        if cold[v]["llm_called"][qi]:
+            return {"variant": v, "query_index": qi,
+                    "gen_latency_ms": round(float(cold[v]["gen_latency_ms"][qi]), 4)}
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Repeated-measurement latency benchmark")
+    parser.add_argument("--queries", default="datasets/test_queries.json")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="discarded rounds after the cold round")
+    parser.add_argument("--repeats", type=int, default=5, help="measured warm rounds")
+    parser.add_argument("--bootstrap", type=int, default=2000, help="bootstrap resamples")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0, help="variant order and bootstrap seed")
+    parser.add_argument("--output", default="results/latency_bench.json")
+    add_backend_args(parser)
+    add_retrieval_args(parser)
+    args = parser.parse_args()
+
+    retriever = load_or_build_retriever(CORPUS_PATH, INDEX_PATH)
+    retriever.prune = args.prune_retrieval
+    context = context_from_args(args, retriever)
+    llm_generate_fn = backend_from_args(args, context)
+    variants = make_variants(retriever, llm_generate_fn, context)
+    query_texts = [q["question"] for q in load_queries(args.queries)]
+    rng = np.random.default_rng(args.seed)
+
+    # cold: first contact of this process with the LLM, index pages and caches
+    cold_order: List[Tuple[int, str]] = []
+    cold = run_round(variants, query_texts, rng, cold_order)
+
+    for _ in range(args.warmup):
+        run_round(variants, query_texts, rng)
+    warm = stack_rounds([run_round(variants, query_texts, rng) for _ in range(args.repeats)])
+
+    cold_stacked = stack_rounds([cold])
+    out = {
+        "environment": environment_metadata(llm_generate_fn.name),
+        "config": vars(args),
+        "n_queries": len(query_texts),
+        "cold": {
+            **summarize_phase(cold_stacked, args),
+            "first_llm_call": first_llm_call(cold, cold_order),
+        },
+        "warm": summarize_phase(warm, args),
+    }
+
+    for phase in ("cold", "warm"):
+        s = out[phase]
+        print(f"\n=== {phase} ({s['rounds']} round(s) x {len(query_texts)} queries) ===")
+        for v, vs in s["variants"].items():
+            lat = vs["total_latency"]
+            print(f"  {v:<26} mean {lat['mean_ms']:>10.3f} ms  p50 {lat['p50_ms']:>10.3f} ms"
+                  f"  p90 {lat['p90_ms']:>10.3f} ms")
+        for v, cmp in s[f"vs_{REFERENCE}"].items():
+            for k, e in cmp.items():
+                print(f"  {v} {k}: {e['estimate']} "
+                      f"({args.confidence:.0%} CI {e['ci'][0]} .. {e['ci'][1]})")
+    if out["cold"]["first_llm_call"]:
+        print(f"\nFirst LLM call: {out['cold']['first_llm_call']}")
+
+    path = Path(args.output)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(out, f, indent=2)
+    print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Pluggable LLM backends.
+
+Every backend implements LLMBackend and is callable as
+llm_generate_fn(query, retrieval), so it drops into the RAG variants.
+
+- OllamaBackend: real model via bench.llm_ollama
+- MockBackend:   fixed, instant output (previous run.py mock)
+- FakeBackend:   simulated model with a latency model (time-to-first-token,
+                 per-token decode, queueing on a fixed number of slots,
+                 jitter) for load-testing gates/schedulers without a model
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, Iterator, List, Optional, Protocol, Tuple
+
+from bench.llm_cache import GenerationCache
+from bench.prompt import ContextBuilder, build_prompt, estimate_tokens
+from bench.timing import ns_to_ms
+from bench.tracing import TRACER
+
+
+# A streamed chunk, shaped like ollama.generate(stream=True) chunks:
+#   {"response": str, "done": bool}; the final chunk (done=True) also
+#   carries prompt_eval_count / eval_count.
+StreamChunk = Dict[str, Any]
+
+
+class LLMBackend(Protocol):
+    name: str
+
+    def generate(self, query: str, retrieval) -> Dict[str, Any]:
+        """-> {"prompt_tokens", "gen_tokens", "latency_ms", ...}"""
+        ...
+
+    def batch_generate(self, requests: List[Tuple[str, Any]]) -> List[Dict[str, Any]]:
+        """requests: [(query, retrieval), ...] -> one generate() dict each."""
+        ...
+
+    def stream(self, query: str, retrieval) -> Iterator[StreamChunk]:
+        ...
+
+    async def agenerate(self, query: str, retrieval) -> Dict[str, Any]:
+        ...
+
+    def __call__(self, query: str, retrieval) -> Dict[str, Any]:
+        ...
+
+
+class _BaseBackend:
+    name = "base"
+
+    def batch_generate(self, requests: List[Tuple[str, Any]]) -> List[Dict[str, Any]]:
+        return [self.generate(q, r) for q, r in requests]
+
+    async def agenerate(self, query: str, retrieval) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.generate, query, retrieval)
+
+    def __call__(self, query: str, retrieval) -> Dict[str, Any]:
+        with TRACER.span("llm.generate", "llm", backend=self.name) as span:
+            out = self.generate(query, retrieval)
+            span.set(prompt_tokens=out.get("prompt_tokens"), gen_tokens=out.get("gen_tokens"))
+        return out
+
+
+class MockBackend(_BaseBackend):
+    """Deterministic + cheap; returns immediately."""
+
+    name = "mock"
+
+    def __init__(self, prompt_tokens: int = 120, gen_tokens: int = 180, latency_ms: float = 60.0):
+        self.prompt_tokens = prompt_tokens
+        self.gen_tokens = gen_tokens
+        self.latency_ms = latency_ms
+
+    def generate(self, query: str, retrieval) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "gen_tokens": self.gen_tokens,
+            "latency_ms": self.latency_ms,
+        }
+
+    async def agenerate(self, query: str, retrieval) -> Dict[str, Any]:
+        return self.generate(query, retrieval)
+
+    def stream(self, query: str, retrieval) -> Iterator[StreamChunk]:
+        for _ in range(self.gen_tokens):
+            yield {"response": " tok", "done": False}
+        yield {
+            "response": "",
+            "done": True,
+            "prompt_eval_count": self.prompt_tokens,
+            "eval_count": self.gen_tokens,
+        }
+
+
+class OllamaBackend(_BaseBackend):
+    """Ollama (bench.llm_ollama); ollama is imported on construction."""
+
+    name = "ollama"
+
+    def __init__(
+        self,
+        cache: Optional[GenerationCache] = None,
+        context: Optional[ContextBuilder] = None,
+    ):
+        """context: builds prompts from real doc text (else doc id placeholders)."""
+        import ollama
+        from bench import llm_ollama
+
+        self._ollama = ollama
+        self._llm = llm_ollama
+        self.cache = cache
+        self.context = context
+        self._async_client = None
+
+    def generate(self, query: str, retrieval) -> Dict[str, Any]:
+        return self._llm.ollama_generate(
+            query, retrieval, cache=self.cache, context=self.context
+        )
+
+    async def agenerate(self, query: str, retrieval) -> Dict[str, Any]:
+        if self._async_client is None:
+            self._async_client = self._ollama.AsyncClient()
+        with TRACER.span("llm.agenerate", "llm", backend=self.name):
+            return await self._llm.ollama_agenerate(
+                query, retrieval, cache=self.cache, client=self._async_client,
+                context=self.context,
+            )
+
+    def stream(self, query: str, retrieval) -> Iterator[StreamChunk]:
+        yield from self._ollama.generate(
+            model=self._llm.MODEL_NAME,
+            prompt=build_prompt(query, retrieval, self.context),
+            options=self._llm.GEN_OPTIONS,
+            stream=True,
+        )
+
+
+class FakeBackend(_BaseBackend):
+    """
+    Simulated LLM server for load tests.
+
+    Latency model per request:
+      ttft    = ttft_base_ms + prefill_ms_per_token * prompt_tokens
+      decode  = decode_ms_per_token * gen_tokens
+      service = (ttft + decode) * jitter,  jitter ~ lognormal(0, jitter_sigma)
+    At most `slots` requests are served at once; the rest queue (FIFO-ish),
+    so reported latency_ms = queue wait + service.
+
+    prompt_tokens is estimated from the prompt text (real passages when a
+    ContextBuilder is given, else doc id placeholders); gen_tokens is
+    drawn uniformly from gen_tokens_range. time_scale shrinks real sleeping
+    (0.01 -> 100x faster wall clock) while latency_ms still reports
+    unscaled model time; time_scale=0 never sleeps.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        ttft_base_ms: float = 200.0,
+        prefill_ms_per_token: float = 2.0,
+        decode_ms_per_token: float = 50.0,
+        gen_tokens_range: Tuple[int, int] = (32, 128),
+        jitter_sigma: float = 0.1,
+        slots: int = 1,
+        time_scale: float = 1.0,
+        seed: Optional[int] = 0,
+        context: Optional[ContextBuilder] = None,
+    ):
+        self.ttft_base_ms = ttft_base_ms
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.decode_ms_per_token = decode_ms_per_token
+        self.gen_tokens_range = gen_tokens_range
+        self.jitter_sigma = jitter_sigma
+        self.slots = slots
+        self.time_scale = time_scale
+        self.context = context
+
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._slots = threading.Semaphore(slots)
+        # created lazily inside the running event loop
+        self._aslots: Optional[asyncio.Semaphore] = None
+
+    def _plan(self, query: str, retrieval) -> Dict[str, Any]:
+        prompt_tokens = estimate_tokens(build_prompt(query, retrieval, self.context))
+        with self._rng_lock:
+            gen_tokens = self._rng.randint(*self.gen_tokens_range)
+            jitter = self._rng.lognormvariate(0.0, self.jitter_sigma) if self.jitter_sigma else 1.0
+        ttft_ms = (self.ttft_base_ms + self.prefill_ms_per_token * prompt_tokens) * jitter
+        per_token_ms = self.decode_ms_per_token * jitter
+        return {
+            "prompt_tokens": prompt_tokens,
+            "gen_tokens": gen_tokens,
+            "ttft_ms": ttft_ms,
+            "per_token_ms": per_token_ms,
+            "service_ms": ttft_ms + per_token_ms * gen_tokens,
+        }
+
+    def _unscaled_ms(self, wall_s: float) -> float:
+        return wall_s * 1000 / self.time_scale if self.time_scale else 0.0
+
+    def _out(self, plan: Dict[str, Any], queued_ms: float) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": plan["prompt_tokens"],
+            "gen_tokens": plan["gen_tokens"],
+            "latency_ms": queued_ms + plan["service_ms"],
+            "queue_ms": queued_ms,
+        }
+
+    def generate(self, query: str, retrieval) -> Dict[str, Any]:
+        plan = self._plan(query, retrieval)
+        t0 = perf_counter_ns()
+        with self._slots:
+            t1 = perf_counter_ns()
+            queued_ms = self._unscaled_ms((t1 - t0) / 1e9)
+            if TRACER.enabled:
+                TRACER.record("llm.queue", t0, t1, "llm", backend=self.name)
+            if self.time_scale:
+                time.sleep(plan["service_ms"] * self.time_scale / 1000)
+        return self._out(plan, queued_ms)
+
+    async def agenerate(self, query: str, retrieval) -> Dict[str, Any]:
+        if self._aslots is None:
+            self._aslots = asyncio.Semaphore(self.slots)
+        plan = self._plan(query, retrieval)
+        t0 = perf_counter_ns()
+        async with self._aslots:
+            t1 = perf_counter_ns()
+            queued_ms = self._unscaled_ms((t1 - t0) / 1e9)
+            if TRACER.enabled:
+                TRACER.record("llm.queue", t0, t1, "llm", backend=self.name)
+            if self.time_scale:
+                await asyncio.sleep(plan["service_ms"] * self.time_scale / 1000)
+        return self._out(plan, queued_ms)
+
+    def stream(self, query: str, retrieval) -> Iterator[StreamChunk]:
+        plan = self._plan(query, retrieval)
+        scale = self.time_scale / 1000
+        with self._slots:
+            if scale:
+                time.sleep(plan["ttft_ms"] * scale)
+            for i in range(plan["gen_tokens"]):
+                if i and scale:
+                    time.sleep(plan["per_token_ms"] * scale)
+                yield {"response": f" tok{i}", "done": False}
+        yield {
+            "response": "",
+            "done": True,
+            "prompt_eval_count": plan["prompt_tokens"],
+            "eval_count": plan["gen_tokens"],
+        }
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in [0, 100]) of an ascending list."""
+    if not sorted_vals:
+        return 0.0
+    rank = max(1, int(-(-q * len(sorted_vals) // 100)))  # ceil
+    return sorted_vals[min(rank, len(sorted_vals)) - 1]
+
+
+# Early-abort hook: called after every streamed token with
+# (text so far, tokens so far); returning True cancels the generation.
+AbortHook = Callable[[str, int], bool]
+
+
+def stream_generate(
+    backend: LLMBackend,
+    query: str,
+    retrieval,
+    abort_hook: Optional[AbortHook] = None,
+) -> Dict[str, Any]:
+    """
+    Run backend.stream() and measure it on the wall clock.
+
+    Returns the generate() dict plus:
+      ttft_ms          time to first token
+      itl_p50_ms / itl_p90_ms / itl_p99_ms   inter-token latency percentiles
+      tokens_per_sec   decode rate after the first token
+      aborted          True if abort_hook cancelled the stream
+    """
+    start = perf_counter_ns()
+    chunks = backend.stream(query, retrieval)
+
+    pieces: List[str] = []
+    token_times: List[int] = []
+    final: Dict[str, Any] = {}
+    aborted = False
+    try:
+        for chunk in chunks:
+            if chunk.get("done"):
+                final = chunk
+                break
+            token_times.append(perf_counter_ns())
+            pieces.append(chunk.get("response", ""))
+            if abort_hook is not None and abort_hook("".join(pieces), len(pieces)):
+                aborted = True
+                break
+    finally:
+        # closes the HTTP stream / frees the backend slot on early exit
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    end = perf_counter_ns()
+
+    n_tokens = len(token_times)
+    if TRACER.enabled and n_tokens:
+        TRACER.record("llm.ttft", start, token_times[0], "llm")
+        TRACER.record("llm.decode", token_times[0], end, "llm", tokens=n_tokens, aborted=aborted)
+    itl = sorted(ns_to_ms(b - a) for a, b in zip(token_times, token_times[1:]))
+    decode_s = (token_times[-1] - token_times[0]) / 1e9 if n_tokens > 1 else 0.0
+
+    return {
+        "prompt_tokens": final.get("prompt_eval_count", 0),
+        "gen_tokens": final.get("eval_count", n_tokens),
+        "response": "".join(pieces),
+        "latency_ms": ns_to_ms(end - start),
+        "ttft_ms": round(ns_to_ms(token_times[0] - start), 3) if n_tokens else None,
+        "itl_p50_ms": round(_percentile(itl, 50), 3) if itl else None,
+        "itl_p90_ms": round(_percentile(itl, 90), 3) if itl else None,
+        "itl_p99_ms": round(_percentile(itl, 99), 3) if itl else None,
+        "tokens_per_sec": round((n_tokens - 1) / decode_s, 2) if decode_s > 0 else None,
+        "aborted": aborted,
+    }
+
+
+class StreamingGenerate:
+    """
+    llm_generate_fn adapter that streams through stream_generate(), so
+    result rows get TTFT / inter-token metrics; abort_hook lets a verifier
+    cancel mid-stream.
+
+    Streams never read or write the backend's GenerationCache: every call
+    runs the model. cache is forwarded for its stats only (the runners
+    reject --stream with --llm-cache).
+    """
+
+    def __init__(self, backend: LLMBackend, abort_hook: Optional[AbortHook] = None):
+        self.backend = backend
+        self.abort_hook = abort_hook
+        self.cache = getattr(backend, "cache", None)
+
+    def __call__(self, query: str, retrieval) -> Dict[str, Any]:
+        return stream_generate(self.backend, query, retrieval, self.abort_hook)
+
+
+BACKENDS = ("ollama", "mock", "fake")
+
+
+def make_backend(name: str, **kwargs) -> LLMBackend:
+    """Backend by name; kwargs go to the backend constructor."""
+    if name == "ollama":
+        return OllamaBackend(**kwargs)
+    if name == "mock":
+        return MockBackend(**kwargs)
+    if name == "fake":
+        return FakeBackend(**kwargs)
+    raise ValueError(f"Unknown LLM backend {name!r}; choose from {BACKENDS}")
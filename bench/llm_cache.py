@@ -0,0 +1,165 @@
+"""
+Content-addressed cache for deterministic LLM generations.
+
+Generation runs with temperature 0, so (model, prompt, options) fully
+determines the output. Entries are kept in an in-memory LRU backed by a
+SQLite file, so re-running the benchmark only pays for new prompts.
+
+Entries keep the latency of the generation that produced them. A hit
+reports that latency (and the lookup time as cache_lookup_ms), so cached
+rows cost what the model did rather than a dictionary lookup.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+DEFAULT_CACHE_PATH = Path("results/llm_cache.sqlite")
+
+
+def replayed_ms(llm_out: Dict[str, Any]) -> float:
+    """
+    Generation time a cache hit stood in for (latency_ms minus the lookup),
+    0.0 for anything else. Added to a row's wall-clock total_latency_ms so
+    hits do not make a variant look faster.
+    """
+    if not llm_out.get("cache_hit"):
+        return 0.0
+    return llm_out["latency_ms"] - llm_out.get("cache_lookup_ms", 0.0)
+
+
+class GenerationCache:
+    """
+    LRU (memory) + SQLite (disk) generation cache.
+
+    - key: sha256 over canonical JSON of (model, prompt, options)
+    - memory: at most max_memory_entries, least recently used evicted
+    - disk: at most max_disk_bytes of stored values, least recently used
+      rows evicted on insert
+    - hits / misses counted per instance
+    """
+
+    def __init__(
+        self,
+        path: Optional[str | Path] = DEFAULT_CACHE_PATH,
+        max_memory_entries: int = 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+    ):
+        """path=None keeps the cache in memory only."""
+        self.path = Path(path) if path is not None else None
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+
+        self._mem: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, prompt: str, options: Dict[str, Any]) -> str:
+        payload = json.dumps([model, prompt, options], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if self.path is None:
+            return None
+        # sqlite connections must not cross fork(); reopen per process
+        if self._db is None or self._db_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), timeout=30)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS generations_lru ON generations(last_access)"
+            )
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _remember(self, key: str, value: Dict[str, Any]) -> None:
+        self._mem[key] = value
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_memory_entries:
+            self._mem.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._mem.get(key)
+        if value is not None:
+            self._mem.move_to_end(key)
+            self.hits += 1
+            return value
+
+        db = self._conn()
+        if db is not None:
+            row = db.execute("SELECT value FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE generations SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+                db.commit()
+                value = json.loads(row[0])
+                self._remember(key, value)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        self._remember(key, value)
+
+        db = self._conn()
+        if db is None:
+            return
+        blob = json.dumps(value)
+        db.execute(
+            "INSERT OR REPLACE INTO generations (key, value, size, last_access)"
+            " VALUES (?, ?, ?, ?)",
+            (key, blob, len(blob), time.time()),
+        )
+        self._evict(db)
+        db.commit()
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()
+        if total <= self.max_disk_bytes:
+            return
+        excess = total - self.max_disk_bytes
+        freed = 0
+        victims = []
+        for key, size in db.execute("SELECT key, size FROM generations ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        db.executemany("DELETE FROM generations WHERE key = ?", victims)
+        for (key,) in victims:
+            self._mem.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._mem),
+        }
+
+    def close(self) -> None:
+        if self._db is not None and self._db_pid == os.getpid():
+            self._db.close()
+        self._db = None
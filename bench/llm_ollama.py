@@ -3,7 +3,12 @@ Ollama LLM integration for benchmarking.
 
 Optimized for CPU-only environments.
 """
-import time
+from time import perf_counter_ns
+from typing import Optional
+
+from bench.llm_cache import GenerationCache
+from bench.prompt import ContextBuilder, build_prompt
+from bench.timing import elapsed_ms
 
 try:
     import ollama
@@ -14,52 +19,108 @@ except ImportError:
 
 # Optimized for CPU-only laptop environments
 MODEL_NAME = "phi3:mini"
+GEN_OPTIONS = {
+    "temperature": 0,      # deterministic
+    "num_predict": 128,    # shorter responses for CPU
+}
 
 
-def ollama_generate(query: str, retrieval) -> dict:
+def _lookup(cache: Optional[GenerationCache], prompt: str, start: int):
+    """
+    Returns (cache key, hit result or None). A hit keeps the stored
+    generation latency_ms; the lookup itself is cache_lookup_ms.
+    """
+    if cache is None:
+        return None, None
+    key = GenerationCache.make_key(MODEL_NAME, prompt, GEN_OPTIONS)
+    cached = cache.get(key)
+    if cached is None or "latency_ms" not in cached:
+        # entries written before latencies were stored are regenerated
+        return key, None
+    return key, {
+        **cached,
+        "cache_lookup_ms": elapsed_ms(start),
+        "cache_hit": True,
+    }
+
+
+def _finish(response, cache: Optional[GenerationCache], key, start: int) -> dict:
+    latency_ms = elapsed_ms(start)
+
+    out = {
+        "prompt_tokens": response.get("prompt_eval_count", 0),
+        "gen_tokens": response.get("eval_count", 0),
+        "response": response.get("response", ""),
+    }
+    result = {**out, "latency_ms": latency_ms}
+    if cache is not None:
+        cache.put(key, result)
+        result = {**result, "cache_hit": False}
+    return result
+
+
+def ollama_generate(
+    query: str,
+    retrieval,
+    cache: Optional[GenerationCache] = None,
+    context: Optional[ContextBuilder] = None,
+) -> dict:
     """
     Generate answer using Ollama.
 
     Args:
         query: User question
         retrieval: RetrievalResult object with retrieved_doc_ids
+        cache: optional GenerationCache; generation is deterministic, so a
+            hit returns the stored output without calling the model
+        context: optional ContextBuilder; packs real doc text into the
+            prompt under its token budget (else doc id placeholders)
 
     Returns:
-        dict with prompt_tokens, gen_tokens, latency_ms
+        dict with prompt_tokens, gen_tokens, latency_ms, cache_hit
+        (on a hit, latency_ms is the original generation's and
+        cache_lookup_ms the lookup time)
     """
-    # Extract doc text from corpus (simplified for benchmark)
-    # In real implementation, would fetch full doc text
-    retrieved_docs = retrieval.retrieved_doc_ids[:3]  # top 3
+    prompt = build_prompt(query, retrieval, context)
 
-    # Build context from doc IDs (placeholder)
-    context = "\n".join([f"Document: {doc_id}" for doc_id in retrieved_docs])
+    start = perf_counter_ns()
+    key, hit = _lookup(cache, prompt, start)
+    if hit is not None:
+        return hit
 
-    prompt = f"""Context:
-{context}
+    response = ollama.generate(
+        model=MODEL_NAME,
+        prompt=prompt,
+        options=GEN_OPTIONS,
+    )
+    return _finish(response, cache, key, start)
 
-Question:
-{query}
 
-Answer:"""
+async def ollama_agenerate(
+    query: str,
+    retrieval,
+    cache: Optional[GenerationCache] = None,
+    client: Optional["ollama.AsyncClient"] = None,
+    context: Optional[ContextBuilder] = None,
+) -> dict:
+    """
+    Async ollama_generate on ollama.AsyncClient; same return dict.
+    Pass a shared client to reuse its HTTP connection pool.
+    """
+    prompt = build_prompt(query, retrieval, context)
 
-    start = time.perf_counter()
+    start = perf_counter_ns()
+    key, hit = _lookup(cache, prompt, start)
+    if hit is not None:
+        return hit
 
-    response = ollama.generate(
+    client = client or ollama.AsyncClient()
+    response = await client.generate(
         model=MODEL_NAME,
         prompt=prompt,
-        options={
-            "temperature": 0,      # deterministic
-            "num_predict": 128,    # shorter responses for CPU
-        }
+        options=GEN_OPTIONS,
     )
-
-    latency_ms = int((time.perf_counter() - start) * 1000)
-
-    return {
-        "prompt_tokens": response.get("prompt_eval_count", 0),
-        "gen_tokens": response.get("eval_count", 0),
-        "latency_ms": latency_ms
-    }
+    return _finish(response, cache, key, start)
 
 
 def check_model_available():
@@ -94,5 +155,5 @@ if __name__ == "__main__":
         print("\nTesting generation...")
         result = ollama_generate("What is the return policy?", MockRetrieval())
         print(f"✓ Generation successful")
-        print(f"  Latency: {result['latency_ms']}ms")
+        print(f"  Latency: {result['latency_ms']:.1f}ms")
         print(f"  Tokens: {result['gen_tokens']}")
@@ -1,53 +1,245 @@
 import json
-from collections import defaultdict, Counter
+import sys
+from collections import Counter
 from pathlib import Path
-from statistics import mean
+from typing import Dict
+
+import numpy as np
+
+from bench.results_store import iter_column_chunks, read_columns, rows_to_columns
+from bench.sketch import DDSketch
 
 
 RESULT_PATH = Path("results/run_results.jsonl")
 
+# only these columns are read (projected) from the results
+METRIC_COLUMNS = [
+    "variant",
+    "llm_called",
+    "prompt_tokens",
+    "gen_tokens",
+    "est_prompt_tokens",
+    "total_latency_ms",
+    "gate_latency_ms",
+    "gen_latency_ms",
+    "retrieval.retrieval_latency_ms",
+    "ttft_ms",
+    "tokens_per_sec",
+    "gen_aborted",
+    "llm_cache_hit",
+    "stop_reason",
+] + [f"retrieval.{s}" for s in ("tokenize_us", "score_us", "topk_us")] + [
+    "prompt_us",
+    "gate_us",
+    "generate_us",
+    "retrieval.cache_hit",
+    "retrieval.cache_saved_us",
+    "gate_cache_hit",
+    "gate_exit_stage",
+    "retrieval.skipped_scoring",
+    "retrieval.postings_total",
+    "retrieval.postings_skipped",
+]
+
+# per-stage spans (microseconds), averaged over rows that ran the stage
+SPAN_COLUMNS = {
+    "tokenize": "retrieval.tokenize_us",
+    "score": "retrieval.score_us",
+    "topk": "retrieval.topk_us",
+    "prompt": "prompt_us",
+    "gate": "gate_us",
+    "generate": "generate_us",
+}
+
+
+QUANTILES = {"p50": 0.50, "p90": 0.90, "p99": 0.99, "p999": 0.999}
+
 
 def load_results(path: Path):
-    rows = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            rows.append(json.loads(line))
-    return rows
+    """Metric columns of a JSONL file or columnar result directory."""
+    return read_columns(path, METRIC_COLUMNS)
+
+
+class VariantAggregator:
+    """
+    One-pass, constant-memory summary of one variant's rows.
+
+    update() takes a chunk of metric columns; counters and sums are exact,
+    latency percentiles come from mergeable DDSketches, so aggregators of
+    different shards combine with merge().
+    """
+
+    LATENCIES = ("total", "retrieval", "gate", "gen")
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.total = 0
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.gen_tokens = 0
+        self.est_saved = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.gen_aborted = 0
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        self.query_cache_saved_us = 0.0
+        self.gate_cache_hits = 0
+        self.gate_cache_misses = 0
+        self.scoring_skipped = 0
+        # pruned retrieval: postings of the query terms / never read
+        self.postings_total = 0
+        self.postings_skipped = 0
+        self.stop_reasons: Counter = Counter()
+        self.gate_exits: Counter = Counter()
+        # streaming metrics: (sum, count) over rows that have them
+        self.ttft = [0.0, 0]
+        self.tps = [0.0, 0]
+        self.spans = {name: [0.0, 0] for name in SPAN_COLUMNS}
+        self.latency = {name: DDSketch(relative_accuracy) for name in self.LATENCIES}
+
+    def update(self, cols) -> None:
+        called = cols["llm_called"]
+        self.total += len(called)
+        self.llm_calls += int(called.sum())
+        self.prompt_tokens += int(cols["prompt_tokens"].sum())
+        self.gen_tokens += int(cols["gen_tokens"].sum())
 
+        # estimated prompt cost of queries the gate stopped (NaN = not estimated)
+        self.est_saved += int(np.nansum(cols["est_prompt_tokens"][~called]))
 
-def aggregate_by_variant(rows):
-    agg = defaultdict(list)
-    for r in rows:
-        agg[r["variant"]].append(r)
-    return agg
+        # -1 = no cache consulted (stopped, mock LLM, or pre-cache results)
+        self.cache_hits += int((cols["llm_cache_hit"] == 1).sum())
+        self.cache_misses += int((cols["llm_cache_hit"] == 0).sum())
+        self.gen_aborted += int((cols["gen_aborted"] == 1).sum())
 
+        # query cache (retrieval + gate memo); -1 = run without a cache
+        self.query_cache_hits += int((cols["retrieval.cache_hit"] == 1).sum())
+        self.query_cache_misses += int((cols["retrieval.cache_hit"] == 0).sum())
+        self.query_cache_saved_us += float(np.nansum(cols["retrieval.cache_saved_us"]))
+        self.gate_cache_hits += int((cols["gate_cache_hit"] == 1).sum())
+        self.gate_cache_misses += int((cols["gate_cache_hit"] == 0).sum())
+        # queries stopped before scoring (query-only gate or score bound)
+        self.scoring_skipped += int((cols["retrieval.skipped_scoring"] == 1).sum())
+        self.postings_total += int(np.nansum(cols["retrieval.postings_total"]))
+        self.postings_skipped += int(np.nansum(cols["retrieval.postings_skipped"]))
 
-def summarize_variant(rows):
-    total = len(rows)
+        reasons = cols["stop_reason"]
+        names, counts = np.unique(reasons[reasons != ""], return_counts=True)
+        self.stop_reasons.update({str(k): int(n) for k, n in zip(names, counts)})
 
-    llm_calls = sum(1 for r in rows if r["llm_called"])
-    prompt_tokens = sum(r.get("prompt_tokens", 0) for r in rows)
-    gen_tokens = sum(r.get("gen_tokens", 0) for r in rows)
+        # deciding gate-cascade stage ("" = variant without a cascade)
+        stages = cols["gate_exit_stage"]
+        names, counts = np.unique(stages[stages != ""], return_counts=True)
+        self.gate_exits.update({str(k): int(n) for k, n in zip(names, counts)})
 
-    avg_latency = mean(r["total_latency_ms"] for r in rows)
-    avg_gate_latency = mean(r.get("gate_latency_ms", 0) for r in rows)
+        # streaming metrics exist only for generated rows run with --stream
+        # spans: NaN where the stage did not run (or older results)
+        sums = [(self.ttft, "ttft_ms"), (self.tps, "tokens_per_sec")]
+        sums += [(self.spans[name], col) for name, col in SPAN_COLUMNS.items()]
+        for acc, col in sums:
+            vals = cols[col][~np.isnan(cols[col])]
+            acc[0] += float(vals.sum())
+            acc[1] += len(vals)
 
-    stop_reasons = Counter(
-        r["stop_reason"] for r in rows if r.get("stop_reason") is not None
-    )
+        self.latency["total"].add_many(cols["total_latency_ms"])
+        self.latency["retrieval"].add_many(cols["retrieval.retrieval_latency_ms"])
+        self.latency["gate"].add_many(cols["gate_latency_ms"])
+        # generation latency only where the LLM was called
+        self.latency["gen"].add_many(cols["gen_latency_ms"][called])
 
+    def merge(self, other: "VariantAggregator") -> None:
+        for name in ("total", "llm_calls", "prompt_tokens", "gen_tokens", "est_saved",
+                     "cache_hits", "cache_misses", "gen_aborted",
+                     "query_cache_hits", "query_cache_misses", "query_cache_saved_us",
+                     "gate_cache_hits", "gate_cache_misses", "scoring_skipped",
+                     "postings_total", "postings_skipped"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.stop_reasons.update(other.stop_reasons)
+        self.gate_exits.update(other.gate_exits)
+        pairs = [(self.ttft, other.ttft), (self.tps, other.tps)]
+        pairs += [(self.spans[name], other.spans[name]) for name in SPAN_COLUMNS]
+        for mine, theirs in pairs:
+            mine[0] += theirs[0]
+            mine[1] += theirs[1]
+        for name in self.LATENCIES:
+            self.latency[name].merge(other.latency[name])
+
+    def summary(self):
+        def avg(acc, ndigits=2):
+            return round(acc[0] / acc[1], ndigits) if acc[1] else None
+
+        # ms values keep 0.1 us resolution: gates run in microseconds
+        def pct(sketch):
+            return {
+                k: None if sketch.quantile(q) is None else round(sketch.quantile(q), 4)
+                for k, q in QUANTILES.items()
+            }
+
+        def rate(hits, misses):
+            return round(hits / (hits + misses), 4) if hits + misses else None
+
+        total_mean = self.latency["total"].mean or 0.0
+        gate_mean = self.latency["gate"].mean or 0.0
+        return {
+            "total_queries": self.total,
+            "llm_calls": self.llm_calls,
+            "llm_call_rate": self.llm_calls / self.total if self.total else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "gen_tokens": self.gen_tokens,
+            "est_prompt_tokens_saved": self.est_saved,
+            "avg_total_latency_ms": round(total_mean, 4),
+            "avg_gate_latency_ms": round(gate_mean, 4),
+            "latency_percentiles_ms": {
+                name: pct(self.latency[name]) for name in self.LATENCIES
+            },
+            "avg_span_us": {name: avg(acc, 3) for name, acc in self.spans.items()},
+            "avg_ttft_ms": avg(self.ttft),
+            "avg_tokens_per_sec": avg(self.tps),
+            "gen_aborted": self.gen_aborted,
+            "llm_cache_hits": self.cache_hits,
+            "llm_cache_misses": self.cache_misses,
+            "query_cache_hits": self.query_cache_hits,
+            "query_cache_hit_rate": rate(self.query_cache_hits, self.query_cache_misses),
+            "query_cache_saved_us": round(self.query_cache_saved_us, 1),
+            "gate_cache_hit_rate": rate(self.gate_cache_hits, self.gate_cache_misses),
+            "scoring_skipped": self.scoring_skipped,
+            "scoring_skip_rate": round(self.scoring_skipped / self.total, 4) if self.total else 0.0,
+            "postings_skip_rate": (
+                round(self.postings_skipped / self.postings_total, 4) if self.postings_total else None
+            ),
+            "stop_reason_breakdown": dict(self.stop_reasons),
+            "gate_exit_breakdown": dict(self.gate_exits),
+        }
+
+
+def aggregate_results(path: Path) -> Dict[str, VariantAggregator]:
+    """Stream a result file/directory chunk by chunk into per-variant aggregators."""
+    aggs: Dict[str, VariantAggregator] = {}
+    for cols in iter_column_chunks(path, METRIC_COLUMNS):
+        for variant, vcols in aggregate_by_variant(cols).items():
+            aggs.setdefault(variant, VariantAggregator()).update(vcols)
+    return aggs
+
+
+def aggregate_by_variant(cols):
+    """{variant: columns restricted to its rows}, in first-seen order."""
+    variants = cols["variant"]
+    names, first = np.unique(variants, return_index=True)
     return {
-        "total_queries": total,
-        "llm_calls": llm_calls,
-        "llm_call_rate": llm_calls / total,
-        "prompt_tokens": prompt_tokens,
-        "gen_tokens": gen_tokens,
-        "avg_total_latency_ms": round(avg_latency, 2),
-        "avg_gate_latency_ms": round(avg_gate_latency, 2),
-        "stop_reason_breakdown": dict(stop_reasons),
+        str(v): {c: a[variants == v] for c, a in cols.items()}
+        for v in names[np.argsort(first)]
     }
 
 
+def summarize_variant(cols):
+    """cols: metric columns of one variant (or a list of row dicts)."""
+    if isinstance(cols, list):
+        cols = rows_to_columns(cols, METRIC_COLUMNS)
+    agg = VariantAggregator()
+    agg.update(cols)
+    return agg.summary()
+
+
 def compare_variants(summary):
     naive = summary["baseline_naive"]
     stop = summary["stop_first"]
@@ -69,12 +261,19 @@ def compare_variants(summary):
 
 
 def main():
-    rows = load_results(RESULT_PATH)
-    grouped = aggregate_by_variant(rows)
+    # JSONL files and/or columnar result directories (run.py --format
+    # columnar); several paths (e.g. results/shards/*) are merged
+    paths = [Path(p) for p in sys.argv[1:]] or [RESULT_PATH]
+
+    aggs: Dict[str, VariantAggregator] = {}
+    for path in paths:
+        for variant, agg in aggregate_results(path).items():
+            if variant in aggs:
+                aggs[variant].merge(agg)
+            else:
+                aggs[variant] = agg
 
-    summary = {}
-    for variant, rs in grouped.items():
-        summary[variant] = summarize_variant(rs)
+    summary = {variant: agg.summary() for variant, agg in aggs.items()}
 
     comparison = compare_variants(summary)
 
@@ -82,7 +281,13 @@ def main():
     for v, s in summary.items():
         print(f"\n[{v}]")
         for k, val in s.items():
-            print(f"  {k}: {val}")
+            if k == "latency_percentiles_ms":
+                for name, pcts in val.items():
+                    print(f"  {name}_latency_ms: {pcts}")
+            elif k == "avg_span_us":
+                print(f"  {k}: " + ", ".join(f"{n}={v}" for n, v in val.items()))
+            else:
+                print(f"  {k}: {val}")
 
     print("\n=== Stop-First vs Baseline Naive ===")
     for k, v in comparison.items():
@@ -0,0 +1,137 @@
+"""
+Pruned retrieval micro-benchmark: postings skipped vs corpus size.
+
+On synthetic Zipf-distributed corpora, compares per query:
+  - exhaustive: BM25Retriever.retrieve (every posting of every query term)
+  - pruned:     BM25Retriever.retrieve with prune=True (MaxScore), with and
+                without a min_score floor
+  - batched:    BM25Retriever.retrieve_many, exhaustive vs pruned
+
+and reports postings read / skipped / probed per query, latency, and
+whether the pruned top-k matched the exhaustive one (it must). Pruning
+reads fewer postings but is currently slower in wall-clock time than
+exhaustive scoring, per query through retrieve() (which runs the batch
+scorer on a batch of one) and batched; the table reports both slowdowns.
+
+Usage:
+  PYTHONPATH=. python3 bench/microbench_pruning.py --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+from pathlib import Path
+from statistics import median
+
+from bench.microbench_retrieval import make_queries, make_synthetic_corpus, time_us
+from bench.retrieval import BM25Retriever
+from bench.gate_cascade import TAU_STOP
+
+
+def postings_per_query(retriever: BM25Retriever, queries, top_k: int, floor):
+    """Mean postings stats per query of the pruned scorer, plus early stops."""
+    sums = {"postings_total": 0, "postings_scored": 0, "postings_skipped": 0, "postings_probed": 0}
+    early = 0
+    for q in queries:
+        _, _, stats = retriever.index.score_candidates_pruned(retriever._tokenize(q), top_k, floor)
+        for key in sums:
+            sums[key] += stats[key]
+        early += stats["early_stop"]
+    out = {key: round(v / len(queries), 1) for key, v in sums.items()}
+    out["skip_rate"] = round(sums["postings_skipped"] / sums["postings_total"], 4) \
+        if sums["postings_total"] else None
+    out["early_stops"] = early
+    return out
+
+
+def matches_exhaustive(retriever: BM25Retriever, queries, top_k: int, floor) -> int:
+    """Number of queries whose pruned result differs from exhaustive scoring."""
+    mismatches = 0
+    for q in queries:
+        retriever.prune = False
+        full = retriever.retrieve(q, top_k=top_k)
+        retriever.prune = True
+        pruned = retriever.retrieve(q, top_k=top_k, min_score=floor)
+        if pruned.skipped_scoring:
+            ok = floor is not None and full.max_score < floor
+        else:
+            ok = (pruned.retrieved_doc_ids, pruned.retrieved_scores) == \
+                 (full.retrieved_doc_ids, full.retrieved_scores)
+        mismatches += not ok
+    retriever.prune = False
+    return mismatches
+
+
+def bench_size(n_docs: int, args):
+    corpus = make_synthetic_corpus(n_docs, args.vocab_size, args.doc_len)
+    retriever = BM25Retriever(corpus)
+    del corpus
+    queries = make_queries(args.queries, args.vocab_size, args.query_len)
+
+    def exhaustive(q):
+        return retriever.retrieve(q, top_k=args.top_k)
+
+    def pruned(q, floor=None):
+        return retriever.retrieve(q, top_k=args.top_k, min_score=floor)
+
+    # warmup
+    for q in queries[:10]:
+        exhaustive(q)
+
+    row = {"n_docs": n_docs}
+    row["exhaustive_p50_us"] = round(median(time_us(exhaustive, queries)), 1)
+    for label, floor in (("pruned", None), ("pruned_floor", args.floor)):
+        retriever.prune = True
+        lat = time_us(lambda q: pruned(q, floor), queries)
+        retriever.prune = False
+        row[f"{label}_p50_us"] = round(median(lat), 1)
+        row[label] = postings_per_query(retriever, queries, args.top_k, floor)
+        row[label]["mismatches"] = matches_exhaustive(retriever, queries, args.top_k, floor)
+
+    # batched: amortized microseconds per query over retrieve_many
+    for label, prune in (("batch_exhaustive", False), ("batch_pruned", True)):
+        retriever.prune = prune
+        lat = time_us(lambda _: retriever.retrieve_many(queries, top_k=args.top_k), [None] * 5)
+        retriever.prune = False
+        row[f"{label}_us"] = round(min(lat) / len(queries), 1)
+    row["retrieve_slowdown"] = round(row["pruned_p50_us"] / row["exhaustive_p50_us"], 2)
+    row["batch_slowdown"] = round(row["batch_pruned_us"] / row["batch_exhaustive_us"], 2)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--floor", type=float, default=TAU_STOP,
+                        help="min_score floor for the pruned_floor run (default: TAU_STOP)")
+    parser.add_argument("--vocab-size", type=int, default=50000)
+    parser.add_argument("--doc-len", type=int, default=50)
+    parser.add_argument("--query-len", type=int, default=4)
+    parser.add_argument("--output", default="results/microbench_pruning.json")
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'n_docs':>10} {'postings/q':>11} {'skipped':>8} {'skip%':>6} "
+          f"{'exhaustive p50':>15} {'pruned p50':>11} {'+floor p50':>11} "
+          f"{'batch exh.':>11} {'batch pruned':>13} {'slowdown (q / batch)':>22} {'mismatch':>9}")
+    print("-" * 139)
+    for n in args.sizes:
+        r = bench_size(n, args)
+        rows.append(r)
+        p = r["pruned"]
+        print(f"{r['n_docs']:>10} {p['postings_total']:>11.1f} {p['postings_skipped']:>8.1f} "
+              f"{100 * (p['skip_rate'] or 0):>5.1f}% {r['exhaustive_p50_us']:>13.1f}us "
+              f"{r['pruned_p50_us']:>9.1f}us {r['pruned_floor_p50_us']:>9.1f}us "
+              f"{r['batch_exhaustive_us']:>9.1f}us {r['batch_pruned_us']:>11.1f}us "
+              f"{r['retrieve_slowdown']:>11.2f}x / {r['batch_slowdown']:>5.2f}x "
+              f"{p['mismatches'] + r['pruned_floor']['mismatches']:>9}")
+
+    out = Path(args.output)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "results": rows}, f, indent=2)
+    print(f"\nSaved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Retrieval micro-benchmark: latency vs corpus size.
+
+Compares, on synthetic Zipf-distributed corpora:
+  - full_sort: dense scores for every doc + full argsort (previous top-k)
+  - partial:   BM25Retriever.retrieve (candidate scoring + partial top-k)
+
+Usage:
+  PYTHONPATH=. python3 bench/microbench_retrieval.py --sizes 1000 10000 100000
+"""
+import argparse
+import json
+from time import perf_counter_ns
+from pathlib import Path
+from statistics import median
+
+import numpy as np
+
+from bench.retrieval import BM25Retriever
+from bench.timing import elapsed_us
+
+
+def make_synthetic_corpus(n_docs: int, vocab_size: int, doc_len: int, seed: int = 0):
+    """Zipf-like term distribution so posting lengths look like real text."""
+    rng = np.random.default_rng(seed)
+    ranks = np.arange(1, vocab_size + 1)
+    p = 1.0 / ranks
+    p /= p.sum()
+    term_ids = rng.choice(vocab_size, size=(n_docs, doc_len), p=p)
+    return [
+        {"doc_id": f"doc_{i:07d}", "text": " ".join(f"t{t}" for t in row)}
+        for i, row in enumerate(term_ids)
+    ]
+
+
+def make_queries(n_queries: int, vocab_size: int, q_len: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    # mid-frequency terms: neither stopwords nor hapaxes
+    term_ids = rng.integers(10, min(vocab_size, 5000), size=(n_queries, q_len))
+    return [" ".join(f"t{t}" for t in row) for row in term_ids]
+
+
+def time_us(fn, queries):
+    lat = []
+    for q in queries:
+        t0 = perf_counter_ns()
+        fn(q)
+        lat.append(elapsed_us(t0))
+    return lat
+
+
+def bench_size(n_docs: int, args):
+    corpus = make_synthetic_corpus(n_docs, args.vocab_size, args.doc_len)
+    retriever = BM25Retriever(corpus)
+    queries = make_queries(args.queries, args.vocab_size, args.query_len)
+
+    def full_sort(q):
+        scores = retriever.index.get_scores(retriever._tokenize(q))
+        return scores.argsort()[::-1][:args.top_k]
+
+    def partial(q):
+        return retriever.retrieve(q, top_k=args.top_k)
+
+    # warmup
+    for q in queries[:10]:
+        full_sort(q)
+        partial(q)
+
+    full = time_us(full_sort, queries)
+    part = time_us(partial, queries)
+    return {
+        "n_docs": n_docs,
+        "full_sort_p50_us": round(median(full), 1),
+        "partial_p50_us": round(median(part), 1),
+        "full_sort_mean_us": round(float(np.mean(full)), 1),
+        "partial_mean_us": round(float(np.mean(part)), 1),
+        "speedup_p50": round(median(full) / median(part), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--vocab-size", type=int, default=50000)
+    parser.add_argument("--doc-len", type=int, default=50)
+    parser.add_argument("--query-len", type=int, default=4)
+    parser.add_argument("--output", default="results/microbench_retrieval.json")
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'n_docs':>10} {'full_sort p50':>14} {'partial p50':>12} {'speedup':>8}")
+    print("-" * 48)
+    for n in args.sizes:
+        r = bench_size(n, args)
+        rows.append(r)
+        print(f"{r['n_docs']:>10} {r['full_sort_p50_us']:>12.1f}us "
+              f"{r['partial_p50_us']:>10.1f}us {r['speedup_p50']:>7.2f}x")
+
+    out = Path(args.output)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "results": rows}, f, indent=2)
+    print(f"\nSaved {out}")
+
+
+if __name__ == "__main__":
+    main()
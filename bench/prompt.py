@@ -0,0 +1,167 @@
+"""
+Prompt construction shared by all LLM backends.
+
+ContextBuilder packs the real text of the top retrieved passages (looked
+up by doc_id, e.g. BM25Retriever.get_text -> DocStore offset seek) into
+the prompt under a token budget. Passages go in score order; the first
+one that does not fit is truncated, lower-scored ones are dropped.
+"""
+from __future__ import annotations
+
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Tuple
+
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+PROMPT_TEMPLATE = """Context:
+{context}
+
+Question:
+{query}
+
+Answer:"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap prompt-token estimate (no model tokenizer): words and punctuation,
+    scaled by ~1.3 subword pieces per word.
+    """
+    return int(round(len(_WORD_RE.findall(text)) * 1.3))
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest word-aligned prefix of text whose estimate is <= max_tokens."""
+    max_words = int(max_tokens / 1.3)
+    if max_words <= 0:
+        return ""
+    for i, m in enumerate(_WORD_RE.finditer(text)):
+        if i + 1 == max_words:
+            return text[:m.end()]
+    return text
+
+
+@dataclass
+class PackedContext:
+    prompt: str
+    est_prompt_tokens: int
+    doc_ids: List[str]                      # passages in the prompt, score order
+    truncated_doc_id: Optional[str] = None  # last passage, cut to fit
+    dropped_doc_ids: List[str] = field(default_factory=list)
+
+
+class ContextBuilder:
+    """
+    get_text(doc_id) -> passage text.
+    token_budget bounds the whole prompt (template + query + passages).
+    max_passages: top-k retrieved docs considered.
+    min_passage_tokens: a passage is truncated only if at least this many
+      tokens of it fit; otherwise it (and everything after it) is dropped.
+    text_version: () -> version of the text source (e.g. the index version,
+      bumped when add_documents replaces a doc); packs memoized under an
+      older version are not reused.
+    """
+
+    def __init__(
+        self,
+        get_text: Callable[[str], str],
+        token_budget: int = 512,
+        max_passages: int = 3,
+        min_passage_tokens: int = 16,
+        cache_size: int = 256,
+        text_version: Optional[Callable[[], int]] = None,
+    ):
+        self.get_text = get_text
+        self.token_budget = token_budget
+        self.max_passages = max_passages
+        self.min_passage_tokens = min_passage_tokens
+        self.cache_size = cache_size
+        self.text_version = text_version
+        # the gate's estimate and the LLM call pack the same (query, docs)
+        self._packed: OrderedDict[Tuple[str, Tuple[str, ...], int], PackedContext] = OrderedDict()
+
+    def pack(self, query: str, retrieval) -> PackedContext:
+        doc_ids = tuple(retrieval.retrieved_doc_ids[:self.max_passages])
+        version = self.text_version() if self.text_version is not None else 0
+        key = (query, doc_ids, version)
+        packed = self._packed.get(key)
+        if packed is not None:
+            self._packed.move_to_end(key)
+            return packed
+
+        packed = self._pack(query, doc_ids)
+        self._packed[key] = packed
+        while len(self._packed) > self.cache_size:
+            self._packed.popitem(last=False)
+        return packed
+
+    def _pack(self, query: str, doc_ids: Tuple[str, ...]) -> PackedContext:
+        remaining = self.token_budget - estimate_tokens(
+            PROMPT_TEMPLATE.format(context="", query=query)
+        )
+        passages: List[str] = []
+        packed_ids: List[str] = []
+        truncated = None
+
+        # doc_ids are in descending score order
+        for i, doc_id in enumerate(doc_ids):
+            text = self.get_text(doc_id)
+            n = estimate_tokens(text)
+            if n <= remaining:
+                passages.append(text)
+                packed_ids.append(doc_id)
+                remaining -= n
+                continue
+            if remaining >= self.min_passage_tokens:
+                passages.append(_truncate_to_tokens(text, remaining))
+                packed_ids.append(doc_id)
+                truncated = doc_id
+            dropped = list(doc_ids[i + 1:] if truncated else doc_ids[i:])
+            break
+        else:
+            dropped = []
+
+        prompt = PROMPT_TEMPLATE.format(context="\n\n".join(passages), query=query)
+        est = estimate_tokens(prompt)
+        # pieces are estimated (and rounded) separately, so the whole prompt
+        # can come out a token or two over: shrink the last passage to fit
+        while est > self.token_budget and passages:
+            keep = estimate_tokens(passages[-1]) - (est - self.token_budget)
+            if keep >= self.min_passage_tokens:
+                passages[-1] = _truncate_to_tokens(passages[-1], keep)
+                truncated = packed_ids[-1]
+            else:
+                passages.pop()
+                dropped.insert(0, packed_ids.pop())
+                if truncated == dropped[0]:
+                    truncated = None
+            prompt = PROMPT_TEMPLATE.format(context="\n\n".join(passages), query=query)
+            est = estimate_tokens(prompt)
+
+        return PackedContext(
+            prompt=prompt,
+            est_prompt_tokens=est,
+            doc_ids=packed_ids,
+            truncated_doc_id=truncated,
+            dropped_doc_ids=dropped,
+        )
+
+    def estimate_prompt_tokens(self, query: str, retrieval) -> int:
+        """Prompt cost before calling the LLM (e.g. for a gate)."""
+        return self.pack(query, retrieval).est_prompt_tokens
+
+
+def build_prompt(query: str, retrieval, context: Optional[ContextBuilder] = None) -> str:
+    """
+    context: ContextBuilder with a doc text source. Without one only doc
+    ids are available, so the context lists them as placeholders.
+    """
+    if context is not None:
+        return context.pack(query, retrieval).prompt
+
+    retrieved_docs = retrieval.retrieved_doc_ids[:3]  # top 3
+    placeholder = "\n".join([f"Document: {doc_id}" for doc_id in retrieved_docs])
+    return PROMPT_TEMPLATE.format(context=placeholder, query=query)
@@ -0,0 +1,182 @@
+"""
+Query-result cache for retrieval and gate decisions.
+
+Keyed on the normalized token tuple BM25Retriever._tokenize produces (plus
+top_k), so "What is your return policy?" and "what is your return
+policy" share one entry. Entries are evicted least-recently-used beyond
+max_entries and, with ttl_s, expire after ttl_s seconds. Every lookup
+passes the index version; when it differs from the version the entries
+were computed against (add/delete/merge), the whole cache is dropped.
+
+A cached RetrievalResult carries a per-entry memo of gate decisions, so
+cached_gate() answers repeated (query, gate) pairs without re-running
+the gate.
+"""
+from __future__ import annotations
+
+import dataclasses
+import time
+from collections import OrderedDict
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from bench.retrieval import RetrievalResult
+
+
+CacheKey = Tuple[int, Tuple[str, ...]]
+
+
+class _Entry:
+    __slots__ = ("result", "compute_us", "gates", "expires")
+
+    def __init__(self, result: RetrievalResult, compute_us: float, expires: float):
+        self.result = result
+        self.compute_us = compute_us          # tokenize + score + top-k of the miss
+        self.gates: Dict[Tuple, Tuple[str, Optional[str]]] = {}
+        self.expires = expires
+
+
+class QueryCache:
+    """
+    In-memory LRU (+ optional TTL) of RetrievalResults.
+
+    - key: (top_k, token tuple)
+    - at most max_entries, least recently used evicted
+    - ttl_s=None: entries never expire
+    - hits / misses / saved microseconds counted per instance
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        ttl_s: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.clock = clock
+
+        self._entries: OrderedDict[CacheKey, _Entry] = OrderedDict()
+        self.version: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_us = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, version: int) -> None:
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(
+        self,
+        key: CacheKey,
+        version: int,
+        query: str,
+        t0_ns: int,
+        tokenize_ns: int,
+    ) -> Optional[RetrievalResult]:
+        """
+        Cached result for key as a result for `query`, or None on a miss.
+        t0_ns: perf_counter_ns() when retrieval of `query` started; a hit's
+        retrieval latency is tokenizing plus this lookup.
+        """
+        self._check_version(version)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires < self.clock():
+            del self._entries[key]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        hit_us = (perf_counter_ns() - t0_ns) / 1e3
+        saved_us = max(0.0, entry.compute_us - hit_us)
+        self.saved_us += saved_us
+        result = dataclasses.replace(
+            entry.result,
+            query=query,
+            retrieval_latency_ms=hit_us / 1e3,
+            tokenize_us=tokenize_ns / 1e3,
+            score_us=0.0,
+            topk_us=0.0,
+            cache_hit=True,
+            cache_saved_us=saved_us,
+        )
+        _attach_gate_memo(result, entry.gates)
+        return result
+
+    def put(self, key: CacheKey, version: int, result: RetrievalResult) -> RetrievalResult:
+        """Store a freshly computed result; returns it marked as a miss."""
+        self._check_version(version)
+        result = dataclasses.replace(result, cache_hit=False, cache_saved_us=0.0)
+        expires = self.clock() + self.ttl_s if self.ttl_s is not None else float("inf")
+        entry = _Entry(result, result.retrieval_latency_ms * 1e3, expires)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        _attach_gate_memo(result, entry.gates)
+        return result
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saved_us": round(self.saved_us, 1),
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+        }
+
+
+def _attach_gate_memo(result: RetrievalResult, memo: Dict) -> None:
+    # not a dataclass field: never serialized with the result row
+    object.__setattr__(result, "_gate_memo", memo)
+
+
+def cached_gate(
+    rag,
+    retrieval: RetrievalResult,
+    gate_fn: Optional[Callable[[RetrievalResult], tuple]] = None,
+) -> tuple:
+    """
+    gate_fn(retrieval) (default rag.gate), memoized per cache entry and
+    (variant, gate params, gate_fn). Returns gate_fn's tuple, e.g.
+    (decision, stop_reason), plus gate_cache_hit; gate_cache_hit is None
+    when the retrieval did not come from a QueryCache. On a memo hit,
+    rag.gate_memo_hit(cached tuple) is called if the variant defines it.
+    """
+    gate_fn = gate_fn or rag.gate
+    memo = getattr(retrieval, "_gate_memo", None)
+    if memo is None:
+        return (*gate_fn(retrieval), None)
+    key = (rag.name, rag.gate_params, gate_fn.__name__)
+    cached = memo.get(key)
+    if cached is not None:
+        # let the variant count decisions that skipped its gate
+        on_hit = getattr(rag, "gate_memo_hit", None)
+        if on_hit is not None:
+            on_hit(cached)
+        return (*cached, True)
+    out = gate_fn(retrieval)
+    memo[key] = out
+    return (*out, False)
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
-import time
+from time import perf_counter_ns
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Dict, Any
 
+from bench.llm_cache import replayed_ms
+from bench.prompt import ContextBuilder
+from bench.query_cache import cached_gate
 from bench.retrieval import BM25Retriever, RetrievalResult
+from bench.timing import elapsed_ms, elapsed_us
+from bench.tracing import TRACER
 
 
 @dataclass
@@ -20,14 +25,39 @@ class RAGNaiveResult:
     stop_reason: Optional[str]  # always None
 
     # costs
-    gate_latency_ms: int  # always 0 (no gate)
+    gate_latency_ms: float  # always 0 (no gate)
     llm_called: bool      # always True
     prompt_tokens: int
     gen_tokens: int
-    gen_latency_ms: int
+    gen_latency_ms: float
 
     # aggregate
-    total_latency_ms: int
+    total_latency_ms: float
+
+    # LLM generation cache: True/False if a cache was consulted, else None.
+    # On a hit gen_latency_ms is the original generation's and
+    # total_latency_ms is charged it instead of the lookup time.
+    llm_cache_hit: Optional[bool] = None
+    llm_cache_lookup_ms: Optional[float] = None
+
+    # QueryCache gate memo: True/False if the retrieval was cached, else None
+    gate_cache_hit: Optional[bool] = None
+
+    # prompt cost estimated before generation (None without a ContextBuilder)
+    est_prompt_tokens: Optional[int] = None
+
+    # stage spans in microseconds (perf_counter_ns); None = stage not run
+    prompt_us: Optional[float] = None
+    gate_us: Optional[float] = None
+    generate_us: Optional[float] = None
+
+    # streaming generation metrics (None unless generated with streaming)
+    ttft_ms: Optional[float] = None
+    itl_p50_ms: Optional[float] = None
+    itl_p90_ms: Optional[float] = None
+    itl_p99_ms: Optional[float] = None
+    tokens_per_sec: Optional[float] = None
+    gen_aborted: Optional[bool] = None
 
 
 class RAGBaselineNaive:
@@ -41,51 +71,135 @@ class RAGBaselineNaive:
     This is the "generate-anyway" baseline.
     """
 
+    name = "baseline_naive"
+
     def __init__(
         self,
         retriever: BM25Retriever,
         llm_generate_fn,
+        context: Optional[ContextBuilder] = None,
     ):
         """
         llm_generate_fn(query, retrieval_result) -> dict:
           {
             "prompt_tokens": int,
             "gen_tokens": int,
-            "latency_ms": int
+            "latency_ms": float
           }
+        context: optional ContextBuilder; if given, the packed prompt's
+          token count is estimated before gating and recorded per row
         """
         self.retriever = retriever
         self.llm_generate_fn = llm_generate_fn
+        self.context = context
 
-    def run(self, query: str) -> RAGNaiveResult:
-        t_start = time.perf_counter()
+    def gate(self, r: RetrievalResult) -> tuple[str, Optional[str]]:
+        """No gate: always answer."""
+        return "answer", None
 
-        # --- retrieval ---
-        retrieval = self.retriever.retrieve(query)
+    @property
+    def gate_params(self) -> tuple:
+        """Everything gate() depends on besides the RetrievalResult."""
+        return ()
 
-        # --- no gate (always generate) ---
-        decision = "answer"
-        stop_reason = None
-        llm_called = True
+    @property
+    def score_floor(self) -> Optional[float]:
+        """None: every query is answered, so it needs the scored retrieval."""
+        return None
 
-        llm_out = self.llm_generate_fn(query, retrieval)
-        prompt_tokens = llm_out.get("prompt_tokens", 0)
-        gen_tokens = llm_out.get("gen_tokens", 0)
-        gen_latency_ms = llm_out.get("latency_ms", 0)
+    def run(
+        self,
+        query: str,
+        retrieval: Optional[RetrievalResult] = None,
+    ) -> RAGNaiveResult:
+        """
+        retrieval: precomputed RetrievalResult for `query` (shared across
+        variants); if None, retrieve here. Its retrieval_latency_ms is
+        counted in total_latency_ms either way.
+        """
+        with TRACER.span("run", "variant", variant=self.name):
+            return self._run(query, retrieval)
+
+    def _run(self, query: str, retrieval: Optional[RetrievalResult]) -> RAGNaiveResult:
+        t_start = perf_counter_ns()
 
-        gate_latency_ms = 0  # no gate
-        total_latency_ms = int((time.perf_counter() - t_start) * 1000)
+        # --- retrieval ---
+        shared = retrieval is not None
+        if not shared:
+            with TRACER.span("retrieve", "variant", variant=self.name):
+                retrieval = self.retriever.retrieve(query)
+
+        # --- prompt cost (estimated before any LLM call) ---
+        est_prompt_tokens = None
+        spans: Dict[str, float] = {}
+        if self.context is not None:
+            with TRACER.span("prompt", "variant", variant=self.name):
+                t_prompt = perf_counter_ns()
+                est_prompt_tokens = self.context.estimate_prompt_tokens(query, retrieval)
+                spans["prompt_us"] = elapsed_us(t_prompt)
 
+        # --- no gate (always generate) ---
+        decision, stop_reason, gate_cache_hit = cached_gate(self, retrieval)
+
+        with TRACER.span("generate", "variant", variant=self.name):
+            t_gen = perf_counter_ns()
+            llm_out = self.llm_generate_fn(query, retrieval)
+            spans["generate_us"] = elapsed_us(t_gen)
+
+        gate_latency_ms = 0.0  # no gate
+        total_latency_ms = elapsed_ms(t_start)
+        if shared:
+            total_latency_ms += retrieval.retrieval_latency_ms
+
+        return self.make_result(
+            query, retrieval, decision, stop_reason,
+            gate_latency_ms, llm_out, total_latency_ms,
+            est_prompt_tokens=est_prompt_tokens, spans=spans,
+            gate_cache_hit=gate_cache_hit,
+        )
+
+    def make_result(
+        self,
+        query: str,
+        retrieval: RetrievalResult,
+        decision: str,
+        stop_reason: Optional[str],
+        gate_latency_ms: float,
+        llm_out: Optional[Dict[str, Any]],
+        total_latency_ms: float,
+        est_prompt_tokens: Optional[int] = None,
+        spans: Optional[Dict[str, float]] = None,
+        gate_cache_hit: Optional[bool] = None,
+    ) -> RAGNaiveResult:
+        """
+        Assemble a result row; llm_out is None when the LLM was not called.
+        spans: {"prompt_us" | "gate_us" | "generate_us": float}
+        """
+        out = llm_out or {}
+        spans = spans or {}
         return RAGNaiveResult(
-            variant="baseline_naive",
+            variant=self.name,
             query=query,
             retrieval=retrieval,
             decision=decision,
             stop_reason=stop_reason,
             gate_latency_ms=gate_latency_ms,
-            llm_called=llm_called,
-            prompt_tokens=prompt_tokens,
-            gen_tokens=gen_tokens,
-            gen_latency_ms=gen_latency_ms,
-            total_latency_ms=total_latency_ms,
+            llm_called=llm_out is not None,
+            prompt_tokens=out.get("prompt_tokens", 0),
+            gen_tokens=out.get("gen_tokens", 0),
+            gen_latency_ms=out.get("latency_ms", 0.0),
+            total_latency_ms=total_latency_ms + replayed_ms(out),
+            llm_cache_hit=out.get("cache_hit"),
+            llm_cache_lookup_ms=out.get("cache_lookup_ms"),
+            gate_cache_hit=gate_cache_hit,
+            est_prompt_tokens=est_prompt_tokens,
+            ttft_ms=out.get("ttft_ms"),
+            itl_p50_ms=out.get("itl_p50_ms"),
+            itl_p90_ms=out.get("itl_p90_ms"),
+            itl_p99_ms=out.get("itl_p99_ms"),
+            tokens_per_sec=out.get("tokens_per_sec"),
+            gen_aborted=out.get("aborted"),
+            prompt_us=spans.get("prompt_us"),
+            gate_us=spans.get("gate_us"),
+            generate_us=spans.get("generate_us"),
         )
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
-import time
+from time import perf_counter_ns
 from dataclasses import dataclass
 from typing import Optional, Dict, Any
 
+from bench.llm_cache import replayed_ms
+from bench.prompt import ContextBuilder
+from bench.query_cache import cached_gate
 from bench.retrieval import BM25Retriever, RetrievalResult
+from bench.timing import elapsed_ms, elapsed_us
+from bench.tracing import TRACER
 
 
 @dataclass
@@ -21,14 +26,39 @@ class RAGThresholdResult:
     stop_reason: Optional[str]
 
     # costs
-    gate_latency_ms: int
+    gate_latency_ms: float
     llm_called: bool
     prompt_tokens: int
     gen_tokens: int
-    gen_latency_ms: int
+    gen_latency_ms: float
 
     # aggregate
-    total_latency_ms: int
+    total_latency_ms: float
+
+    # LLM generation cache: True/False if a cache was consulted, else None.
+    # On a hit gen_latency_ms is the original generation's and
+    # total_latency_ms is charged it instead of the lookup time.
+    llm_cache_hit: Optional[bool] = None
+    llm_cache_lookup_ms: Optional[float] = None
+
+    # QueryCache gate memo: True/False if the retrieval was cached, else None
+    gate_cache_hit: Optional[bool] = None
+
+    # prompt cost estimated before generation (None without a ContextBuilder)
+    est_prompt_tokens: Optional[int] = None
+
+    # stage spans in microseconds (perf_counter_ns); None = stage not run
+    prompt_us: Optional[float] = None
+    gate_us: Optional[float] = None
+    generate_us: Optional[float] = None
+
+    # streaming generation metrics (None unless generated with streaming)
+    ttft_ms: Optional[float] = None
+    itl_p50_ms: Optional[float] = None
+    itl_p90_ms: Optional[float] = None
+    itl_p99_ms: Optional[float] = None
+    tokens_per_sec: Optional[float] = None
+    gen_aborted: Optional[bool] = None
 
 
 class RAGBaselineThreshold:
@@ -36,71 +66,160 @@ class RAGBaselineThreshold:
     RAG-B: Retrieval score threshold baseline.
 
     Logic:
-      retrieve(query)
+      retrieve(query)   (not scored if its BM25 upper bound < tau)
       if max_score < tau:
           STOP (no LLM call)
       else:
           CALL LLM
     """
 
+    name = "baseline_score_threshold"
+
     def __init__(
         self,
         retriever: BM25Retriever,
         tau: float,
         llm_generate_fn,
+        context: Optional[ContextBuilder] = None,
     ):
         """
         llm_generate_fn(query, retrieval_result) -> dict:
           {
             "prompt_tokens": int,
             "gen_tokens": int,
-            "latency_ms": int
+            "latency_ms": float
           }
+        context: optional ContextBuilder; if given, the packed prompt's
+          token count is estimated before gating and recorded per row
         """
         self.retriever = retriever
         self.tau = tau
         self.llm_generate_fn = llm_generate_fn
+        self.context = context
+
+    def gate(self, r: RetrievalResult) -> tuple[str, Optional[str]]:
+        """
+        Returns:
+          decision: "stop" | "answer"
+          stop_reason: "score_below_threshold" | None
+        """
+        if r.max_score < self.tau:
+            return "stop", "score_below_threshold"
+        return "answer", None
+
+    @property
+    def gate_params(self) -> tuple:
+        """Everything gate() depends on besides the RetrievalResult."""
+        return (self.tau,)
 
-    def run(self, query: str) -> RAGThresholdResult:
-        t_start = time.perf_counter()
+    @property
+    def score_floor(self) -> Optional[float]:
+        """max_score below which gate() always stops (retrieval may skip scoring)."""
+        return self.tau
+
+    def run(
+        self,
+        query: str,
+        retrieval: Optional[RetrievalResult] = None,
+    ) -> RAGThresholdResult:
+        """
+        retrieval: precomputed RetrievalResult for `query` (shared across
+        variants); if None, retrieve here. Its retrieval_latency_ms is
+        counted in total_latency_ms either way.
+        """
+        with TRACER.span("run", "variant", variant=self.name):
+            return self._run(query, retrieval)
+
+    def _run(self, query: str, retrieval: Optional[RetrievalResult]) -> RAGThresholdResult:
+        t_start = perf_counter_ns()
 
         # --- retrieval ---
-        retrieval = self.retriever.retrieve(query)
+        shared = retrieval is not None
+        if not shared:
+            with TRACER.span("retrieve", "variant", variant=self.name):
+                # bound < tau: gate stops on max_score either way
+                retrieval = self.retriever.retrieve(query, min_score=self.score_floor)
+
+        # --- prompt cost (estimated before any LLM call) ---
+        est_prompt_tokens = None
+        spans: Dict[str, float] = {}
+        if self.context is not None and not retrieval.skipped_scoring:
+            with TRACER.span("prompt", "variant", variant=self.name):
+                t_prompt = perf_counter_ns()
+                est_prompt_tokens = self.context.estimate_prompt_tokens(query, retrieval)
+                spans["prompt_us"] = elapsed_us(t_prompt)
 
         # --- gate (threshold) ---
-        t_gate_start = time.perf_counter()
-
-        if retrieval.max_score < self.tau:
-            decision = "stop"
-            stop_reason = "score_below_threshold"
-            llm_called = False
-            prompt_tokens = 0
-            gen_tokens = 0
-            gen_latency_ms = 0
-        else:
-            decision = "answer"
-            stop_reason = None
-            llm_called = True
-
-            llm_out = self.llm_generate_fn(query, retrieval)
-            prompt_tokens = llm_out.get("prompt_tokens", 0)
-            gen_tokens = llm_out.get("gen_tokens", 0)
-            gen_latency_ms = llm_out.get("latency_ms", 0)
-
-        gate_latency_ms = int((time.perf_counter() - t_gate_start) * 1000)
-        total_latency_ms = int((time.perf_counter() - t_start) * 1000)
+        with TRACER.span("gate", "variant", variant=self.name) as span:
+            t_gate_start = perf_counter_ns()
+            decision, stop_reason, gate_cache_hit = cached_gate(self, retrieval)
+            spans["gate_us"] = elapsed_us(t_gate_start)
+            span.set(decision=decision, stop_reason=stop_reason)
+        # gate only; generation is timed separately
+        gate_latency_ms = spans["gate_us"] / 1000
+
+        # --- generation ---
+        llm_out = None
+        if decision == "answer":
+            with TRACER.span("generate", "variant", variant=self.name):
+                t_gen = perf_counter_ns()
+                llm_out = self.llm_generate_fn(query, retrieval)
+                spans["generate_us"] = elapsed_us(t_gen)
+
+        total_latency_ms = elapsed_ms(t_start)
+        if shared:
+            total_latency_ms += retrieval.retrieval_latency_ms
+
+        return self.make_result(
+            query, retrieval, decision, stop_reason,
+            gate_latency_ms, llm_out, total_latency_ms,
+            est_prompt_tokens=est_prompt_tokens, spans=spans,
+            gate_cache_hit=gate_cache_hit,
+        )
 
+    def make_result(
+        self,
+        query: str,
+        retrieval: RetrievalResult,
+        decision: str,
+        stop_reason: Optional[str],
+        gate_latency_ms: float,
+        llm_out: Optional[Dict[str, Any]],
+        total_latency_ms: float,
+        est_prompt_tokens: Optional[int] = None,
+        spans: Optional[Dict[str, float]] = None,
+        gate_cache_hit: Optional[bool] = None,
+    ) -> RAGThresholdResult:
+        """
+        Assemble a result row; llm_out is None when the LLM was not called.
+        spans: {"prompt_us" | "gate_us" | "generate_us": float}
+        """
+        out = llm_out or {}
+        spans = spans or {}
         return RAGThresholdResult(
-            variant="baseline_score_threshold",
+            variant=self.name,
             query=query,
             retrieval=retrieval,
             tau=self.tau,
             decision=decision,
             stop_reason=stop_reason,
             gate_latency_ms=gate_latency_ms,
-            llm_called=llm_called,
-            prompt_tokens=prompt_tokens,
-            gen_tokens=gen_tokens,
-            gen_latency_ms=gen_latency_ms,
-            total_latency_ms=total_latency_ms,
+            llm_called=llm_out is not None,
+            prompt_tokens=out.get("prompt_tokens", 0),
+            gen_tokens=out.get("gen_tokens", 0),
+            gen_latency_ms=out.get("latency_ms", 0.0),
+            total_latency_ms=total_latency_ms + replayed_ms(out),
+            llm_cache_hit=out.get("cache_hit"),
+            llm_cache_lookup_ms=out.get("cache_lookup_ms"),
+            gate_cache_hit=gate_cache_hit,
+            est_prompt_tokens=est_prompt_tokens,
+            ttft_ms=out.get("ttft_ms"),
+            itl_p50_ms=out.get("itl_p50_ms"),
+            itl_p90_ms=out.get("itl_p90_ms"),
+            itl_p99_ms=out.get("itl_p99_ms"),
+            tokens_per_sec=out.get("tokens_per_sec"),
+            gen_aborted=out.get("aborted"),
+            prompt_us=spans.get("prompt_us"),
+            gate_us=spans.get("gate_us"),
+            generate_us=spans.get("generate_us"),
         )
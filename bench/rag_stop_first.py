@@ -1,10 +1,16 @@
 from __future__ import annotations
 
-import time
+from time import perf_counter_ns
 from dataclasses import dataclass
-from typing import Optional, Dict
+from typing import Optional, Dict, Any
 
+from bench.gate_cascade import GateCascade, default_cascade
+from bench.llm_cache import replayed_ms
+from bench.prompt import ContextBuilder
+from bench.query_cache import cached_gate
 from bench.retrieval import BM25Retriever, RetrievalResult
+from bench.timing import elapsed_ms, elapsed_us
+from bench.tracing import TRACER
 
 
 @dataclass
@@ -23,30 +29,63 @@ class RAGStopFirstResult:
     tau_stop: float
 
     # costs
-    gate_latency_ms: int
+    gate_latency_ms: float
     llm_called: bool
     prompt_tokens: int
     gen_tokens: int
-    gen_latency_ms: int
+    gen_latency_ms: float
 
     # aggregate
-    total_latency_ms: int
+    total_latency_ms: float
+
+    # LLM generation cache: True/False if a cache was consulted, else None.
+    # On a hit gen_latency_ms is the original generation's and
+    # total_latency_ms is charged it instead of the lookup time.
+    llm_cache_hit: Optional[bool] = None
+    llm_cache_lookup_ms: Optional[float] = None
+
+    # QueryCache gate memo: True/False if the retrieval was cached, else None
+    gate_cache_hit: Optional[bool] = None
+
+    # cascade stage that decided ("final" if every stage deferred)
+    gate_exit_stage: Optional[str] = None
+
+    # prompt cost estimated before generation (None without a ContextBuilder)
+    est_prompt_tokens: Optional[int] = None
+
+    # stage spans in microseconds (perf_counter_ns); None = stage not run
+    prompt_us: Optional[float] = None
+    gate_us: Optional[float] = None
+    generate_us: Optional[float] = None
+
+    # streaming generation metrics (None unless generated with streaming)
+    ttft_ms: Optional[float] = None
+    itl_p50_ms: Optional[float] = None
+    itl_p90_ms: Optional[float] = None
+    itl_p99_ms: Optional[float] = None
+    tokens_per_sec: Optional[float] = None
+    gen_aborted: Optional[bool] = None
 
 
 class RAGStopFirst:
     """
     Stop-First RAG:
-      retrieve(query)
-      cheap multi-signal gate
+      query-only gate stages (may stop before scoring)
+      retrieve(query)   (not scored if its BM25 upper bound < tau_stop)
+      cheap multi-signal gate (GateCascade, cheap -> expensive)
       if STOP -> typed stop_reason
       else -> CALL LLM
     """
 
+    name = "stop_first"
+
     def __init__(
         self,
         retriever: BM25Retriever,
         tau_stop: float,
         llm_generate_fn,
+        context: Optional[ContextBuilder] = None,
+        cascade: Optional[GateCascade] = None,
     ):
         """
         tau_stop:
@@ -55,72 +94,172 @@ class RAGStopFirst:
           {
             "prompt_tokens": int,
             "gen_tokens": int,
-            "latency_ms": int
+            "latency_ms": float
           }
+        context: optional ContextBuilder; if given, the packed prompt's
+          token count is estimated before gating and recorded per row
+        cascade: gate stages; default_cascade(retriever, tau_stop) is the
+          oov -> max_score -> gap gate
         """
         self.retriever = retriever
         self.tau_stop = tau_stop
         self.llm_generate_fn = llm_generate_fn
+        self.context = context
+        self.cascade = cascade or default_cascade(retriever, tau_stop)
 
-    def _gate(self, r: RetrievalResult) -> tuple[str, Optional[str]]:
+    def gate(self, r: RetrievalResult) -> tuple[str, Optional[str]]:
         """
         Returns:
           decision: "stop" | "answer"
           stop_reason: typed reason or None
         """
+        decision, stop_reason, _ = self.cascade.decide(r.query, r)
+        return decision, stop_reason
+
+    def gate_with_stage(self, r: RetrievalResult) -> tuple[str, Optional[str], str]:
+        """gate() plus the name of the cascade stage that decided."""
+        return self.cascade.decide(r.query, r)
 
-        # 1) No data: retrieval confidence too low
-        if r.max_score < self.tau_stop:
-            return "stop", "no_data"
+    def gate_after_retrieval(self, r: RetrievalResult) -> tuple[str, Optional[str], str]:
+        """Cascade stages after the query-only ones (already passed)."""
+        return self.cascade.post_retrieval(r.query, r)
 
-        # 2) Conflict candidate: ambiguous top evidence
-        if r.conflict_candidate:
-            return "stop", "conflict"
+    def gate_memo_hit(self, out: tuple) -> None:
+        """cached_gate replayed a memoized gate output; count it in the cascade stats."""
+        self.cascade.record_memo_hit(out[2] if len(out) > 2 else None)
 
-        # 3) Low confidence (optional cheap heuristic)
-        # If top score exists but gap is tiny AND absolute score not strong
-        if r.top1_score < (self.tau_stop * 1.2) and r.score_gap_12 < 0.01:
-            return "stop", "low_confidence"
+    @property
+    def gate_params(self) -> tuple:
+        """Everything gate() depends on besides the RetrievalResult."""
+        return (self.tau_stop, self.cascade.params)
 
-        return "answer", None
+    @property
+    def score_floor(self) -> Optional[float]:
+        """max_score below which gate() always stops (retrieval may skip scoring)."""
+        return self.cascade.score_floor
 
-    def run(self, query: str) -> RAGStopFirstResult:
-        t_start = time.perf_counter()
+    def run(
+        self,
+        query: str,
+        retrieval: Optional[RetrievalResult] = None,
+    ) -> RAGStopFirstResult:
+        """
+        retrieval: precomputed RetrievalResult for `query` (shared across
+        variants); if None, retrieve here. Its retrieval_latency_ms is
+        counted in total_latency_ms either way.
+        """
+        with TRACER.span("run", "variant", variant=self.name):
+            return self._run(query, retrieval)
+
+    def _run(self, query: str, retrieval: Optional[RetrievalResult]) -> RAGStopFirstResult:
+        t_start = perf_counter_ns()
+        spans: Dict[str, float] = {}
+        gate_ns = 0
+        gate_cache_hit = None
+
+        # --- query-only gate stages (only worth it before scoring) ---
+        shared = retrieval is not None
+        early = None
+        if not shared:
+            with TRACER.span("gate_pre", "variant", variant=self.name):
+                t_pre = perf_counter_ns()
+                early = self.cascade.pre_retrieval(query)
+                gate_ns = perf_counter_ns() - t_pre
 
         # --- retrieval ---
-        retrieval = self.retriever.retrieve(query)
+        if early is not None:
+            retrieval = self.retriever.unscored_result(query)
+        elif not shared:
+            with TRACER.span("retrieve", "variant", variant=self.name):
+                retrieval = self.retriever.retrieve(query, min_score=self.score_floor)
+
+        # --- prompt cost (estimated before any LLM call) ---
+        est_prompt_tokens = None
+        if self.context is not None and not retrieval.skipped_scoring:
+            with TRACER.span("prompt", "variant", variant=self.name):
+                t_prompt = perf_counter_ns()
+                est_prompt_tokens = self.context.estimate_prompt_tokens(query, retrieval)
+                spans["prompt_us"] = elapsed_us(t_prompt)
 
         # --- gate ---
-        t_gate_start = time.perf_counter()
-        decision, stop_reason = self._gate(retrieval)
-        gate_latency_ms = int((time.perf_counter() - t_gate_start) * 1000)
+        if early is not None:
+            decision, stop_reason, exit_stage = early
+        else:
+            gate_fn = self.gate_with_stage if shared else self.gate_after_retrieval
+            with TRACER.span("gate", "variant", variant=self.name) as span:
+                t_gate_start = perf_counter_ns()
+                decision, stop_reason, exit_stage, gate_cache_hit = cached_gate(
+                    self, retrieval, gate_fn
+                )
+                gate_ns += perf_counter_ns() - t_gate_start
+                span.set(decision=decision, stop_reason=stop_reason, stage=exit_stage)
+        spans["gate_us"] = gate_ns / 1e3
+        gate_latency_ms = spans["gate_us"] / 1000
 
         # --- generation ---
-        if decision == "stop":
-            llm_called = False
-            prompt_tokens = 0
-            gen_tokens = 0
-            gen_latency_ms = 0
-        else:
-            llm_called = True
-            llm_out = self.llm_generate_fn(query, retrieval)
-            prompt_tokens = llm_out.get("prompt_tokens", 0)
-            gen_tokens = llm_out.get("gen_tokens", 0)
-            gen_latency_ms = llm_out.get("latency_ms", 0)
+        llm_out = None
+        if decision == "answer":
+            with TRACER.span("generate", "variant", variant=self.name):
+                t_gen = perf_counter_ns()
+                llm_out = self.llm_generate_fn(query, retrieval)
+                spans["generate_us"] = elapsed_us(t_gen)
 
-        total_latency_ms = int((time.perf_counter() - t_start) * 1000)
+        total_latency_ms = elapsed_ms(t_start)
+        if shared:
+            total_latency_ms += retrieval.retrieval_latency_ms
 
+        return self.make_result(
+            query, retrieval, decision, stop_reason,
+            gate_latency_ms, llm_out, total_latency_ms,
+            est_prompt_tokens=est_prompt_tokens, spans=spans,
+            gate_cache_hit=gate_cache_hit, gate_exit_stage=exit_stage,
+        )
+
+    def make_result(
+        self,
+        query: str,
+        retrieval: RetrievalResult,
+        decision: str,
+        stop_reason: Optional[str],
+        gate_latency_ms: float,
+        llm_out: Optional[Dict[str, Any]],
+        total_latency_ms: float,
+        est_prompt_tokens: Optional[int] = None,
+        spans: Optional[Dict[str, float]] = None,
+        gate_cache_hit: Optional[bool] = None,
+        gate_exit_stage: Optional[str] = None,
+    ) -> RAGStopFirstResult:
+        """
+        Assemble a result row; llm_out is None when the LLM was not called.
+        spans: {"prompt_us" | "gate_us" | "generate_us": float}
+        """
+        out = llm_out or {}
+        spans = spans or {}
         return RAGStopFirstResult(
-            variant="stop_first",
+            variant=self.name,
             query=query,
             retrieval=retrieval,
             decision=decision,
             stop_reason=stop_reason,
             tau_stop=self.tau_stop,
             gate_latency_ms=gate_latency_ms,
-            llm_called=llm_called,
-            prompt_tokens=prompt_tokens,
-            gen_tokens=gen_tokens,
-            gen_latency_ms=gen_latency_ms,
-            total_latency_ms=total_latency_ms,
+            llm_called=llm_out is not None,
+            prompt_tokens=out.get("prompt_tokens", 0),
+            gen_tokens=out.get("gen_tokens", 0),
+            gen_latency_ms=out.get("latency_ms", 0.0),
+            total_latency_ms=total_latency_ms + replayed_ms(out),
+            llm_cache_hit=out.get("cache_hit"),
+            llm_cache_lookup_ms=out.get("cache_lookup_ms"),
+            gate_cache_hit=gate_cache_hit,
+            gate_exit_stage=gate_exit_stage,
+            est_prompt_tokens=est_prompt_tokens,
+            ttft_ms=out.get("ttft_ms"),
+            itl_p50_ms=out.get("itl_p50_ms"),
+            itl_p90_ms=out.get("itl_p90_ms"),
+            itl_p99_ms=out.get("itl_p99_ms"),
+            tokens_per_sec=out.get("tokens_per_sec"),
+            gen_aborted=out.get("aborted"),
+            prompt_us=spans.get("prompt_us"),
+            gate_us=spans.get("gate_us"),
+            generate_us=spans.get("generate_us"),
         )
@@ -0,0 +1,261 @@
+"""
+Result row storage: nested JSONL or chunked columnar (.npz) files.
+
+Rows are the variant result dataclasses. Both formats flatten them the
+same way (dataclasses.asdict; nested RetrievalResult fields become
+"retrieval.<field>" columns) and share one schema derived from the
+dataclass type hints, so readers can project columns from either:
+
+  jsonl     one nested JSON object per line
+  columnar  a directory of chunk_<n>.npz files (one array per column,
+            appended every chunk_rows rows) plus schema.json; reading a
+            column loads only that array from each chunk
+
+Column encodings (null = None, or a column the row's variant lacks):
+  bool -> bool;  bool? -> int8 (-1 = null)
+  int -> int64;  int?, float, float? -> float64 (NaN = null)
+  str, str? -> unicode ("" = null);  json (lists) -> JSON-encoded unicode
+"""
+from __future__ import annotations
+
+import dataclasses
+import json
+import math
+import typing
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from bench.rag_baseline_naive import RAGNaiveResult
+from bench.rag_baseline_threshold import RAGThresholdResult
+from bench.rag_stop_first import RAGStopFirstResult
+
+
+FORMATS = ("jsonl", "columnar")
+DEFAULT_CHUNK_ROWS = 65536
+
+_NULL_INT8 = -1
+
+
+def _kind(tp) -> str:
+    nullable = False
+    if typing.get_origin(tp) is typing.Union:
+        args = [a for a in typing.get_args(tp) if a is not type(None)]
+        nullable = len(args) < len(typing.get_args(tp))
+        tp = args[0] if len(args) == 1 else Any
+    if typing.get_origin(tp) in (list, tuple, dict):
+        return "json"
+    for base, name in ((bool, "bool"), (int, "int"), (float, "float"), (str, "str")):
+        if tp is base:
+            return name + "?" if nullable else name
+    return "json"
+
+
+def _schema_fields(cls, prefix: str = "") -> Dict[str, str]:
+    hints = typing.get_type_hints(cls)
+    schema: Dict[str, str] = {}
+    for f in dataclasses.fields(cls):
+        tp = hints[f.name]
+        if dataclasses.is_dataclass(tp):
+            schema.update(_schema_fields(tp, f"{prefix}{f.name}."))
+        else:
+            schema[prefix + f.name] = _kind(tp)
+    return schema
+
+
+def result_schema(*classes) -> Dict[str, str]:
+    """Union of the flattened columns of the given result dataclasses."""
+    per_class = [_schema_fields(cls) for cls in classes]
+    schema: Dict[str, str] = {}
+    for fields in per_class:
+        for name, kind in fields.items():
+            schema.setdefault(name, kind)
+    # a column only some variants have is null for the others
+    for name, kind in schema.items():
+        if kind != "json" and not kind.endswith("?") and any(name not in f for f in per_class):
+            schema[name] = kind + "?"
+    return schema
+
+
+RESULT_SCHEMA = result_schema(RAGNaiveResult, RAGThresholdResult, RAGStopFirstResult)
+
+
+def result_to_dict(result) -> Dict[str, Any]:
+    """Nested dict of a result dataclass (retrieval as a nested object)."""
+    return dataclasses.asdict(result)
+
+
+def _get(row: Dict[str, Any], column: str):
+    value: Any = row
+    for part in column.split("."):
+        if not isinstance(value, dict):
+            # e.g. retrieval stored as a repr string by older runs
+            return None
+        value = value.get(part)
+    return value
+
+
+def _encode(kind: str, values: Sequence[Any]) -> np.ndarray:
+    if kind == "bool":
+        return np.array([bool(v) for v in values], dtype=np.bool_)
+    if kind == "bool?":
+        return np.array([_NULL_INT8 if v is None else int(bool(v)) for v in values], dtype=np.int8)
+    if kind == "int":
+        return np.array([v or 0 for v in values], dtype=np.int64)
+    if kind in ("int?", "float", "float?"):
+        return np.array([math.nan if v is None else v for v in values], dtype=np.float64)
+    if kind in ("str", "str?"):
+        return np.array(["" if v is None else v for v in values], dtype=np.str_)
+    return np.array([json.dumps(v) for v in values], dtype=np.str_)
+
+
+def rows_to_columns(
+    rows: Sequence[Dict[str, Any]],
+    columns: Optional[Sequence[str]] = None,
+    schema: Dict[str, str] = RESULT_SCHEMA,
+) -> Dict[str, np.ndarray]:
+    """Encode nested row dicts into column arrays (see module docstring)."""
+    columns = list(schema) if columns is None else columns
+    return {c: _encode(schema.get(c, "json"), [_get(r, c) for r in rows]) for c in columns}
+
+
+class JsonlResultWriter:
+    """One nested JSON object per line."""
+
+    def __init__(self, path, append: bool = False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, result) -> None:
+        self._f.write(json.dumps(result_to_dict(result)) + "\n")
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ColumnarResultWriter:
+    """
+    Buffers rows and appends one chunk_<n>.npz per chunk_rows rows.
+    append=True continues after the chunks already in the directory.
+    """
+
+    def __init__(
+        self,
+        path,
+        append: bool = False,
+        chunk_rows: int = DEFAULT_CHUNK_ROWS,
+        schema: Dict[str, str] = RESULT_SCHEMA,
+    ):
+        self.path = Path(path)
+        self.chunk_rows = chunk_rows
+        self.schema = schema
+        self.path.mkdir(parents=True, exist_ok=True)
+        if not append:
+            for old in self.path.glob("chunk_*.npz"):
+                old.unlink()
+        with open(self.path / "schema.json", "w", encoding="utf-8") as f:
+            json.dump(schema, f, indent=2)
+        self._next_chunk = len(_chunk_files(self.path))
+        self._rows: List[Dict[str, Any]] = []
+
+    def write(self, result) -> None:
+        self._rows.append(result_to_dict(result))
+        if len(self._rows) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        arrays = rows_to_columns(self._rows, schema=self.schema)
+        np.savez(self.path / f"chunk_{self._next_chunk:06d}.npz", **arrays)
+        self._next_chunk += 1
+        self._rows = []
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_result_writer(path, fmt: str = "jsonl", append: bool = False, **kwargs):
+    if fmt == "jsonl":
+        return JsonlResultWriter(path, append=append)
+    if fmt == "columnar":
+        return ColumnarResultWriter(path, append=append, **kwargs)
+    raise ValueError(f"Unknown result format {fmt!r}; choose from {FORMATS}")
+
+
+def _chunk_files(path: Path) -> List[Path]:
+    return sorted(path.glob("chunk_*.npz"))
+
+
+def iter_column_chunks(
+    path,
+    columns: Sequence[str],
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Yield {column: array} per chunk of rows, loading only `columns`.
+    path: a columnar result directory or a JSONL file.
+    """
+    path = Path(path)
+    if path.is_dir():
+        with open(path / "schema.json", "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        for chunk in _chunk_files(path):
+            with np.load(chunk) as z:
+                cols = {c: z[c] for c in columns if c in z.files}
+                missing = [c for c in columns if c not in cols]
+                if missing:
+                    n = len(next(iter(cols.values())) if cols else z[z.files[0]])
+                    for c in missing:
+                        cols[c] = _encode(schema.get(c, "json"), [None] * n)
+                yield {c: cols[c] for c in columns}
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        rows: List[Dict[str, Any]] = []
+        for line in f:
+            rows.append(json.loads(line))
+            if len(rows) >= chunk_rows:
+                yield rows_to_columns(rows, columns)
+                rows = []
+        if rows:
+            yield rows_to_columns(rows, columns)
+
+
+def read_columns(path, columns: Sequence[str]) -> Dict[str, np.ndarray]:
+    """All rows of the projected columns, concatenated."""
+    chunks = list(iter_column_chunks(path, columns))
+    if not chunks:
+        return {c: _encode(RESULT_SCHEMA.get(c, "json"), []) for c in columns}
+    return {c: np.concatenate([ch[c] for ch in chunks]) for c in columns}
+
+
+def merge_columnar(shard_paths: Sequence[str], output_path) -> int:
+    """Concatenate columnar shard directories in order; returns #chunks."""
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    for old in _chunk_files(output_path):
+        old.unlink()
+    n = 0
+    for shard in shard_paths:
+        shard = Path(shard)
+        if n == 0:
+            (output_path / "schema.json").write_bytes((shard / "schema.json").read_bytes())
+        for chunk in _chunk_files(shard):
+            chunk.replace(output_path / f"chunk_{n:06d}.npz")
+            n += 1
+    return n
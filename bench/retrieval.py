@@ -1,16 +1,45 @@
 from __future__ import annotations
 
+import dataclasses
 import json
-import time
+import math
+import os
+from time import perf_counter_ns
 import re
+import sys
+from array import array
+from collections import Counter
+from itertools import repeat
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from types import MappingProxyType
+from typing import Any, List, Dict, Tuple, Optional, Iterable, Iterator, Mapping
 
 import numpy as np
 
-# pip install rank-bm25
-from rank_bm25 import BM25Okapi
+from bench.timing import ns_to_ms, ns_to_us
+from bench.tracing import TRACER
+
+
+# BM25Okapi defaults (rank-bm25). Kept identical so scores match the
+# previous rank_bm25-backed retriever exactly.
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+# Bump when the on-disk layout written by InvertedIndex.save changes
+INDEX_FORMAT_VERSION = 2
+
+# Tokenizer: lowercase alnum runs (compiled once, shared by docs and queries)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Postings are materialized / weighted in blocks of this many entries, so
+# int64/float64 temporaries stay bounded instead of O(postings)
+_WEIGHT_BLOCK = 1 << 16
+
+# Relative slack for pruning comparisons between sums taken in different
+# orders (partial scores vs the final query-order sum)
+PRUNE_SLACK = 1e-9
 
 
 @dataclass(frozen=True)
@@ -19,7 +48,7 @@ class RetrievalResult:
     retrieved_doc_ids: List[str]
     retrieved_scores: List[float]
     max_score: float
-    retrieval_latency_ms: int
+    retrieval_latency_ms: float  # tokenize + score + top-k
 
     # For later diagnostics / conflict handling
     top1_doc_id: Optional[str]
@@ -29,22 +58,1165 @@ class RetrievalResult:
     score_gap_12: float
     conflict_candidate: bool  # heuristic only
 
+    # Stage spans (microseconds, perf_counter_ns). In retrieve_many the
+    # tokenize / score spans are batch times amortized per query.
+    tokenize_us: float = 0.0
+    score_us: float = 0.0
+    topk_us: float = 0.0
+
+    # QueryCache: True/False if one was consulted, else None. A hit's
+    # latency is tokenize + lookup; cache_saved_us is the scoring it skipped.
+    cache_hit: Optional[bool] = None
+    cache_saved_us: Optional[float] = None
+
+    # True if the query was gated before scoring (no docs retrieved)
+    skipped_scoring: bool = False
+    # retrieve(min_score=...) skipped scoring: the bound that was below it
+    score_upper_bound: Optional[float] = None
+
+    # Pruned retrieval (BM25Retriever.prune): postings of the query terms
+    # and how many of them were never read. None = exhaustive scoring.
+    postings_total: Optional[int] = None
+    postings_skipped: Optional[int] = None
+
+    # Query tokens, and how many of them have no live postings (unknown to
+    # the vocabulary or df == 0), for OOVStage. None = not retrieved.
+    query_tokens: Optional[int] = None
+    oov_tokens: Optional[int] = None
+
+
+def iter_corpus_jsonl_with_offsets(path: str | Path) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """
+    Stream (byte offset, doc) pairs from a corpus JSONL file.
+    The offset points at the start of the doc's line (see DocStore).
+    """
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
+            if line.strip():
+                d = json.loads(line)
+                if "doc_id" not in d or "text" not in d:
+                    raise ValueError("Corpus items must have 'doc_id' and 'text'")
+                yield offset, d
+            offset += len(line)
+
+
+def iter_corpus_jsonl(path: str | Path) -> Iterator[Dict[str, str]]:
+    """
+    Stream docs from a corpus JSONL file one at a time.
+
+    Expected JSONL:
+      {"doc_id": "doc_0001", "text": "..."}
+    """
+    for _, d in iter_corpus_jsonl_with_offsets(path):
+        yield d
+
 
 def load_corpus_jsonl(path: str | Path) -> List[Dict[str, str]]:
     """
     Expected JSONL:
       {"doc_id": "doc_0001", "text": "..."}
+
+    Materializes the whole corpus; prefer iter_corpus_jsonl /
+    BM25Retriever.from_jsonl for large files.
     """
-    corpus: List[Dict[str, str]] = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                corpus.append(json.loads(line))
-    # Minimal validation
-    for d in corpus[:5]:
-        if "doc_id" not in d or "text" not in d:
-            raise ValueError("Corpus items must have 'doc_id' and 'text'")
-    return corpus
+    return list(iter_corpus_jsonl(path))
+
+
+class DocStore:
+    """
+    Lazy doc text lookup via byte offsets into the corpus JSONL.
+
+    Only one int64 offset per doc is resident; text is read (one seek +
+    one line) on demand from a file handle kept open until close(). A
+    forked process (e.g. a run_sharded worker) opens its own handle, so
+    processes never share a file position.
+
+    Docs added after the corpus file was indexed (BM25Retriever.add_documents)
+    have no offset (-1) and are kept in memory instead.
+    """
+
+    def __init__(self, corpus_path: str | Path, offsets: np.ndarray, doc_ids: List[str]):
+        self.corpus_path = Path(corpus_path)
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self._extra: Dict[int, Dict[str, str]] = {}
+        self._row_by_id: Optional[Dict[str, int]] = None
+        self._file = None
+        self._file_pid = -1
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get(self, idx: int) -> Dict[str, str]:
+        """Doc record at index idx (same order as the index / doc_ids)."""
+        if idx in self._extra:
+            return self._extra[idx]
+        if self._file is None or self._file_pid != os.getpid():
+            # a handle inherited across fork shares its position: reopen
+            self._file = open(self.corpus_path, "rb")
+            self._file_pid = os.getpid()
+        self._file.seek(int(self.offsets[idx]))
+        return json.loads(self._file.readline())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+
+    def __del__(self):
+        self.close()
+
+    def get_text(self, doc_id: str) -> str:
+        if self._row_by_id is None:
+            # later rows win, so a re-added doc_id resolves to its new copy
+            self._row_by_id = {d: i for i, d in enumerate(self.doc_ids)}
+        return self.get(self._row_by_id[doc_id])["text"]
+
+    def append(self, docs: List[Dict[str, str]]) -> None:
+        """Register docs appended to the index (kept in memory)."""
+        first = len(self.offsets)
+        self.offsets = np.concatenate([self.offsets, np.full(len(docs), -1, dtype=np.int64)])
+        for i, d in enumerate(docs):
+            self._extra[first + i] = d
+        self._row_by_id = None
+
+    def compact(self, remap: np.ndarray, doc_ids: List[str]) -> None:
+        """Apply an InvertedIndex.merge() doc index remap."""
+        self.offsets = np.asarray(self.offsets)[remap >= 0]
+        self._extra = {int(remap[i]): d for i, d in self._extra.items() if remap[i] >= 0}
+        self.doc_ids = doc_ids
+        self._row_by_id = None
+
+
+def _bm25_idf(df: List[int], num_docs: int, epsilon: float) -> np.ndarray:
+    # Mirrors BM25Okapi._calc_idf term by term (math.log + sequential sum)
+    # so the epsilon floor and average idf match to the last bit as long as
+    # term ids follow first-seen corpus order (true after build and
+    # add_documents; deletes can move a term's first occurrence, and the
+    # average is then summed in a different order). Terms with df == 0 (all
+    # their docs deleted) are not part of the corpus any more: idf 0.0 and
+    # excluded from the average.
+    idf = [0.0] * len(df)
+    idf_sum = 0.0
+    n_terms = 0
+    negative = []
+    for t, freq in enumerate(df):
+        if freq == 0:
+            continue
+        v = math.log(num_docs - freq + 0.5) - math.log(freq + 0.5)
+        idf[t] = v
+        idf_sum += v
+        n_terms += 1
+        if v < 0:
+            negative.append(t)
+
+    average_idf = idf_sum / n_terms if n_terms else 0.0
+    eps = epsilon * average_idf
+    for t in negative:
+        idf[t] = eps
+    return np.asarray(idf, dtype=float)
+
+
+def _count_postings(
+    tokens: List[str],
+    doc_idx: int,
+    vocab: Dict[str, int],
+    df: array,
+    terms: array,
+    docs: array,
+    tfs: array,
+) -> None:
+    """
+    Append one doc's (term id, doc, tf) postings to int32 buffers; unseen
+    terms get the next id. array('i') holds 4 bytes per entry where a list
+    holds an 8-byte pointer plus (for ids > 256) a 28-byte int object.
+    """
+    counts = Counter(tokens)
+    for term, tf in counts.items():
+        t = vocab.get(term)
+        if t is None:
+            t = len(vocab)
+            vocab[term] = t
+            df.append(0)
+        df[t] += 1
+        terms.append(t)
+    docs.extend([doc_idx] * len(counts))
+    tfs.extend(counts.values())
+
+
+def _int32_view(buf: array) -> np.ndarray:
+    """Zero-copy int32 view of an array('i') buffer."""
+    return np.frombuffer(buf, dtype=np.int32) if len(buf) else np.zeros(0, dtype=np.int32)
+
+
+def _csr_positions(indptr: np.ndarray, terms: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Posting positions of every listed term (concatenated) + per-term counts."""
+    starts = indptr[terms]
+    lens = indptr[terms + 1] - starts
+    offsets = np.cumsum(lens) - lens
+    pos = np.arange(int(lens.sum()), dtype=np.int64) + np.repeat(starts - offsets, lens)
+    return pos, lens
+
+
+def _csr_from_triples(
+    terms: np.ndarray,
+    docs: np.ndarray,
+    tfs: np.ndarray,
+    vocab_size: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(indptr, post_docs, post_tfs); stable sort keeps docs ascending per term."""
+    order = np.argsort(terms, kind="stable")
+    indptr = np.zeros(vocab_size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=vocab_size), out=indptr[1:])
+    return indptr, docs[order].astype(np.int32, copy=False), tfs[order].astype(np.int32, copy=False)
+
+
+class _Segment:
+    """
+    Immutable CSR postings for a batch of docs (built or added together).
+
+    post_weights caches BM25 weights for one stats version of the owning
+    index; when stats move on (add/delete), weights are recomputed from
+    post_tfs for the touched postings only, until the next merge.
+    """
+
+    def __init__(
+        self,
+        indptr: np.ndarray,
+        post_docs: np.ndarray,
+        post_tfs: np.ndarray,
+        post_weights: Optional[np.ndarray] = None,
+        weights_version: int = -1,
+    ):
+        self.indptr = indptr
+        self.post_docs = post_docs
+        self.post_tfs = post_tfs
+        self.post_weights = post_weights
+        self.weights_version = weights_version
+
+    @property
+    def vocab_size(self) -> int:
+        return len(self.indptr) - 1
+
+    def term_ids(self) -> np.ndarray:
+        """Term id of every posting (expanded from indptr)."""
+        return np.repeat(np.arange(self.vocab_size, dtype=np.int64), np.diff(self.indptr))
+
+
+def _prune_cut(thr):
+    """thr lowered by PRUNE_SLACK (relative); scalars or arrays."""
+    return thr - PRUNE_SLACK * np.maximum(1.0, np.abs(thr))
+
+
+def _below(x, thr):
+    """x < thr by more than PRUNE_SLACK."""
+    return x < _prune_cut(thr)
+
+
+def _kth_largest(values: np.ndarray, k: int) -> float:
+    """k-th largest value; 0.0 with fewer than k values."""
+    if values.size < k:
+        return 0.0
+    return float(np.partition(values, values.size - k)[values.size - k])
+
+
+def _group_kth_max(
+    groups: np.ndarray, values: np.ndarray, n_groups: int, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Per group id in [0, n_groups): (k-th largest, largest) value, 0.0 if too few."""
+    if (groups[1:] < groups[:-1]).any():
+        order = np.argsort(groups, kind="stable")
+        groups, values = groups[order], values[order]
+    starts = np.searchsorted(groups, np.arange(n_groups + 1))
+    kth = np.zeros(n_groups)
+    top = np.zeros(n_groups)
+    for g in np.flatnonzero(starts[1:] > starts[:-1]).tolist():
+        v = values[starts[g]:starts[g + 1]]
+        kth[g] = _kth_largest(v, k)
+        top[g] = v.max()
+    return kth, top
+
+
+class _PrunePlan:
+    """One query of a pruned batch: distinct terms by decreasing bound + stats."""
+
+    __slots__ = ("row", "ids", "floor", "stats", "terms", "mult", "lens", "bounds",
+                 "suffix", "n_read", "stopped")
+
+    def __init__(self, row: int, ids: List[int], floor: Optional[float]):
+        self.row = row
+        self.ids = ids
+        self.floor = floor
+        self.stats: Dict[str, Any] = {
+            "postings_total": 0,
+            "postings_scored": 0,
+            "postings_probed": 0,
+            "postings_skipped": 0,
+            "early_stop": False,
+        }
+        self.terms: List[int] = []
+        self.mult: List[int] = []
+        self.lens: List[int] = []
+        self.bounds: List[float] = []
+        # suffix[j]: bound contributed by the lists terms[j:]
+        self.suffix: List[float] = [0.0]
+        self.n_read = 0
+        self.stopped = False
+
+    def stop(self, best_ub: float) -> bool:
+        """Stop early if no doc can reach the floor (best_ub bounds every doc)."""
+        if self.floor is None or not _below(best_ub, self.floor):
+            return False
+        self.stopped = True
+        self.stats["early_stop"] = True
+        self.stats["score_upper_bound"] = float(best_ub)
+        self.stats["postings_skipped"] = self.stats["postings_total"] - self.stats["postings_scored"]
+        return True
+
+
+class InvertedIndex:
+    """
+    BM25 inverted index with CSR-style postings.
+
+    Layout:
+      vocab[term] -> term id t (frozen, read-only; add_documents swaps in
+      an extended copy, so ids never change and a held vocab never grows)
+      segments: one or more _Segment; postings of t in a segment live in
+      [indptr[t], indptr[t + 1]) of
+        post_docs     doc indices (ascending)
+        post_tfs      term frequencies
+        post_weights  precomputed BM25 weight idf(t) * tf-norm(t, doc)
+
+    Scoring a query only touches the postings of its terms, so the cost is
+    O(sum of query-term posting lengths) instead of O(corpus) per token.
+
+    Scores are bit-identical to rank_bm25.BM25Okapi on the same docs: same
+    idf (incl. the epsilon floor for negative idf), same float expression
+    order, and query tokens are accumulated one at a time in query order.
+    After delete_documents (and a merge() that follows), the epsilon floor
+    can differ from a fresh build in the last bits (~1e-15), since the
+    average idf is then summed in term-id rather than corpus order.
+
+    Updates (add_documents / delete_documents) append a segment or tombstone
+    docs and refresh df, avgdl and idf; nothing is re-tokenized. merge()
+    folds segments back into one and drops deleted docs.
+    """
+
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        segments: List[_Segment],
+        df: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        epsilon: float = BM25_EPSILON,
+        idf: Optional[np.ndarray] = None,
+        avgdl: Optional[float] = None,
+    ):
+        """
+        vocab: term -> id; the index takes ownership (do not mutate it).
+        idf/avgdl: pass the stats the segments' weights were computed with
+        (e.g. when loading from disk) to skip recomputing them.
+        """
+        self._vocab = vocab
+        self.vocab: Mapping[str, int] = MappingProxyType(vocab)
+        self.segments = segments
+        self.df = df
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        # Tombstones: sorted doc indices deleted since the last merge
+        self.deleted = np.zeros(0, dtype=np.int64)
+        self._live: Optional[np.ndarray] = None
+        # Bumped on every change to stats / postings
+        self.version = 0
+        # per-term score bound, cached for one version (see term_max_weights)
+        self._max_weights: Optional[np.ndarray] = None
+        self._max_weights_version = -1
+        if idf is None or avgdl is None:
+            self._refresh_stats()
+        else:
+            self.idf, self.avgdl = idf, avgdl
+        for seg in segments:
+            if seg.post_weights is None:
+                self._materialize_weights(seg)
+
+    @classmethod
+    def build(
+        cls,
+        tokenized: Iterable[List[str]],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        epsilon: float = BM25_EPSILON,
+    ) -> "InvertedIndex":
+        builder = IndexBuilder(k1=k1, b=b, epsilon=epsilon)
+        for tokens in tokenized:
+            builder.add(tokens)
+        return builder.finish()
+
+    # --- stats ---
+
+    @property
+    def num_slots(self) -> int:
+        """Doc indices in use, including deleted ones not yet merged away."""
+        return len(self.doc_len)
+
+    @property
+    def num_docs(self) -> int:
+        return self.num_slots - self.deleted.size
+
+    @property
+    def num_postings(self) -> int:
+        return sum(int(seg.post_docs.size) for seg in self.segments)
+
+    @property
+    def num_tokens(self) -> int:
+        """Indexed tokens of the live docs."""
+        if self._live is None:
+            return int(self.doc_len.sum())
+        return int(self.doc_len[self._live].sum())
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """
+        Bytes held per component. Memory-mapped postings count in full
+        although only the touched pages are resident.
+        """
+        postings = 0
+        for seg in self.segments:
+            for name in ("indptr", "post_docs", "post_tfs", "post_weights"):
+                arr = getattr(seg, name)
+                postings += 0 if arr is None else int(arr.nbytes)
+        stats = sum(int(a.nbytes) for a in (self.df, self.doc_len, self.idf))
+        if self._max_weights is not None:
+            stats += int(self._max_weights.nbytes)
+        vocab = sys.getsizeof(self._vocab) + sum(
+            sys.getsizeof(term) + sys.getsizeof(t) for term, t in self._vocab.items()
+        )
+        return {"postings": postings, "stats": stats, "vocab": vocab,
+                "total": postings + stats + vocab}
+
+    def _refresh_stats(self) -> None:
+        n = self.num_docs
+        self.avgdl = (self.num_tokens / n) if n else 0.0
+        self.idf = _bm25_idf(self.df.tolist(), n, self.epsilon)
+
+    def _weights(self, seg: _Segment, pos: np.ndarray, terms: np.ndarray) -> np.ndarray:
+        if seg.weights_version == self.version:
+            return seg.post_weights[pos]
+        k1, b = self.k1, self.b
+        tf = seg.post_tfs[pos].astype(np.int64)
+        dl = self.doc_len[seg.post_docs[pos]]
+        # Same expression (and evaluation order) as BM25Okapi.get_scores
+        return self.idf[terms] * (
+            tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / self.avgdl))
+        )
+
+    def _weight_blocks(self, seg: _Segment) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        (first position, term ids, weights) per _WEIGHT_BLOCK postings, so
+        temporaries stay O(block) however large the segment is.
+        """
+        n = seg.post_docs.size
+        for lo in range(0, n, _WEIGHT_BLOCK):
+            pos = np.arange(lo, min(n, lo + _WEIGHT_BLOCK), dtype=np.int64)
+            terms = np.searchsorted(seg.indptr, pos, side="right") - 1
+            yield lo, terms, self._weights(seg, pos, terms)
+
+    def _materialize_weights(self, seg: _Segment) -> None:
+        # blockwise: elementwise, so identical to one pass over all postings
+        weights = np.empty(seg.post_docs.size)
+        for lo, _, w in self._weight_blocks(seg):
+            weights[lo:lo + w.size] = w
+        seg.post_weights = weights
+        seg.weights_version = self.version
+
+    def _segment_max_weights(self, seg: _Segment) -> np.ndarray:
+        """max(0, max weight) per term over the segment's postings."""
+        out = np.zeros(seg.vocab_size)
+        if seg.weights_version == self.version:
+            nonempty = np.flatnonzero(np.diff(seg.indptr))
+            if nonempty.size:
+                # empty terms between two starts add nothing to a reduceat range
+                out[nonempty] = np.maximum(
+                    np.maximum.reduceat(seg.post_weights, seg.indptr[nonempty]), 0.0
+                )
+            return out
+        # stale weights: recompute blockwise; a term's postings may span blocks
+        for _, terms, w in self._weight_blocks(seg):
+            starts = np.flatnonzero(np.diff(terms, prepend=-1))
+            t = terms[starts]
+            out[t] = np.maximum(out[t], np.maximum.reduceat(w, starts))
+        return out
+
+    def term_max_weights(self) -> np.ndarray:
+        """
+        Upper bound on any doc's weight for each term: max(0, max posting
+        weight) over all segments. Tombstoned postings are included, which
+        only loosens the bound. Computed once per index version.
+        """
+        if self._max_weights_version != self.version:
+            out = np.zeros(len(self.vocab))
+            for seg in self.segments:
+                m = self._segment_max_weights(seg)
+                np.maximum(out[:m.size], m, out=out[:m.size])
+            self._max_weights = out
+            self._max_weights_version = self.version
+        return self._max_weights
+
+    def term_ids(self, tokens: List[str]) -> List[int]:
+        """
+        Term ids of the known tokens, in order (repeats kept, OOV dropped).
+        A pure lookup: queries never add terms to the vocabulary.
+        """
+        get = self._vocab.get
+        return [t for t in map(get, tokens) if t is not None]
+
+    def term_ids_array(self, tokens: Iterable[str]) -> np.ndarray:
+        """int32 term id per token, in order; -1 for out-of-vocabulary tokens."""
+        return np.fromiter(map(self._vocab.get, tokens, repeat(-1)), dtype=np.int32)
+
+    def oov_count(self, ids: np.ndarray) -> int:
+        """Tokens among term_ids_array() ids with no live postings (-1 or df == 0)."""
+        return int(ids.size - np.count_nonzero(self.df[ids[ids >= 0]] > 0))
+
+    def score_upper_bound(self, query_tokens: List[str]) -> float:
+        """
+        Upper bound on every doc's BM25 score for the query (and so on
+        max_score), from per-term max weights only; no postings are read.
+
+        A doc's score is summed token by token in query order; the bound
+        adds, in the same order, a value >= each token's weight (0.0 for
+        docs without the term). IEEE addition is monotone, so the bound is
+        >= every computed score, rounding included.
+        """
+        max_w = self.term_max_weights()
+        bound = 0.0
+        for t in self.term_ids(query_tokens):
+            bound += float(max_w[t])
+        return bound
+
+    # --- updates ---
+
+    def add_documents(self, tokenized: Iterable[List[str]]) -> np.ndarray:
+        """
+        Index new docs as a new segment; returns their doc indices.
+        Only the new docs are tokenized/counted; df, avgdl and idf are
+        updated in place (idf is O(vocab), postings are untouched).
+        """
+        first = self.num_slots
+        vocab = dict(self._vocab)   # copy-on-write: new terms go into a new vocab
+        df = array("q", self.df.tolist())
+        doc_len = array("i")
+        terms, docs, tfs = array("i"), array("i"), array("i")
+        for tokens in tokenized:
+            doc_idx = first + len(doc_len)
+            doc_len.append(len(tokens))
+            _count_postings(tokens, doc_idx, vocab, df, terms, docs, tfs)
+
+        if not doc_len:
+            return np.zeros(0, dtype=np.int64)
+
+        indptr, post_docs, post_tfs = _csr_from_triples(
+            _int32_view(terms), _int32_view(docs), _int32_view(tfs), len(vocab)
+        )
+        self._vocab = vocab
+        self.vocab = MappingProxyType(vocab)
+        self.df = np.asarray(df, dtype=np.int64)
+        self.doc_len = np.concatenate([self.doc_len, np.asarray(doc_len, dtype=np.int64)])
+        if self._live is not None:
+            self._live = np.concatenate([self._live, np.ones(len(doc_len), dtype=bool)])
+
+        seg = _Segment(indptr, post_docs, post_tfs)
+        self.segments.append(seg)
+        self.version += 1
+        self._refresh_stats()
+        self._materialize_weights(seg)
+        return np.arange(first, self.num_slots, dtype=np.int64)
+
+    def delete_documents(self, doc_indices: Iterable[int]) -> int:
+        """
+        Tombstone docs; their postings stay until merge() but no longer
+        count towards df/avgdl/idf and never show up in results.
+        Returns the number of docs actually deleted.
+        """
+        idx = np.unique(np.asarray(list(doc_indices), dtype=np.int64))
+        idx = idx[(idx >= 0) & (idx < self.num_slots)]
+        if self._live is None:
+            self._live = np.ones(self.num_slots, dtype=bool)
+        idx = idx[self._live[idx]]
+        if idx.size == 0:
+            return 0
+
+        df = self.df.copy()
+        for seg in self.segments:
+            hit = np.flatnonzero(np.isin(seg.post_docs, idx))
+            if hit.size:
+                t = np.searchsorted(seg.indptr, hit, side="right") - 1
+                df -= np.bincount(t, minlength=df.size)
+        self.df = df
+        self._live[idx] = False
+        self.deleted = np.union1d(self.deleted, idx)
+        self.version += 1
+        self._refresh_stats()
+        return int(idx.size)
+
+    def merge(self) -> Optional[np.ndarray]:
+        """
+        Fold all segments into one, dropping deleted docs, and materialize
+        weights for the current stats. Scores are the same as before the
+        merge (not necessarily bit-identical to a rebuild, see the class
+        docstring).
+
+        Returns an old -> new doc index map (-1 for dropped docs) if doc
+        indices were compacted, else None.
+        """
+        remap = None
+        if self.deleted.size:
+            remap = np.cumsum(self._live, dtype=np.int64) - 1
+            remap[~self._live] = -1
+
+        if len(self.segments) > 1 or remap is not None:
+            parts = []
+            for seg in self.segments:
+                terms = seg.term_ids()
+                docs = seg.post_docs.astype(np.int64)
+                tfs = seg.post_tfs
+                if remap is not None:
+                    keep = self._live[docs]
+                    terms, docs, tfs = terms[keep], remap[docs[keep]], tfs[keep]
+                parts.append((terms, docs, tfs))
+            # segments hold increasing doc ranges -> docs stay ascending per term
+            terms, docs, tfs = (np.concatenate(cols) for cols in zip(*parts))
+            indptr, post_docs, post_tfs = _csr_from_triples(terms, docs, tfs, len(self.vocab))
+            self.segments = [_Segment(indptr, post_docs, post_tfs)]
+
+        if remap is not None:
+            self.doc_len = self.doc_len[self._live]
+            self.deleted = np.zeros(0, dtype=np.int64)
+            self._live = None
+            self.version += 1
+            self._refresh_stats()
+
+        for seg in self.segments:
+            if seg.weights_version != self.version:
+                self._materialize_weights(seg)
+        return remap
+
+    # --- persistence ---
+
+    # Array files of the on-disk format; loaded with np.load(mmap_mode=...)
+    _ARRAYS = ("indptr", "post_docs", "post_tfs", "post_weights")
+
+    def save(self, path: str | Path) -> None:
+        """
+        Write the index as a directory of .npy arrays + JSON metadata:
+          meta.json, vocab.json (terms in id order), <array>.npy
+
+        Requires a single segment without deletions (call merge() first).
+        """
+        if len(self.segments) != 1 or self.deleted.size:
+            raise ValueError("Index has pending segments/deletions; merge() before save()")
+        seg = self.segments[0]
+        if seg.weights_version != self.version:
+            self._materialize_weights(seg)
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in self._ARRAYS:
+            np.save(path / f"{name}.npy", np.asarray(getattr(seg, name)))
+        for name in ("idf", "df", "doc_len"):
+            np.save(path / f"{name}.npy", np.asarray(getattr(self, name)))
+        np.save(path / "term_max_weights.npy", self.term_max_weights())
+        with open(path / "vocab.json", "w", encoding="utf-8") as f:
+            json.dump(list(self.vocab), f)
+        with open(path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "format_version": INDEX_FORMAT_VERSION,
+                "num_docs": self.num_docs,
+                "vocab_size": len(self.vocab),
+                "num_postings": self.num_postings,
+                "avgdl": self.avgdl,
+                "k1": self.k1,
+                "b": self.b,
+                "epsilon": self.epsilon,
+            }, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "InvertedIndex":
+        """
+        Load an index written by save(). With mmap=True the postings are
+        memory-mapped read-only: cold start does not touch them, and
+        processes loading the same files share their page cache.
+        """
+        path = Path(path)
+        with open(path / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != INDEX_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index format {meta.get('format_version')!r} at {path}"
+            )
+        with open(path / "vocab.json", "r", encoding="utf-8") as f:
+            vocab = {term: t for t, term in enumerate(json.load(f))}
+
+        mode = "r" if mmap else None
+        seg = _Segment(
+            *(np.load(path / f"{name}.npy", mmap_mode=mode) for name in cls._ARRAYS),
+            weights_version=0,
+        )
+        # Saved weights were computed from the saved idf/avgdl; reuse them
+        # so the O(vocab) idf pass is skipped at cold start.
+        index = cls(
+            vocab,
+            [seg],
+            df=np.load(path / "df.npy"),
+            doc_len=np.load(path / "doc_len.npy"),
+            k1=meta["k1"],
+            b=meta["b"],
+            epsilon=meta["epsilon"],
+            idf=np.load(path / "idf.npy"),
+            avgdl=meta["avgdl"],
+        )
+        # optional (older indexes lack it): computed on first use instead
+        if (path / "term_max_weights.npy").exists():
+            index._max_weights = np.load(path / "term_max_weights.npy")
+            index._max_weights_version = index.version
+        return index
+
+    # --- scoring ---
+
+    def _gather(
+        self, rows: np.ndarray, terms: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (row, doc, weight) for every live posting of the (row, term) pairs.
+        Within a doc, entries keep the order of the pairs (each doc lives in
+        exactly one segment).
+        """
+        out_rows, out_docs, out_w = [], [], []
+        for seg in self.segments:
+            ok = terms < seg.vocab_size
+            r, t = rows[ok], terms[ok]
+            pos, lens = _csr_positions(seg.indptr, t)
+            out_rows.append(np.repeat(r, lens))
+            out_docs.append(seg.post_docs[pos].astype(np.int64))
+            out_w.append(self._weights(seg, pos, np.repeat(t, lens)))
+
+        if len(self.segments) == 1:
+            rows, docs, weights = out_rows[0], out_docs[0], out_w[0]
+        else:
+            rows, docs, weights = (np.concatenate(x) for x in (out_rows, out_docs, out_w))
+        if self._live is not None:
+            keep = self._live[docs]
+            rows, docs, weights = rows[keep], docs[keep], weights[keep]
+        return rows, docs, weights
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (doc indices, BM25 weights) for a term; empty if OOV."""
+        t = self.vocab.get(term)
+        terms = np.asarray([] if t is None else [t], dtype=np.int64)
+        _, docs, weights = self._gather(np.zeros(terms.size, dtype=np.int64), terms)
+        return docs, weights
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        """Dense BM25 scores for all docs (drop-in for BM25Okapi.get_scores)."""
+        scores = np.zeros(self.num_slots)
+        for term in query_tokens:
+            docs, weights = self.postings(term)
+            # doc indices are unique within a term, so fancy-index += is safe
+            scores[docs] += weights
+        return scores
+
+    def score_candidates_batch(
+        self, queries_tokens: List[List[str]]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Sparse BM25 scores for a batch of queries in one sparse matrix product.
+
+        Returns one (doc indices, scores) pair per query, covering only docs
+        that share at least one term with it (every other doc scores 0.0).
+        Doc indices are ascending.
+
+        The query-term matrix is kept in COO form with one entry per token
+        occurrence; its postings are gathered in a single vectorized pass and
+        reduced with bincount. Entries are ordered (query, token, doc), so each
+        score is summed in the same order as get_scores() -> identical floats.
+        """
+        rows: List[int] = []
+        terms: List[int] = []
+        for row, tokens in enumerate(queries_tokens):
+            ids = self.term_ids(tokens)
+            rows.extend([row] * len(ids))
+            terms.extend(ids)
+
+        n_rows = len(queries_tokens)
+        if not terms:
+            empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+            return [empty] * n_rows
+
+        rows_arr, docs, weights = self._gather(
+            np.asarray(rows, dtype=np.int64), np.asarray(terms, dtype=np.int64)
+        )
+        n = self.num_slots
+        keys = rows_arr * n + docs
+        uniq, inv = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inv, weights=weights, minlength=uniq.size)
+
+        bounds = np.searchsorted(uniq // n, np.arange(n_rows + 1))
+        return [
+            (uniq[lo:hi] - row * n, sums[lo:hi])
+            for row, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))
+        ]
+
+    # --- pruned scoring ---
+
+    def _posting_lens(self, terms: np.ndarray) -> np.ndarray:
+        """Postings per term id, summed over segments (tombstoned docs included)."""
+        lens = np.zeros(terms.size, dtype=np.int64)
+        for seg in self.segments:
+            ok = terms < seg.vocab_size
+            t = terms[ok]
+            lens[ok] += seg.indptr[t + 1] - seg.indptr[t]
+        return lens
+
+    def _probe(self, terms: np.ndarray, docs: np.ndarray) -> np.ndarray:
+        """
+        Weight of term id terms[i] in live doc docs[i] (0.0 where absent),
+        by binary search in its postings instead of reading them. Entries
+        of the same term should be contiguous: one search per run.
+        """
+        out = np.zeros(docs.size)
+        runs = [0] + (np.flatnonzero(terms[1:] != terms[:-1]) + 1).tolist() + [terms.size]
+        for lo_i, hi_i in zip(runs[:-1], runs[1:]):
+            if lo_i == hi_i:
+                continue
+            t = int(terms[lo_i])
+            d = docs[lo_i:hi_i]
+            for seg in self.segments:
+                if t >= seg.vocab_size:
+                    continue
+                lo, hi = int(seg.indptr[t]), int(seg.indptr[t + 1])
+                if lo == hi:
+                    continue
+                plist = seg.post_docs[lo:hi]
+                i = np.minimum(np.searchsorted(plist, d), hi - lo - 1)
+                found = np.flatnonzero(plist[i] == d)
+                if found.size:
+                    pos = lo + i[found]
+                    out[lo_i + found] = self._weights(seg, pos, np.full(pos.size, t, dtype=np.int64))
+        return out
+
+    def score_candidates_pruned(
+        self,
+        query_tokens: List[str],
+        k: int,
+        floor: Optional[float] = None,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], Dict[str, Any]]:
+        """score_candidates_pruned_batch() for a single query."""
+        return self.score_candidates_pruned_batch([query_tokens], k, [floor])[0]
+
+    def score_candidates_pruned_batch(
+        self,
+        queries_tokens: List[List[str]],
+        k: int,
+        floors: Optional[List[Optional[float]]] = None,
+    ) -> List[Tuple[Optional[np.ndarray], Optional[np.ndarray], Dict[str, Any]]]:
+        """
+        MaxScore dynamic pruning for a batch of queries. Returns per query
+        (doc indices, scores, stats) of a candidate subset on which
+        top_k_docs(..., k, ...) selects exactly the same docs and scores as
+        on score_candidates_batch()'s candidates.
+
+        Term bounds are max weight x query count. theta, the k-th best
+        partial score so far, is a lower bound on the true k-th score; the
+        strongest list alone gives a first theta. Lists are essential while
+        the bounds of the lists after them sum to >= theta (an unseen doc
+        could still make the top k); those are read in full and merged.
+        The rest are only probed (binary search) for the docs already seen,
+        and docs whose partial score plus the remaining bound falls below
+        theta are dropped. Survivors are summed in query-token order, so
+        scores are bit-identical to score_candidates_batch on this index.
+
+        Every step runs over the whole batch at once: one gather per phase,
+        one probe round per list position.
+
+        floors: per query, stop early (docs = scores = None) once no doc
+        can reach it; stats["score_upper_bound"] is then the bound that
+        proved it.
+        stats: postings_total / postings_scored (read in full) /
+        postings_skipped (never read) / postings_probed (binary searches),
+        over distinct query terms.
+        """
+        n_rows = len(queries_tokens)
+        floors = floors if floors is not None else [None] * n_rows
+        out: List[Any] = [None] * n_rows
+        max_w = self.term_max_weights()
+        q_ids = [self.term_ids(tokens) for tokens in queries_tokens]
+        distinct = sorted({t for ids in q_ids for t in ids})
+        len_of = dict(zip(distinct, self._posting_lens(np.asarray(distinct, dtype=np.int64)).tolist()))
+
+        # --- per query: distinct terms by decreasing bound ---
+        plans: List[_PrunePlan] = []
+        exhaustive: List[_PrunePlan] = []
+        for row, ids in enumerate(q_ids):
+            plan = _PrunePlan(row, ids, floors[row])
+            counts = Counter(ids)
+            plan.stats["postings_total"] = sum(len_of[t] for t in counts)
+            # bounds need non-negative weights (idf > 0); else score exhaustively
+            if not counts or any(self.idf[t] <= 0 for t in counts):
+                plan.stats["postings_scored"] = plan.stats["postings_total"]
+                exhaustive.append(plan)
+                continue
+            bound = {t: n * float(max_w[t]) for t, n in counts.items()}
+            plan.terms = sorted(counts, key=bound.__getitem__, reverse=True)
+            plan.mult = [counts[t] for t in plan.terms]
+            plan.lens = [len_of[t] for t in plan.terms]
+            plan.bounds = [bound[t] for t in plan.terms]
+            plan.suffix = [0.0] * (len(plan.terms) + 1)
+            for j in range(len(plan.terms) - 1, -1, -1):
+                plan.suffix[j] = plan.suffix[j + 1] + plan.bounds[j]
+            plan.stop(plan.suffix[0])
+            plans.append(plan)
+            out[row] = (None, None, plan.stats)
+
+        if exhaustive:
+            scored = self.score_candidates_batch([queries_tokens[p.row] for p in exhaustive])
+            for plan, (docs, scores) in zip(exhaustive, scored):
+                out[plan.row] = (docs, scores, plan.stats)
+        if all(plan.stopped for plan in plans):
+            return out
+
+        # one pair per (query, distinct term); pair id = offset[p] + term position
+        n_plans = len(plans)
+        offset = np.zeros(n_plans + 1, dtype=np.int64)
+        np.cumsum([len(plan.terms) for plan in plans], out=offset[1:])
+        pair_plan = np.repeat(np.arange(n_plans), np.diff(offset))
+        pair_term = np.asarray([t for plan in plans for t in plan.terms], dtype=np.int64)
+        pair_mult = np.asarray([m for plan in plans for m in plan.mult], dtype=float)
+        pair_bound = np.asarray([b for plan in plans for b in plan.bounds])
+
+        def gather(pairs: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+            pairs_arr = np.asarray(pairs, dtype=np.int64)
+            return self._gather(pairs_arr, pair_term[pairs_arr])
+
+        # strongest list of each query first: its k-th weight is a first theta
+        first = [int(offset[p]) for p, plan in enumerate(plans) if not plan.stopped]
+        for p in pair_plan[first]:
+            plans[p].stats["postings_scored"] += plans[p].lens[0]
+        a_pairs, a_docs, a_w = gather(first)
+        theta, top = _group_kth_max(pair_plan[a_pairs], pair_mult[a_pairs] * a_w, n_plans, k)
+
+        # essential lists of every query, read together and merged once
+        essential: List[int] = []
+        for p, plan in enumerate(plans):
+            if plan.stopped or plan.stop(top[p] + plan.suffix[1]):
+                continue
+            j = 1
+            while j < len(plan.terms) and not (theta[p] > 0.0 and _below(plan.suffix[j], theta[p])):
+                j += 1
+            plan.n_read = j
+            plan.stats["postings_scored"] += sum(plan.lens[1:j])
+            essential.extend(range(int(offset[p]) + 1, int(offset[p]) + j))
+        b_pairs, b_docs, b_w = gather(essential)
+
+        live = np.asarray([not plan.stopped for plan in plans])
+        e_pairs = np.concatenate([a_pairs, b_pairs])
+        keep = live[pair_plan[e_pairs]]
+        e_pairs = e_pairs[keep]
+        e_docs = np.concatenate([a_docs, b_docs])[keep]
+        e_w = np.concatenate([a_w, b_w])[keep]
+        # each list is doc-ascending: a stable (merge) sort of the keys is
+        # cheaper than np.unique's quicksort
+        n = self.num_slots
+        keys = pair_plan[e_pairs] * n + e_docs
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        first_of_key = np.ones(keys.size, dtype=bool)
+        np.not_equal(keys[1:], keys[:-1], out=first_of_key[1:])
+        starts = np.flatnonzero(first_of_key)
+        uniq = keys[starts]
+        part = np.add.reduceat((pair_mult[e_pairs] * e_w)[order], starts) if starts.size else np.zeros(0)
+        cand_plan = uniq // n
+        cand_doc = uniq - cand_plan * n
+        kth, top = _group_kth_max(cand_plan, part, n_plans, k)
+        theta = np.maximum(theta, kth)
+
+        # non-essential lists, one round per list position: drop the
+        # candidates that cannot reach theta, probe the rest
+        n_terms = np.diff(offset)
+        pos = np.asarray([plan.n_read for plan in plans])
+        remaining = np.asarray([plan.suffix[plan.n_read] for plan in plans])
+        for p, plan in enumerate(plans):
+            if not plan.stopped:
+                plan.stop(top[p] + remaining[p])
+        idx = np.arange(uniq.size)
+        while True:
+            live = np.asarray([not plan.stopped for plan in plans])
+            rounds = np.flatnonzero(live & (pos < n_terms))
+            idx = idx[live[cand_plan[idx]]]
+            if rounds.size == 0:
+                break
+            idx_plan = cand_plan[idx]
+            probing = pos[idx_plan] < n_terms[idx_plan]
+            cut = _prune_cut(theta)
+            keep = ~probing | (part[idx] + remaining[idx_plan] >= cut[idx_plan])
+            idx, idx_plan, probing = idx[keep], idx_plan[keep], probing[keep]
+            sel = idx[probing]
+            pairs = offset[idx_plan[probing]] + pos[idx_plan[probing]]
+            pair_w = self._probe(pair_term[pairs], cand_doc[sel])
+            part[sel] += pair_mult[pairs] * pair_w
+            n_probed = np.bincount(idx_plan[probing], minlength=n_plans)
+            remaining[rounds] -= pair_bound[offset[rounds] + pos[rounds]]
+            pos[rounds] += 1
+            kth, top = _group_kth_max(idx_plan, part[idx], n_plans, k)
+            theta = np.maximum(theta, kth)
+            for p in rounds.tolist():
+                plans[p].stats["postings_probed"] += int(n_probed[p])
+                plans[p].stop(top[p] + remaining[p])
+        idx = idx[part[idx] >= _prune_cut(theta)[cand_plan[idx]]]
+
+        # exact scores of the survivors: probe them for every query token,
+        # then sum in query order (adding 0.0 for an absent term is exact)
+        ids_grid = np.full((n_plans, max(len(plan.ids) for plan in plans)), -1, dtype=np.int64)
+        for p, plan in enumerate(plans):
+            ids_grid[p, :len(plan.ids)] = plan.ids
+        grid = ids_grid[cand_plan[idx]].T   # (token position, survivor)
+        present = grid >= 0
+        token_w = np.zeros(grid.shape)
+        token_w[present] = self._probe(
+            grid[present], np.broadcast_to(cand_doc[idx], grid.shape)[present]
+        )
+        scores = np.zeros(idx.size)
+        for row in token_w:
+            scores += row
+
+        bounds = np.searchsorted(cand_plan[idx], np.arange(n_plans + 1))
+        for p, plan in enumerate(plans):
+            if plan.stopped:
+                continue
+            plan.stats["postings_skipped"] = (
+                plan.stats["postings_total"] - plan.stats["postings_scored"]
+            )
+            lo, hi = bounds[p], bounds[p + 1]
+            plan.stats["postings_probed"] += int(hi - lo) * len(plan.ids)
+            out[plan.row] = (cand_doc[idx[lo:hi]], scores[lo:hi], plan.stats)
+        return out
+
+
+class IndexBuilder:
+    """
+    Incremental InvertedIndex construction.
+
+    Docs are consumed one at a time (add) into int32 array('i') buffers of
+    (term, doc, tf) and flushed every chunk_size docs into NumPy arrays; no
+    token lists or raw text are kept. Resident memory is ~12 bytes per
+    posting + vocab + 4 bytes per doc length.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 10_000,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        epsilon: float = BM25_EPSILON,
+    ):
+        self.chunk_size = chunk_size
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.vocab: Dict[str, int] = {}
+        self.df = array("i")
+        self.doc_len = array("i")
+        self._chunks: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._terms, self._docs, self._tfs = array("i"), array("i"), array("i")
+
+    def add(self, tokens: List[str]) -> int:
+        """Add one tokenized doc; returns its doc index."""
+        doc_idx = len(self.doc_len)
+        self.doc_len.append(len(tokens))
+        _count_postings(tokens, doc_idx, self.vocab, self.df, self._terms, self._docs, self._tfs)
+
+        if len(self.doc_len) % self.chunk_size == 0:
+            self._flush()
+        return doc_idx
+
+    def _flush(self) -> None:
+        if self._terms:
+            # the views keep the buffers alive; new buffers for the next chunk
+            self._chunks.append((
+                _int32_view(self._terms), _int32_view(self._docs), _int32_view(self._tfs),
+            ))
+        self._terms, self._docs, self._tfs = array("i"), array("i"), array("i")
+
+    def finish(self) -> InvertedIndex:
+        self._flush()
+        if self._chunks:
+            terms, docs, tfs = (np.concatenate(cols) for cols in zip(*self._chunks))
+        else:
+            terms = docs = tfs = np.zeros(0, dtype=np.int32)
+        self._chunks = []
+
+        indptr, post_docs, post_tfs = _csr_from_triples(terms, docs, tfs, len(self.vocab))
+        del terms, docs, tfs  # unsorted copies; free before weights are materialized
+        vocab, self.vocab = self.vocab, {}   # the index owns (and freezes) it
+        return InvertedIndex(
+            vocab,
+            [_Segment(indptr, post_docs, post_tfs)],
+            df=np.asarray(self.df, dtype=np.int64),
+            doc_len=np.asarray(self.doc_len, dtype=np.int64),
+            k1=self.k1,
+            b=self.b,
+            epsilon=self.epsilon,
+        )
+
+
+def top_k_docs(
+    docs: np.ndarray,
+    scores: np.ndarray,
+    k: int,
+    num_docs: int,
+    deleted: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top-k over sparse candidate scores (docs not listed score 0.0).
+
+    num_docs is the number of doc indices; deleted (sorted) indices are
+    never returned. Uses argpartition-style selection (O(candidates))
+    instead of a full sort. Order is score desc, then doc index asc, so
+    ties are deterministic.
+    """
+    n_deleted = 0 if deleted is None else deleted.size
+    k = min(k, num_docs - n_deleted)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # Docs outside the candidate set all score 0.0; of those only the first k
+    # in doc order can make the cut, and only if candidates don't fill it.
+    if docs.size < k or scores.min() <= 0.0:
+        limit = min(num_docs, k + docs.size + n_deleted)
+        taken = docs[docs < limit]
+        if n_deleted:
+            taken = np.union1d(taken, deleted[deleted < limit])
+        pad = np.setdiff1d(np.arange(limit), taken, assume_unique=True)[:k]
+        docs = np.concatenate([docs, pad])
+        scores = np.concatenate([scores, np.zeros(pad.size)])
+
+    if docs.size > k:
+        kth = np.partition(scores, docs.size - k)[docs.size - k]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)
+        need = k - above.size
+        if need < ties.size:
+            ties = ties[np.argpartition(docs[ties], need - 1)[:need]]
+        sel = np.concatenate([above, ties])
+        docs, scores = docs[sel], scores[sel]
+
+    order = np.lexsort((docs, -scores))
+    return docs[order], scores[order]
 
 
 class BM25Retriever:
@@ -53,52 +1225,440 @@ class BM25Retriever:
     - deterministic
     - simple tokenizer
     - returns top-k doc ids and scores
+    - add_documents / delete_documents update the index in place
+    - optional QueryCache (self.cache) in front of retrieve / retrieve_many
+    - prune = True: retrieve() uses MaxScore dynamic pruning (same top-k)
     """
 
-    def __init__(self, corpus: List[Dict[str, str]]):
-        self.corpus = corpus
-        self.doc_ids = [d["doc_id"] for d in corpus]
-        self.texts = [d["text"] for d in corpus]
+    # Segment merge policy for add/delete
+    max_segments = 8
+    max_deleted_ratio = 0.2
+
+    def __init__(self, corpus: Iterable[Dict[str, str]], chunk_size: int = 10_000):
+        """
+        corpus: iterable of {"doc_id", "text"} dicts; consumed once, so a
+        generator works and no text is kept after indexing.
+        """
+        builder = IndexBuilder(chunk_size=chunk_size)
+        self.doc_ids: List[str] = []
+        for d in corpus:
+            self.doc_ids.append(d["doc_id"])
+            builder.add(self._tokenize(d["text"]))
+        self.index = builder.finish()
+        self.doc_store: Optional[DocStore] = None
+        self._doc_idx: Optional[Dict[str, int]] = None
+        self.cache = None
+        self.prune = False
+
+    @classmethod
+    def from_jsonl(cls, path: str | Path, chunk_size: int = 10_000) -> "BM25Retriever":
+        """
+        Stream-index a corpus JSONL file. Texts stay on disk; a DocStore of
+        byte offsets is attached for lazy lookup (get_text).
+        """
+        offsets: List[int] = []
+
+        def docs():
+            for offset, d in iter_corpus_jsonl_with_offsets(path):
+                offsets.append(offset)
+                yield d
+
+        self = cls(docs(), chunk_size=chunk_size)
+        self.doc_store = DocStore(path, np.asarray(offsets, dtype=np.int64), self.doc_ids)
+        return self
+
+    def get_text(self, doc_id: str) -> str:
+        if self.doc_store is None:
+            raise ValueError("No DocStore attached (build with from_jsonl)")
+        return self.doc_store.get_text(doc_id)
+
+    def add_documents(self, docs: Iterable[Dict[str, str]]) -> None:
+        """
+        Index new {"doc_id", "text"} docs without rebuilding.
+        Re-adding an existing doc_id replaces the old version.
+        """
+        docs = list(docs)
+        if not docs:
+            return
+        self.delete_documents(d["doc_id"] for d in docs)
+        self.index.add_documents(self._tokenize(d["text"]) for d in docs)
+        self.doc_ids.extend(d["doc_id"] for d in docs)
+        self._doc_idx = None
+        if self.doc_store is not None:
+            self.doc_store.append(docs)
+        self._maybe_merge()
+
+    def delete_documents(self, doc_ids: Iterable[str]) -> int:
+        """Remove docs by id; unknown ids are ignored. Returns #deleted."""
+        if self._doc_idx is None:
+            self._doc_idx = {d: i for i, d in enumerate(self.doc_ids)}
+        idx = [self._doc_idx[d] for d in doc_ids if d in self._doc_idx]
+        n = self.index.delete_documents(idx)
+        if n:
+            self._maybe_merge()
+        return n
+
+    def _maybe_merge(self) -> None:
+        index = self.index
+        if (len(index.segments) > self.max_segments
+                or index.deleted.size > self.max_deleted_ratio * max(1, index.num_slots)):
+            self.merge()
+
+    def merge(self) -> None:
+        """Compact index segments and drop deleted docs (doc_ids/doc_store follow)."""
+        remap = self.index.merge()
+        if remap is not None:
+            self.doc_ids = [d for d, r in zip(self.doc_ids, remap) if r >= 0]
+            self._doc_idx = None
+            if self.doc_store is not None:
+                self.doc_store.compact(remap, self.doc_ids)
+
+    def save(self, path: str | Path) -> None:
+        """Persist the index (+ doc ids, doc offsets) so later runs can load() it."""
+        path = Path(path)
+        self.merge()
+        self.index.save(path)
+        with open(path / "doc_ids.json", "w", encoding="utf-8") as f:
+            json.dump(self.doc_ids, f)
+        if self.doc_store is not None:
+            np.save(path / "doc_offsets.npy", np.asarray(self.doc_store.offsets))
+            with open(path / "doc_store.json", "w", encoding="utf-8") as f:
+                json.dump({
+                    "corpus_path": str(self.doc_store.corpus_path),
+                    # docs added after indexing are not in the corpus file
+                    "extra": {str(i): d for i, d in self.doc_store._extra.items()},
+                }, f)
 
-        self.tokenized = [self._tokenize(t) for t in self.texts]
-        self.bm25 = BM25Okapi(self.tokenized)
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "BM25Retriever":
+        """
+        Open a saved index without reading or tokenizing the corpus.
+        Doc texts, if the index was built with from_jsonl, are read lazily.
+        """
+        path = Path(path)
+        self = cls.__new__(cls)
+        self.index = InvertedIndex.load(path, mmap=mmap)
+        with open(path / "doc_ids.json", "r", encoding="utf-8") as f:
+            self.doc_ids = json.load(f)
+
+        self._doc_idx = None
+        self.doc_store = None
+        self.cache = None
+        self.prune = False
+        if (path / "doc_store.json").exists():
+            with open(path / "doc_store.json", "r", encoding="utf-8") as f:
+                info = json.load(f)
+            offsets = np.load(path / "doc_offsets.npy", mmap_mode="r" if mmap else None)
+            self.doc_store = DocStore(info["corpus_path"], offsets, self.doc_ids)
+            self.doc_store._extra = {int(i): d for i, d in info.get("extra", {}).items()}
+        return self
 
     @staticmethod
     def _tokenize(text: str) -> List[str]:
         # Simple + stable tokenizer (avoid overfitting debate)
         # - lowercase
         # - keep alnum tokens
-        return re.findall(r"[a-z0-9]+", text.lower())
+        return _TOKEN_RE.findall(text.lower())
+
+    def term_ids_from_text(self, text: str) -> np.ndarray:
+        """
+        Tokenize straight to int32 term ids through the frozen vocabulary,
+        in order; -1 marks out-of-vocabulary tokens.
+        """
+        return self.index.term_ids_array(_TOKEN_RE.findall(text.lower()))
 
-    def retrieve(self, query: str, top_k: int = 5) -> RetrievalResult:
+    def unscored_result(
+        self,
+        query: str,
+        score_upper_bound: Optional[float] = None,
+        tokenize_ns: int = 0,
+        score_ns: int = 0,
+        q_tokens: Optional[List[str]] = None,
+    ) -> RetrievalResult:
+        """
+        Placeholder result for a query stopped before (or while) scoring;
+        score_ns is the time spent proving it could not reach the floor.
+        q_tokens: the query's tokens, if it was tokenized (token counts).
+        """
+        return RetrievalResult(
+            query=query,
+            retrieved_doc_ids=[],
+            retrieved_scores=[],
+            max_score=0.0,
+            retrieval_latency_ms=ns_to_ms(tokenize_ns + score_ns),
+            top1_doc_id=None,
+            top2_doc_id=None,
+            top1_score=0.0,
+            top2_score=0.0,
+            score_gap_12=0.0,
+            conflict_candidate=False,
+            tokenize_us=ns_to_us(tokenize_ns),
+            score_us=ns_to_us(score_ns),
+            skipped_scoring=True,
+            score_upper_bound=score_upper_bound,
+            **self._token_counts(q_tokens),
+        )
+
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 5,
+        min_score: Optional[float] = None,
+    ) -> RetrievalResult:
+        """
+        min_score: if the query's score_upper_bound is below it, no doc can
+        reach min_score; scoring is skipped and an unscored result
+        (max_score 0.0, skipped_scoring=True) is returned. Any gate that
+        stops on max_score < min_score decides the same either way.
+        With self.prune, min_score is also the floor of the pruned scorer,
+        which can stop partway through the postings.
+        """
+        t0 = perf_counter_ns()
         q_tokens = self._tokenize(query)
+        t1 = perf_counter_ns()
+        if TRACER.enabled:
+            TRACER.record("tokenize", t0, t1, "retrieval")
+        if min_score is not None:
+            bound = self.index.score_upper_bound(q_tokens)
+            if bound < min_score:
+                t2 = perf_counter_ns()
+                if TRACER.enabled:
+                    TRACER.record("score_bound", t1, t2, "retrieval", bound=bound)
+                return self.unscored_result(query, bound, t1 - t0, t2 - t1, q_tokens)
+            # a passing bound check is counted in the score span
+        if self.cache is not None:
+            key = (top_k, tuple(q_tokens))
+            hit = self.cache.get(key, self.index.version, query, t0, t1 - t0)
+            if hit is not None:
+                return hit
+
+        # on a miss the (sub-microsecond) lookup is counted in the score span
+        pstats = None
+        if self.prune:
+            docs, scores, pstats = self.index.score_candidates_pruned(q_tokens, top_k, min_score)
+        else:
+            docs, scores = self.index.score_candidates_batch([q_tokens])[0]
+        t2 = perf_counter_ns()
+        if TRACER.enabled:
+            TRACER.record("score", t1, t2, "retrieval",
+                          candidates=-1 if docs is None else len(docs))
+        result = self._scored_result(
+            query, q_tokens, docs, scores, pstats, top_k, t1 - t0, t2 - t1
+        )
+        if docs is None:
+            return result
+        if self.cache is not None:
+            result = self.cache.put(key, self.index.version, result)
+        return result
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        batch_size: int = 64,
+        min_score: Optional[float] = None,
+    ) -> List[RetrievalResult]:
+        """
+        Batched retrieve(): one sparse (queries x terms) @ (terms x docs)
+        product per batch instead of one scoring pass per query. Only
+        candidate docs are materialized, so memory is O(postings touched).
+
+        Results are identical to calling retrieve() per query.
+        Tokenize / score spans are the batch times amortized per query
+        (score over the queries actually scored); top-k is timed per query.
+        min_score: queries whose score_upper_bound is below it get an
+        unscored result, as in retrieve(), and are left out of the batch.
+        With a cache, only misses are scored, each distinct one once.
+        With self.prune, the batch goes through the pruned scorer with
+        min_score as its floor, as in retrieve().
+        """
+        results: List[RetrievalResult] = []
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+
+            t0 = perf_counter_ns()
+            q_tokens = [self._tokenize(q) for q in batch]
+            t1 = perf_counter_ns()
+            tokenize_ns = (t1 - t0) // len(batch)
+            if TRACER.enabled:
+                TRACER.record("tokenize_batch", t0, t1, "retrieval", queries=len(batch))
+
+            out: List[Optional[RetrievalResult]] = [None] * len(batch)
+            bound_ns = 0
+            if min_score is not None:
+                self._unscored_below(batch, q_tokens, min_score, tokenize_ns, out)
+                # a passing bound check is counted in the score span
+                bound_ns = (perf_counter_ns() - t1) // len(batch)
+            todo = [i for i, r in enumerate(out) if r is None]
+            repeats: List[int] = []
+            if self.cache is not None:
+                todo, repeats = self._cache_lookup_batch(batch, q_tokens, top_k, tokenize_ns, out, todo)
+
+            t1 = perf_counter_ns()
+            todo_tokens = [q_tokens[i] for i in todo]
+            if not todo:
+                scored = []
+            elif self.prune:
+                scored = self.index.score_candidates_pruned_batch(
+                    todo_tokens, top_k, [min_score] * len(todo)
+                )
+            else:
+                scored = [(d, s, None) for d, s in self.index.score_candidates_batch(todo_tokens)]
+            t2 = perf_counter_ns()
+            score_ns = (t2 - t1) // max(1, len(todo)) + bound_ns
+            if TRACER.enabled and todo:
+                TRACER.record("score_batch", t1, t2, "retrieval", queries=len(todo))
+
+            for i, (docs, scores, pstats) in zip(todo, scored):
+                out[i] = self._scored_result(
+                    batch[i], q_tokens[i], docs, scores, pstats, top_k, tokenize_ns, score_ns
+                )
+                if self.cache is not None and docs is not None:
+                    out[i] = self.cache.put((top_k, tuple(q_tokens[i])), self.index.version, out[i])
+            for i in repeats:
+                # same tokens as an earlier miss in this batch: now cached
+                t_q = perf_counter_ns() - tokenize_ns
+                out[i] = (
+                    self.cache.get((top_k, tuple(q_tokens[i])), self.index.version,
+                                   batch[i], t_q, tokenize_ns)
+                    or self.retrieve(batch[i], top_k, min_score)
+                )
+            results.extend(out)
+        return results
 
-        t0 = time.perf_counter()
-        scores = self.bm25.get_scores(q_tokens)
-        latency_ms = int((time.perf_counter() - t0) * 1000)
+    def unscored_below(self, queries: List[str], min_score: float) -> List[Optional[RetrievalResult]]:
+        """
+        retrieve()'s bound check on its own: per query, an unscored result
+        if its score_upper_bound is below min_score, else None. Lets a
+        caller that shares one scored retrieval across gates give a gate
+        with that floor what it would have retrieved itself.
+        """
+        t0 = perf_counter_ns()
+        q_tokens = [self._tokenize(q) for q in queries]
+        tokenize_ns = (perf_counter_ns() - t0) // max(1, len(queries))
+        out: List[Optional[RetrievalResult]] = [None] * len(queries)
+        self._unscored_below(queries, q_tokens, min_score, tokenize_ns, out)
+        return out
 
-        scores = np.asarray(scores, dtype=float)
-        if scores.size == 0:
+    def _unscored_below(
+        self,
+        batch: List[str],
+        q_tokens: List[List[str]],
+        min_score: float,
+        tokenize_ns: int,
+        out: List[Optional[RetrievalResult]],
+    ) -> None:
+        """Fill `out` with unscored results where the score bound is below min_score."""
+        for i, (query, tokens) in enumerate(zip(batch, q_tokens)):
+            t0 = perf_counter_ns()
+            bound = self.index.score_upper_bound(tokens)
+            if bound < min_score:
+                out[i] = self.unscored_result(
+                    query, bound, tokenize_ns, perf_counter_ns() - t0, tokens
+                )
+
+    def _cache_lookup_batch(
+        self,
+        batch: List[str],
+        q_tokens: List[List[str]],
+        top_k: int,
+        tokenize_ns: int,
+        out: List[Optional[RetrievalResult]],
+        indices: List[int],
+    ) -> Tuple[List[int], List[int]]:
+        """
+        Fill `out` with cache hits among `indices`. Returns (indices to
+        score, indices repeating an earlier miss of this batch).
+        """
+        todo: List[int] = []
+        repeats: List[int] = []
+        missed = set()
+        for i in indices:
+            query, tokens = batch[i], q_tokens[i]
+            key = (top_k, tuple(tokens))
+            if key in missed:
+                repeats.append(i)
+                continue
+            hit = self.cache.get(key, self.index.version, query,
+                                 perf_counter_ns() - tokenize_ns, tokenize_ns)
+            if hit is None:
+                missed.add(key)
+                todo.append(i)
+            else:
+                out[i] = hit
+        return todo, repeats
+
+    def _scored_result(
+        self,
+        query: str,
+        q_tokens: List[str],
+        docs: Optional[np.ndarray],
+        scores: Optional[np.ndarray],
+        pstats: Optional[Dict[str, Any]],
+        top_k: int,
+        tokenize_ns: int,
+        score_ns: int,
+    ) -> RetrievalResult:
+        """_make_result(), plus the postings stats of the pruned scorer (pstats)."""
+        if pstats is None:
+            return self._make_result(query, q_tokens, docs, scores, top_k, tokenize_ns, score_ns)
+        if docs is None:
+            # pruned scoring proved no doc reaches min_score
+            result = self.unscored_result(
+                query, pstats["score_upper_bound"], tokenize_ns, score_ns, q_tokens
+            )
+        else:
+            result = self._make_result(query, q_tokens, docs, scores, top_k, tokenize_ns, score_ns)
+        return dataclasses.replace(
+            result,
+            postings_total=pstats["postings_total"],
+            postings_skipped=pstats["postings_skipped"],
+        )
+
+    def _token_counts(self, q_tokens: Optional[List[str]]) -> Dict[str, Optional[int]]:
+        """query_tokens / oov_tokens of a RetrievalResult (None if not tokenized)."""
+        if q_tokens is None:
+            return {"query_tokens": None, "oov_tokens": None}
+        ids = self.index.term_ids_array(q_tokens)
+        return {"query_tokens": int(ids.size), "oov_tokens": self.index.oov_count(ids)}
+
+    def _make_result(
+        self,
+        query: str,
+        q_tokens: List[str],
+        docs: np.ndarray,
+        scores: np.ndarray,
+        top_k: int,
+        tokenize_ns: int,
+        score_ns: int,
+    ) -> RetrievalResult:
+        counts = self._token_counts(q_tokens)
+        t0 = perf_counter_ns()
+        if self.index.num_docs == 0:
             return RetrievalResult(
                 query=query,
                 retrieved_doc_ids=[],
                 retrieved_scores=[],
                 max_score=0.0,
-                retrieval_latency_ms=latency_ms,
+                retrieval_latency_ms=ns_to_ms(tokenize_ns + score_ns),
                 top1_doc_id=None,
                 top2_doc_id=None,
                 top1_score=0.0,
                 top2_score=0.0,
                 score_gap_12=0.0,
                 conflict_candidate=False,
+                tokenize_us=ns_to_us(tokenize_ns),
+                score_us=ns_to_us(score_ns),
+                **counts,
             )
 
-        # Top-k
-        k = min(top_k, scores.size)
-        top_idx = scores.argsort()[::-1][:k]
+        # Top-k (partial selection, ties broken by doc order)
+        top_idx, top_scores = top_k_docs(
+            docs, scores, top_k, self.index.num_slots, self.index.deleted
+        )
 
         retrieved_doc_ids = [self.doc_ids[i] for i in top_idx]
-        retrieved_scores = [float(scores[i]) for i in top_idx]
+        retrieved_scores = [float(x) for x in top_scores]
         max_score = float(retrieved_scores[0]) if retrieved_scores else 0.0
 
         # Heuristic conflict candidate:
@@ -110,21 +1670,57 @@ class BM25Retriever:
         # Default heuristic threshold; can be tuned later
         conflict_candidate = (len(retrieved_scores) >= 2) and (score_gap_12 <= 0.05 * max(1.0, top1_score))
 
+        t1 = perf_counter_ns()
+        topk_ns = t1 - t0
+        if TRACER.enabled:
+            TRACER.record("topk", t0, t1, "retrieval")
         return RetrievalResult(
             query=query,
             retrieved_doc_ids=retrieved_doc_ids,
             retrieved_scores=retrieved_scores,
             max_score=max_score,
-            retrieval_latency_ms=latency_ms,
+            retrieval_latency_ms=ns_to_ms(tokenize_ns + score_ns + topk_ns),
             top1_doc_id=retrieved_doc_ids[0] if len(retrieved_doc_ids) >= 1 else None,
             top2_doc_id=retrieved_doc_ids[1] if len(retrieved_doc_ids) >= 2 else None,
             top1_score=top1_score,
             top2_score=top2_score,
             score_gap_12=score_gap_12,
             conflict_candidate=conflict_candidate,
+            tokenize_us=ns_to_us(tokenize_ns),
+            score_us=ns_to_us(score_ns),
+            topk_us=ns_to_us(topk_ns),
+            **counts,
         )
 
 
+def load_or_build_retriever(
+    corpus_path: str | Path,
+    index_path: str | Path,
+) -> BM25Retriever:
+    """
+    Load the index at index_path if it was built from the current corpus
+    file; otherwise build it from corpus_path and save it there.
+    """
+    corpus_path, index_path = Path(corpus_path), Path(index_path)
+    st = corpus_path.stat()
+    source = {"corpus_path": str(corpus_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    source_file = index_path / "source.json"
+    if source_file.exists():
+        with open(source_file, "r", encoding="utf-8") as f:
+            if json.load(f) == source:
+                try:
+                    return BM25Retriever.load(index_path)
+                except (OSError, ValueError, KeyError):
+                    pass  # unreadable / old format -> rebuild below
+
+    retriever = BM25Retriever.from_jsonl(corpus_path)
+    retriever.save(index_path)
+    with open(source_file, "w", encoding="utf-8") as f:
+        json.dump(source, f, indent=2)
+    return retriever
+
+
 def make_retrieval_fn_max_score(retriever: BM25Retriever, top_k: int = 5):
     """
     Adapter for tune_threshold.py: returns only max_score.
@@ -1,90 +1,250 @@
+import argparse
 import json
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 import sys
 
-from bench.retrieval import load_corpus_jsonl, BM25Retriever
+from bench.retrieval import RetrievalResult, load_or_build_retriever
 from bench.rag_baseline_naive import RAGBaselineNaive
 from bench.rag_baseline_threshold import RAGBaselineThreshold
 from bench.rag_stop_first import RAGStopFirst
+from bench.llm_cache import GenerationCache
+# tau constants and gate CLI helpers live in gate_cascade (no LLM imports)
+from bench.gate_cascade import (
+    TAU_STOP, TAU_THRESHOLD, GateCascade, add_gate_args, cascade_from_args,
+)
+from bench.prompt import ContextBuilder
+from bench.query_cache import QueryCache
+from bench.results_store import FORMATS, open_result_writer
+from bench.tracing import TRACER
+from bench.llm_backend import (
+    BACKENDS, LLMBackend, MockBackend, StreamingGenerate, make_backend,
+)
 
 # Import Ollama LLM
 try:
-    from bench.llm_ollama import ollama_generate, check_model_available
+    from bench.llm_ollama import check_model_available
     USE_OLLAMA = True
 except ImportError:
     print("Warning: ollama not available, using mock LLM")
     USE_OLLAMA = False
 
 
-# -------------------------
-# Mock LLM (fallback)
-# -------------------------
-def mock_llm_generate(query, retrieval):
-    # Deterministic + cheap
-    return {
-        "prompt_tokens": 120,
-        "gen_tokens": 180,
-        "latency_ms": 60,
-    }
+DEFAULT_OUTPUTS = {
+    "jsonl": "results/run_results.jsonl",
+    "columnar": "results/run_results",
+}
+
+
+def select_backend(
+    name: str = "auto",
+    context: Optional[ContextBuilder] = None,
+    cache: bool = False,
+    **fake_kwargs,
+) -> LLMBackend:
+    """
+    name: "auto" (Ollama if the model is available, else mock) or one of
+    BACKENDS. context builds prompts from doc text (ollama / fake);
+    cache=True enables the Ollama generation cache (off by default: hits
+    replay stored latencies instead of measuring the model);
+    fake_kwargs configure FakeBackend.
+    """
+    if name in ("auto", "ollama"):
+        if USE_OLLAMA and check_model_available():
+            print("\n✓ Using Ollama (phi3:mini)")
+            # deterministic generation -> identical prompts are served from cache
+            return make_backend(
+                "ollama", cache=GenerationCache() if cache else None, context=context
+            )
+        print("\nFalling back to mock LLM")
+        return MockBackend()
+
+    if name == "fake":
+        print(f"\n✓ Using fake LLM backend {fake_kwargs or ''}")
+        return make_backend("fake", context=context, **fake_kwargs)
+
+    print(f"\n✓ Using {name} LLM")
+    return make_backend(name)
+
+
+def add_backend_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--backend", default="auto", choices=("auto",) + BACKENDS)
+    parser.add_argument("--fake-slots", type=int, default=1,
+                        help="fake backend: concurrent generation slots")
+    parser.add_argument("--fake-time-scale", type=float, default=1.0,
+                        help="fake backend: wall-clock scale (0 = no sleeping)")
+    parser.add_argument("--context-budget", type=int, default=512,
+                        help="prompt token budget for packed document context")
+    parser.add_argument("--llm-cache", action="store_true",
+                        help="serve repeated Ollama prompts from results/llm_cache.sqlite "
+                             "(hits report the stored generation latency)")
+
+
+def check_backend_args(parser: argparse.ArgumentParser, args) -> None:
+    """Reject backend options that would be silently ignored."""
+    if getattr(args, "stream", False) and args.llm_cache:
+        parser.error("--stream never reads or writes the generation cache; drop --llm-cache")
+
+
+def backend_from_args(args, context: Optional[ContextBuilder] = None) -> LLMBackend:
+    fake_kwargs = {}
+    if args.backend == "fake":
+        fake_kwargs = {"slots": args.fake_slots, "time_scale": args.fake_time_scale}
+    return select_backend(args.backend, context=context, cache=args.llm_cache, **fake_kwargs)
+
+
+def context_from_args(args, retriever) -> ContextBuilder:
+    """Packs real passage text (DocStore lookup by doc_id) into prompts."""
+    return ContextBuilder(
+        retriever.get_text,
+        token_budget=args.context_budget,
+        text_version=lambda: retriever.index.version,
+    )
+
+
+def add_query_cache_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--query-cache", type=int, default=0, metavar="ENTRIES",
+                        help="cache retrieval + gate results per normalized query (0 = off)")
+    parser.add_argument("--query-cache-ttl", type=float, default=None, metavar="SECONDS",
+                        help="expire query cache entries after SECONDS (default: never)")
+
+
+def query_cache_from_args(args) -> Optional[QueryCache]:
+    if args.query_cache <= 0:
+        return None
+    return QueryCache(max_entries=args.query_cache, ttl_s=args.query_cache_ttl)
+
+
+def add_retrieval_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--prune-retrieval", action="store_true",
+                        help="MaxScore dynamic pruning in retrieval (same top-k, fewer postings "
+                             "read; currently slower than exhaustive scoring, see docs/repro.md)")
 
 
 def load_queries(path: str) -> List[Dict]:
+    """JSON array, or JSONL (one query object per line) for *.jsonl."""
     with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
         return json.load(f)
 
 
+def make_variants(
+    retriever,
+    llm_generate_fn,
+    context: Optional[ContextBuilder] = None,
+    cascade: Optional[GateCascade] = None,
+) -> list:
+    """The three benchmark variants, in output order (cascade: stop-first gate)."""
+    return [
+        RAGBaselineNaive(retriever, llm_generate_fn, context),
+        RAGBaselineThreshold(retriever, TAU_THRESHOLD, llm_generate_fn, context),
+        RAGStopFirst(retriever, TAU_STOP, llm_generate_fn, context, cascade),
+    ]
+
+
+def variant_retrievals(variants, retriever, query_texts: List[str]) -> List[List[RetrievalResult]]:
+    """
+    Per query, the RetrievalResult each variant sees. Queries are scored
+    once and shared, except that a variant with a score_floor gets an
+    unscored result where the query's score bound is below its floor:
+    what it would retrieve on its own, with the same gate decision.
+    """
+    shared = retriever.retrieve_many(query_texts)
+    below = {
+        floor: retriever.unscored_below(query_texts, floor)
+        for floor in {rag.score_floor for rag in variants} - {None}
+    }
+    return [
+        [(below[rag.score_floor][i] if rag.score_floor is not None else None) or r
+         for rag in variants]
+        for i, r in enumerate(shared)
+    ]
+
+
+def run_queries(variants, retriever, query_texts: List[str], writer) -> int:
+    """
+    Retrieve once per query (see variant_retrievals), run each variant and
+    write one row per (query, variant) in that order to a
+    bench.results_store writer. Returns the number of rows written.
+    """
+    n = 0
+    retrievals = variant_retrievals(variants, retriever, query_texts)
+    for query_text, per_variant in zip(query_texts, retrievals):
+        for rag, retrieval in zip(variants, per_variant):
+            writer.write(rag.run(query_text, retrieval))
+            n += 1
+    return n
+
+
+def add_output_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--format", default="jsonl", choices=FORMATS,
+                        help="jsonl: nested JSON rows; columnar: chunked .npz column files")
+    parser.add_argument("--output", default=None,
+                        help="default: results/run_results.jsonl (jsonl) "
+                             "or results/run_results/ (columnar)")
+    parser.add_argument("--trace", default=None, metavar="PATH",
+                        help="record spans and write a Chrome-trace/Perfetto JSON file")
+
+
+def output_path_from_args(args) -> Path:
+    if args.output is not None:
+        return Path(args.output)
+    return Path(DEFAULT_OUTPUTS[args.format])
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Stop-first benchmark runner")
+    add_backend_args(parser)
+    parser.add_argument("--stream", action="store_true",
+                        help="stream generations and record TTFT / inter-token latency")
+    add_query_cache_args(parser)
+    add_retrieval_args(parser)
+    add_gate_args(parser)
+    add_output_args(parser)
+    args = parser.parse_args()
+    check_backend_args(parser, args)
+
     # paths
     corpus_path = "corpus/corpus.jsonl"
+    index_path = "index/bm25"
     queries_path = "datasets/test_queries.json"
-    output_path = Path("results/run_results.jsonl")
-    output_path.parent.mkdir(exist_ok=True)
-
-    # Select LLM
-    if USE_OLLAMA:
-        if not check_model_available():
-            print("\nFalling back to mock LLM")
-            llm_generate_fn = mock_llm_generate
-        else:
-            print("\n✓ Using Ollama (phi3:mini)")
-            llm_generate_fn = ollama_generate
-    else:
-        print("\n✓ Using mock LLM")
-        llm_generate_fn = mock_llm_generate
+    output_path = output_path_from_args(args)
+    if args.trace:
+        TRACER.enable()
 
     # load
-    corpus = load_corpus_jsonl(corpus_path)
-    retriever = BM25Retriever(corpus)
+    retriever = load_or_build_retriever(corpus_path, index_path)
+    retriever.cache = query_cache_from_args(args)
+    retriever.prune = args.prune_retrieval
+    context = context_from_args(args, retriever)
 
-    queries = load_queries(queries_path)
+    # Select LLM
+    llm_generate_fn = backend_from_args(args, context)
+    if args.stream:
+        llm_generate_fn = StreamingGenerate(llm_generate_fn)
+    cache = getattr(llm_generate_fn, "cache", None)
 
-    # tau calibrated for BM25 score meaningfulness
-    # answerable min=2.58, all pass at τ=2.0
-    TAU_THRESHOLD = 2.0      # BM25 score threshold (recall=1.0)
-    TAU_STOP = 2.0           # stop-first uses same base threshold
+    queries = load_queries(queries_path)
 
     # variants
-    rag_naive = RAGBaselineNaive(retriever, llm_generate_fn)
-    rag_threshold = RAGBaselineThreshold(retriever, TAU_THRESHOLD, llm_generate_fn)
-    rag_stop_first = RAGStopFirst(retriever, TAU_STOP, llm_generate_fn)
-
-    variants = [
-        rag_naive,
-        rag_threshold,
-        rag_stop_first,
-    ]
+    cascade = cascade_from_args(args, retriever)
+    variants = make_variants(retriever, llm_generate_fn, context, cascade)
 
     # run
-    with open(output_path, "w", encoding="utf-8") as out:
-        for q in queries:
-            query_text = q["question"]
-
-            for rag in variants:
-                result = rag.run(query_text)
-                out.write(json.dumps(result.__dict__, default=str) + "\n")
+    query_texts = [q["question"] for q in queries]
+    with open_result_writer(output_path, args.format) as writer:
+        run_queries(variants, retriever, query_texts, writer)
 
     print(f"Saved results to {output_path}")
+    if args.trace:
+        print(f"Trace: {TRACER.export_chrome_trace(args.trace)} ({len(TRACER.events)} spans)")
+    print(f"Gate cascade: {cascade.stats()}")
+    if retriever.cache is not None:
+        print(f"Query cache: {retriever.cache.stats()}")
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}")
+        cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+"""
+Async benchmark runner: keeps up to N LLM generations in flight.
+
+Same variants, gates and output rows as run.py, but generation calls are
+awaited concurrently (LLMBackend.agenerate, e.g. ollama.AsyncClient) by a
+fixed pool of --max-in-flight workers pulling from a queue. Retrieval runs
+one chunk of queries at a time as the queue drains and gating inline in
+the worker; rows are written in the same (query, variant) order as run.py
+as soon as every earlier row is done.
+
+Usage:
+  PYTHONPATH=. python3 bench/run_async.py --max-in-flight 4
+  PYTHONPATH=. python3 bench/run_async.py --backend fake --fake-slots 8 --max-in-flight 64
+"""
+import argparse
+import asyncio
+import time
+from time import perf_counter_ns
+
+from bench.retrieval import load_or_build_retriever
+from bench.rag_baseline_naive import RAGBaselineNaive
+from bench.rag_baseline_threshold import RAGBaselineThreshold
+from bench.rag_stop_first import RAGStopFirst
+from bench.run import (
+    load_queries, add_backend_args, add_gate_args, add_output_args, add_query_cache_args,
+    add_retrieval_args, backend_from_args, cascade_from_args, context_from_args, output_path_from_args,
+    query_cache_from_args, variant_retrievals, TAU_THRESHOLD, TAU_STOP,
+)
+from bench.query_cache import cached_gate
+from bench.results_store import open_result_writer
+from bench.timing import elapsed_ms, elapsed_us
+from bench.tracing import TRACER
+
+
+async def run_one(rag, query, retrieval, agenerate_fn):
+    t_start = perf_counter_ns()
+    # requests overlap on one thread: one trace track per request
+    tid = id(asyncio.current_task())
+
+    # --- prompt cost (estimated before any LLM call) ---
+    est_prompt_tokens = None
+    spans = {}
+    if rag.context is not None:
+        t_prompt = perf_counter_ns()
+        est_prompt_tokens = rag.context.estimate_prompt_tokens(query, retrieval)
+        spans["prompt_us"] = elapsed_us(t_prompt)
+
+    # --- gate (sync, cheap) ---
+    extra = {}
+    t_gate_start = perf_counter_ns()
+    if hasattr(rag, "cascade"):
+        decision, stop_reason, exit_stage, gate_cache_hit = cached_gate(
+            rag, retrieval, rag.gate_with_stage
+        )
+        extra["gate_exit_stage"] = exit_stage
+    else:
+        decision, stop_reason, gate_cache_hit = cached_gate(rag, retrieval)
+    t_gate_end = perf_counter_ns()
+    spans["gate_us"] = (t_gate_end - t_gate_start) / 1e3
+    gate_latency_ms = spans["gate_us"] / 1000
+    if TRACER.enabled:
+        TRACER.record("gate", t_gate_start, t_gate_end, "variant", tid=tid,
+                      variant=rag.name, decision=decision)
+
+    # --- generation (the worker pool bounds concurrency) ---
+    llm_out = None
+    if decision == "answer":
+        t_gen = perf_counter_ns()
+        llm_out = await agenerate_fn(query, retrieval)
+        t_gen_end = perf_counter_ns()
+        spans["generate_us"] = (t_gen_end - t_gen) / 1e3
+        if TRACER.enabled:
+            TRACER.record("generate", t_gen, t_gen_end, "variant", tid=tid, variant=rag.name)
+
+    total_latency_ms = elapsed_ms(t_start)
+    total_latency_ms += retrieval.retrieval_latency_ms
+    if TRACER.enabled:
+        TRACER.record("run", t_start, perf_counter_ns(), "variant", tid=tid, variant=rag.name)
+
+    return rag.make_result(
+        query, retrieval, decision, stop_reason,
+        gate_latency_ms, llm_out, total_latency_ms,
+        est_prompt_tokens=est_prompt_tokens, spans=spans,
+        gate_cache_hit=gate_cache_hit, **extra,
+    )
+
+
+def iter_jobs(variants, retriever, query_texts, chunk_size):
+    """
+    (rag, query, retrieval) in output order. Queries are retrieved
+    chunk_size at a time, as the consumer asks for them, so only one
+    chunk of retrievals is held at once.
+    """
+    for start in range(0, len(query_texts), chunk_size):
+        chunk = query_texts[start:start + chunk_size]
+        for q, per_variant in zip(chunk, variant_retrievals(variants, retriever, chunk)):
+            for rag, r in zip(variants, per_variant):
+                yield rag, q, r
+
+
+async def run_all(jobs, agenerate_fn, max_in_flight, writer, max_buffered=None):
+    """
+    jobs: iterable of (rag, query, retrieval) in output order.
+
+    max_in_flight workers pull jobs from a bounded asyncio.Queue, so only
+    that many requests run at a time however many jobs there are. Rows
+    are written to `writer` in job order as soon as every earlier row is
+    done. A job is only queued within max_buffered (default 4 x
+    max_in_flight) rows of the oldest unwritten one, so a slow row holds
+    back at most that many finished rows. Returns (#rows, #generations).
+    """
+    max_buffered = max(max_in_flight, max_buffered or 4 * max_in_flight)
+    queue = asyncio.Queue(maxsize=max_in_flight)
+    written = asyncio.Condition()
+    finished = {}
+    next_row = 0
+    n_generated = 0
+
+    async def produce():
+        for i, job in enumerate(jobs):
+            async with written:
+                await written.wait_for(lambda: i < next_row + max_buffered)
+            await queue.put((i, job, perf_counter_ns()))
+        for _ in range(max_in_flight):
+            await queue.put(None)
+
+    async def work():
+        nonlocal next_row, n_generated
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            i, (rag, q, r), t_queued = item
+            if TRACER.enabled:
+                TRACER.record("wait_slot", t_queued, perf_counter_ns(), "variant",
+                              tid=id(asyncio.current_task()), variant=rag.name)
+            finished[i] = await run_one(rag, q, r, agenerate_fn)
+            # write the done prefix; later rows wait for earlier ones
+            if next_row in finished:
+                while next_row in finished:
+                    result = finished.pop(next_row)
+                    n_generated += int(result.llm_called)
+                    writer.write(result)
+                    next_row += 1
+                async with written:
+                    written.notify_all()
+
+    await asyncio.gather(produce(), *(work() for _ in range(max_in_flight)))
+    return next_row, n_generated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async stop-first benchmark runner")
+    parser.add_argument("--max-in-flight", type=int, default=4,
+                        help="max concurrent LLM generations")
+    parser.add_argument("--retrieval-chunk", type=int, default=64,
+                        help="queries retrieved at a time ahead of the workers")
+    parser.add_argument("--max-buffered", type=int, default=None,
+                        help="max rows queued or waiting to be written in order "
+                             "(default: 4 x --max-in-flight)")
+    parser.add_argument("--queries", default="datasets/test_queries.json")
+    add_output_args(parser)
+    add_backend_args(parser)
+    add_query_cache_args(parser)
+    add_retrieval_args(parser)
+    add_gate_args(parser)
+    args = parser.parse_args()
+
+    corpus_path = "corpus/corpus.jsonl"
+    index_path = "index/bm25"
+    output_path = output_path_from_args(args)
+    if args.trace:
+        TRACER.enable()
+
+    retriever = load_or_build_retriever(corpus_path, index_path)
+    retriever.cache = query_cache_from_args(args)
+    retriever.prune = args.prune_retrieval
+    queries = load_queries(args.queries)
+    context = context_from_args(args, retriever)
+
+    backend = backend_from_args(args, context)
+    agenerate_fn = backend.agenerate
+    cache = getattr(backend, "cache", None)
+    print(f"Max in flight: {args.max_in_flight}")
+
+    # llm_generate_fn is unused here: generation goes through agenerate_fn
+    cascade = cascade_from_args(args, retriever)
+    variants = [
+        RAGBaselineNaive(retriever, None, context),
+        RAGBaselineThreshold(retriever, TAU_THRESHOLD, None, context),
+        RAGStopFirst(retriever, TAU_STOP, None, context, cascade),
+    ]
+
+    query_texts = [q["question"] for q in queries]
+    jobs = iter_jobs(variants, retriever, query_texts, args.retrieval_chunk)
+
+    t0 = time.perf_counter()
+    with open_result_writer(output_path, args.format) as writer:
+        n_rows, n_generated = asyncio.run(
+            run_all(jobs, agenerate_fn, args.max_in_flight, writer, args.max_buffered)
+        )
+    wall_s = time.perf_counter() - t0
+
+    print(f"Saved results to {output_path}")
+    print(f"Rows: {n_rows}  generations: {n_generated}  wall: {wall_s:.2f}s")
+    print(f"Throughput: {n_rows / wall_s:.2f} rows/s, "
+          f"{n_generated / wall_s:.2f} generations/s")
+    if args.trace:
+        print(f"Trace: {TRACER.export_chrome_trace(args.trace)} ({len(TRACER.events)} spans)")
+    print(f"Gate cascade: {cascade.stats()}")
+    if retriever.cache is not None:
+        print(f"Query cache: {retriever.cache.stats()}")
+    if cache is not None:
+        print(f"LLM cache: {cache.stats()}")
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
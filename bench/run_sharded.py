@@ -0,0 +1,205 @@
+"""
+Multi-process sharded benchmark runner.
+
+Splits the query set into contiguous shards and runs them on a process
+pool. The BM25 index is loaded once (memory-mapped from index/bm25) in the
+parent; with the fork start method workers inherit it copy-on-write, with
+spawn each worker memory-maps the same files, so it is never rebuilt.
+
+Each shard writes results/shards/run_results.<shard>.jsonl (or a columnar
+directory with --format columnar); shards are then concatenated in shard
+order, so the merged output has the same rows in the same (query, variant)
+order as a serial run.py run (latencies aside; the fake backend's random
+draws also depend on shard boundaries).
+
+Usage:
+  PYTHONPATH=. python3 bench/run_sharded.py --workers 64 --queries big.jsonl
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from bench.llm_backend import StreamingGenerate
+from bench.retrieval import BM25Retriever, load_or_build_retriever
+from bench.results_store import merge_columnar, open_result_writer
+from bench.tracing import TRACER, Tracer
+from bench.run import (
+    add_backend_args, add_gate_args, add_output_args, add_query_cache_args,
+    add_retrieval_args, backend_from_args, cascade_from_args, check_backend_args,
+    context_from_args, load_queries, make_variants, output_path_from_args,
+    query_cache_from_args, run_queries,
+)
+
+
+CORPUS_PATH = "corpus/corpus.jsonl"
+INDEX_PATH = "index/bm25"
+
+# per-process state: inherited on fork, filled by _init_worker on spawn
+_RETRIEVER: Optional[BM25Retriever] = None
+_WORKER = None
+
+
+def shard_bounds(n: int, n_shards: int) -> List[Tuple[int, int]]:
+    """Contiguous [start, end) ranges covering 0..n, sizes differing by <= 1."""
+    n_shards = max(1, min(n_shards, n))
+    base, extra = divmod(n, n_shards)
+    bounds = []
+    start = 0
+    for i in range(n_shards):
+        end = start + base + (i < extra)
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+
+def _init_worker(args, query_texts: List[str], shard_dir: str) -> None:
+    global _RETRIEVER, _WORKER
+    if _RETRIEVER is None:
+        _RETRIEVER = BM25Retriever.load(INDEX_PATH)
+    # one query cache per worker process
+    _RETRIEVER.cache = query_cache_from_args(args)
+    _RETRIEVER.prune = args.prune_retrieval
+    context = context_from_args(args, _RETRIEVER)
+    # backend was chosen (and announced) by the parent
+    with contextlib.redirect_stdout(io.StringIO()):
+        llm_generate_fn = backend_from_args(args, context)
+    if args.stream:
+        llm_generate_fn = StreamingGenerate(llm_generate_fn)
+    cascade = cascade_from_args(args, _RETRIEVER)
+    _WORKER = {
+        "variants": make_variants(_RETRIEVER, llm_generate_fn, context, cascade),
+        "cascade": cascade,
+        "query_texts": query_texts,
+        "shard_dir": Path(shard_dir),
+        "cache": getattr(llm_generate_fn, "cache", None),
+        "format": args.format,
+        "trace": bool(args.trace),
+    }
+
+
+def _run_shard(task: Tuple[int, int, int]) -> Tuple[int, str, int, Dict]:
+    shard, start, end = task
+    w = _WORKER
+    # a worker runs many shards: report this shard's gate counts only
+    w["cascade"].reset_stats()
+    if w["trace"]:
+        TRACER.enable()
+        TRACER.clear()
+    suffix = ".jsonl" if w["format"] == "jsonl" else ""
+    path = w["shard_dir"] / f"run_results.{shard:05d}{suffix}"
+    with open_result_writer(path, w["format"]) as writer:
+        n_rows = run_queries(w["variants"], _RETRIEVER, w["query_texts"][start:end], writer)
+    if w["cache"] is not None:
+        # flushes this process's SQLite connection; reopened on next use
+        w["cache"].close()
+    if w["trace"]:
+        TRACER.export_chrome_trace(w["shard_dir"] / f"trace.{shard:05d}.json")
+    return shard, str(path), n_rows, w["cascade"].counters()
+
+
+def merge_shards(shard_paths: List[str], output_path: Path) -> int:
+    """Concatenate JSONL shard files in the given (shard) order."""
+    n_rows = 0
+    with open(output_path, "w", encoding="utf-8") as out:
+        for path in shard_paths:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    out.write(line)
+                    n_rows += 1
+    return n_rows
+
+
+def merge_traces(shard_dir: Path, n_shards: int, output_path) -> int:
+    """Concatenate per-shard trace events (pid tells workers apart)."""
+    events = []
+    for shard in range(n_shards):
+        with open(shard_dir / f"trace.{shard:05d}.json", "r", encoding="utf-8") as f:
+            events.extend(json.load(f)["traceEvents"])
+    tracer = Tracer()
+    tracer.events = events
+    tracer.export_chrome_trace(output_path)
+    return len(events)
+
+
+def main():
+    global _RETRIEVER
+
+    parser = argparse.ArgumentParser(description="Sharded multi-process benchmark runner")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shards-per-worker", type=int, default=4,
+                        help="smaller shards balance load across workers")
+    parser.add_argument("--queries", default="datasets/test_queries.json")
+    add_output_args(parser)
+    parser.add_argument("--shard-dir", default="results/shards")
+    parser.add_argument("--start-method", default=None, choices=mp.get_all_start_methods(),
+                        help="default: fork where available (index inherited)")
+    add_backend_args(parser)
+    add_query_cache_args(parser)
+    add_retrieval_args(parser)
+    add_gate_args(parser)
+    parser.add_argument("--stream", action="store_true",
+                        help="stream generations and record TTFT / inter-token latency")
+    args = parser.parse_args()
+    check_backend_args(parser, args)
+
+    output_path = output_path_from_args(args)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    shard_dir = Path(args.shard_dir)
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    shard_dir.mkdir(parents=True)
+
+    # builds index/bm25 if missing, so workers only ever memory-map it
+    _RETRIEVER = load_or_build_retriever(CORPUS_PATH, INDEX_PATH)
+
+    # resolve "auto" once so every worker uses the same backend
+    backend = backend_from_args(args, None)
+    args.backend = backend.name
+
+    query_texts = [q["question"] for q in load_queries(args.queries)]
+    bounds = shard_bounds(len(query_texts), args.workers * args.shards_per_worker)
+    tasks = [(i, start, end) for i, (start, end) in enumerate(bounds)]
+    print(f"Queries: {len(query_texts)}  workers: {args.workers}  shards: {len(tasks)}")
+
+    start_method = args.start_method
+    if start_method is None:
+        start_method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+    ctx = mp.get_context(start_method)
+
+    t0 = time.perf_counter()
+    shard_paths = [None] * len(tasks)
+    shard_rows = [0] * len(tasks)
+    # sums the workers' per-shard gate counters
+    cascade = cascade_from_args(args, _RETRIEVER)
+    with ctx.Pool(
+        args.workers,
+        initializer=_init_worker,
+        initargs=(args, query_texts, str(shard_dir)),
+    ) as pool:
+        for shard, path, n, counters in pool.imap_unordered(_run_shard, tasks):
+            shard_paths[shard] = path
+            shard_rows[shard] = n
+            cascade.merge_counters(counters)
+    if args.format == "jsonl":
+        merge_shards(shard_paths, output_path)
+    else:
+        merge_columnar(shard_paths, output_path)
+    n_rows = sum(shard_rows)
+    wall_s = time.perf_counter() - t0
+    if args.trace:
+        n_spans = merge_traces(shard_dir, len(tasks), args.trace)
+        print(f"Trace: {args.trace} ({n_spans} spans)")
+
+    print(f"Saved results to {output_path} ({n_rows} rows from {len(tasks)} shards)")
+    print(f"Wall: {wall_s:.2f}s  throughput: {len(query_texts) / wall_s:.1f} queries/s")
+    print(f"Gate cascade: {cascade.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+High-resolution timing helpers.
+
+Spans are taken with time.perf_counter_ns (integer ns, no float rounding
+of the clock) and reported as float microseconds / milliseconds, so
+sub-millisecond stages (gate, top-k) are not truncated to 0.
+"""
+from time import perf_counter_ns
+
+
+def ns_to_us(ns: int) -> float:
+    return ns / 1e3
+
+
+def ns_to_ms(ns: int) -> float:
+    return ns / 1e6
+
+
+def elapsed_us(t0_ns: int) -> float:
+    """Microseconds since a perf_counter_ns() timestamp."""
+    return (perf_counter_ns() - t0_ns) / 1e3
+
+
+def elapsed_ms(t0_ns: int) -> float:
+    """Milliseconds (float) since a perf_counter_ns() timestamp."""
+    return (perf_counter_ns() - t0_ns) / 1e6
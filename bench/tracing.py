@@ -0,0 +1,141 @@
+"""
+Lightweight span tracer with Chrome-trace / Perfetto export.
+
+Disabled by default. While disabled, span() returns a shared no-op
+context manager and callers guard record() with `if TRACER.enabled`, so
+instrumented code pays one attribute check per stage.
+
+  from bench.tracing import TRACER
+
+  with TRACER.span("generate", variant="stop_first"):
+      ...
+  if TRACER.enabled:                 # reuse timestamps already taken
+      TRACER.record("gate", t0_ns, t1_ns)
+
+  TRACER.enable()
+  ...
+  TRACER.export_chrome_trace("results/trace.json")   # chrome://tracing, ui.perfetto.dev
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from time import perf_counter_ns
+from typing import Any, Dict, List, Optional
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "t0")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.t0, perf_counter_ns(), self.cat, **self.args)
+        return False
+
+    def set(self, **args) -> None:
+        """Attach args known only inside the span (e.g. token counts)."""
+        self.args.update(args)
+
+
+class Tracer:
+    """
+    Collects complete ("X") events in memory; at most max_events are kept
+    (later ones are counted in `dropped`).
+    """
+
+    def __init__(self, enabled: bool = False, max_events: int = 1_000_000):
+        self.enabled = enabled
+        self.max_events = max_events
+        self.events: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def clear(self) -> None:
+        with self._lock:
+            self.events = []
+            self.dropped = 0
+
+    def span(self, name: str, cat: str = "bench", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def record(
+        self,
+        name: str,
+        t0_ns: int,
+        t1_ns: int,
+        cat: str = "bench",
+        tid: Optional[int] = None,
+        **args,
+    ) -> None:
+        """Record a finished span from perf_counter_ns timestamps."""
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": t0_ns / 1e3,            # trace format uses microseconds
+            "dur": (t1_ns - t0_ns) / 1e3,
+            "pid": os.getpid(),
+            "tid": threading.get_ident() if tid is None else tid,
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            if len(self.events) < self.max_events:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        return {
+            "traceEvents": list(self.events),
+            "displayTimeUnit": "ns",
+            "otherData": {"dropped_events": self.dropped},
+        }
+
+    def export_chrome_trace(self, path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+        return path
+
+
+# process-wide tracer used by the retriever, variants and LLM backends
+TRACER = Tracer()
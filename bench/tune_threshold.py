@@ -1,89 +1,257 @@
 """
 Threshold (τ) tuning for baseline_score_threshold.
 
-Goal: Find τ that satisfies Recall >= 0.95 on answerable queries.
-Strategy: Select the highest τ meeting this constraint.
+Goal: Find τ that satisfies Recall >= 0.95 on answerable queries
+(optionally jointly with limits on unanswerable pass-through, precision
+and overall stop rate).
+Strategy: Select the highest τ meeting all constraints.
+
+Every distinct retrieval score is a candidate τ: scores are sorted once
+and the counts of answered queries (max_score >= τ) per label come from
+binary searches into the sorted arrays, so the whole sweep is
+O(n log n) and works for millions of logged queries. With unanswerable
+queries the sweep is a full ROC / precision-recall curve ("positive" =
+answered, i.e. the LLM is called).
+
+Inputs are JSONL with a "question" field, labeled like gate_eval.py (file
+flag, or a per-row boolean "answerable"); unlabeled rows count toward
+the stop rate only.
+
+Usage:
+  PYTHONPATH=. python3 bench/tune_threshold.py
+  PYTHONPATH=. python3 bench/tune_threshold.py --unanswerable unans.jsonl \
+      --queries logged.jsonl --min-recall 0.95 --max-fpr 0.2
 """
+import argparse
 import json
+from itertools import islice
 from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
 import numpy as np
 import matplotlib.pyplot as plt
 
-from bench.retrieval import load_corpus_jsonl, BM25Retriever
+from bench.gate_eval import iter_queries
+from bench.retrieval import load_or_build_retriever
+
+
+# label codes in the score arrays
+ANSWERABLE = 1
+UNANSWERABLE = 0
+UNLABELED = -1
+
+# np.trapz was renamed np.trapezoid in NumPy 2.0
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
+def collect_scores(retriever, sources: Iterable, batch_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    sources: iterables of (question, label) (see gate_eval.iter_queries).
+    Returns (max_score, label code) arrays, one entry per query; queries
+    are retrieved in batches (retrieve_many), top-1 only.
+    """
+    scores = []
+    labels = []
+    for source in sources:
+        it = iter(source)
+        while True:
+            batch = list(islice(it, batch_size))
+            if not batch:
+                break
+            results = retriever.retrieve_many(
+                [q for q, _ in batch], top_k=1, batch_size=batch_size
+            )
+            scores.extend(r.max_score for r in results)
+            labels.extend(
+                UNLABELED if label is None else (ANSWERABLE if label else UNANSWERABLE)
+                for _, label in batch
+            )
+    return np.array(scores, dtype=np.float64), np.array(labels, dtype=np.int8)
+
+
+def sweep_tau(scores: np.ndarray, labels: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Gate metrics for every candidate τ (answer iff max_score >= τ).
+
+    Candidates are the distinct scores in decreasing order, preceded by
+    +inf (stop everything), so the curve runs from (0, 0) to (1, 1).
+    Metrics that need unanswerable labels are NaN without them.
+    """
+    pos = np.sort(scores[labels == ANSWERABLE])
+    neg = np.sort(scores[labels == UNANSWERABLE])
+    everything = np.sort(scores)
+
+    tau = np.concatenate([[np.inf], np.unique(everything)[::-1]])
+
+    def n_answered(sorted_scores):
+        # count of scores >= tau, for all tau at once
+        return len(sorted_scores) - np.searchsorted(sorted_scores, tau, side='left')
+
+    tp = n_answered(pos)
+    fp = n_answered(neg)
+    answered = n_answered(everything)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = tp / len(pos) if len(pos) else np.full(len(tau), np.nan)
+        fpr = fp / len(neg) if len(neg) else np.full(len(tau), np.nan)
+        precision = np.where(tp + fp > 0, tp / (tp + fp), np.nan)
+        if not len(neg):
+            precision = np.full(len(tau), np.nan)
+
+    return {
+        'tau': tau,
+        'n_answered': answered,
+        'tp': tp,
+        'fp': fp,
+        'recall': recall,                     # answerable answered
+        'false_stop_rate': 1 - recall,        # answerable stopped
+        'fpr': fpr,                           # unanswerable answered
+        'precision': precision,               # answered that are answerable
+        'stop_rate': 1 - answered / len(scores) if len(scores) else np.full(len(tau), np.nan),
+    }
+
 
+def curve_auc(curve: Dict[str, np.ndarray]) -> Dict[str, Optional[float]]:
+    """ROC AUC (trapezoid) and average precision of a sweep_tau curve."""
+    recall, fpr, precision = curve['recall'], curve['fpr'], curve['precision']
+    if np.isnan(recall).all() or np.isnan(fpr).all():
+        return {'roc_auc': None, 'average_precision': None}
+    roc_auc = float(_trapezoid(recall, fpr))
+    # step-wise AP: precision at each threshold times the recall it adds
+    d_recall = np.diff(recall)
+    ap = float(np.nansum(d_recall * precision[1:]))
+    return {'roc_auc': round(roc_auc, 4), 'average_precision': round(ap, 4)}
 
-def load_answerable(path: str):
-    """Load answerable queries."""
-    queries = []
-    with open(path, 'r') as f:
-        for line in f:
-            queries.append(json.loads(line))
-    return queries
 
+def select_tau(
+    curve: Dict[str, np.ndarray],
+    min_recall: float = 0.95,
+    max_fpr: Optional[float] = None,
+    min_precision: Optional[float] = None,
+    max_stop_rate: Optional[float] = None,
+) -> Tuple[int, bool]:
+    """
+    Index of the highest τ meeting every given constraint (constraints on
+    metrics that are NaN, e.g. no unanswerable labels, are skipped).
+    Returns (index, feasible); if nothing is feasible, the index of the
+    highest τ with maximal recall. Raises ValueError on a curve without
+    scores (only the +inf point).
+    """
+    if len(curve['tau']) < 2:
+        raise ValueError("No scores to tune τ on (empty query set)")
+    ok = np.ones(len(curve['tau']), dtype=bool)
+    checks = [
+        ('recall', min_recall, np.greater_equal),
+        ('fpr', max_fpr, np.less_equal),
+        ('precision', min_precision, np.greater_equal),
+        ('stop_rate', max_stop_rate, np.less_equal),
+    ]
+    for name, bound, cmp in checks:
+        values = curve[name]
+        if bound is None or np.isnan(values).all():
+            continue
+        with np.errstate(invalid='ignore'):
+            ok &= cmp(values, bound)
+    # τ is decreasing along the curve; skip the +inf (stop-everything) point
+    ok[0] = False
+    feasible = np.flatnonzero(ok)
+    if len(feasible):
+        return int(feasible[0]), True
+    recall = np.nan_to_num(curve['recall'][1:], nan=0.0)
+    return int(np.argmax(recall)) + 1, False
+
+
+def curve_point(curve: Dict[str, np.ndarray], i: int) -> Dict:
+    def num(x):
+        x = float(x)
+        return None if np.isnan(x) else round(x, 4)
+
+    return {
+        'tau': float(curve['tau'][i]),
+        'n_answered': int(curve['n_answered'][i]),
+        'recall': num(curve['recall'][i]),
+        'false_stop_rate': num(curve['false_stop_rate'][i]),
+        'fpr': num(curve['fpr'][i]),
+        'precision': num(curve['precision'][i]),
+        'stop_rate': num(curve['stop_rate'][i]),
+    }
 
-def tune_tau(retriever, queries, tau_grid):
+
+def downsample_curve(curve: Dict[str, np.ndarray], max_points: int):
+    """Evenly spaced indices (always keeping both ends) for saving/plotting."""
+    n = len(curve['tau'])
+    if n <= max_points:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, max_points).round().astype(np.int64))
+
+
+def tune_tau(
+    scores: np.ndarray,
+    labels: np.ndarray,
+    min_recall: float = 0.95,
+    max_fpr: Optional[float] = None,
+    min_precision: Optional[float] = None,
+    max_stop_rate: Optional[float] = None,
+    max_curve_points: int = 1000,
+):
     """
-    Tune τ on answerable set.
+    Tune τ over every distinct score.
 
     Returns:
-        dict with tau_results, best_tau, scores
+        dict with the selected point, constraints, AUCs, a downsampled
+        curve and per-label score stats
     """
-    # Get retrieval scores for all queries
-    scores = []
-    for q in queries:
-        result = retriever.retrieve(q['question'])
-        scores.append(result.max_score)
-
-    scores = np.array(scores)
-    n_total = len(scores)
-
-    # Evaluate each τ
-    tau_results = []
-    for tau in tau_grid:
-        # How many queries have score >= tau?
-        n_answered = np.sum(scores >= tau)
-        recall = n_answered / n_total
-
-        tau_results.append({
-            'tau': tau,
-            'n_answered': int(n_answered),
-            'n_total': n_total,
-            'recall': round(recall, 3)
-        })
-
-    # Select: highest τ with recall >= 0.95
-    valid = [r for r in tau_results if r['recall'] >= 0.95]
-
-    if not valid:
-        print("Warning: No τ satisfies recall >= 0.95")
+    curve = sweep_tau(scores, labels)
+    best, feasible = select_tau(curve, min_recall, max_fpr, min_precision, max_stop_rate)
+    if not feasible:
+        print("Warning: No τ satisfies the constraints")
         print("Using τ with highest recall instead")
-        best = max(tau_results, key=lambda x: x['recall'])
-    else:
-        best = max(valid, key=lambda x: x['tau'])
+
+    def stats(s):
+        if not len(s):
+            return None
+        return {
+            'n': int(len(s)),
+            'min': float(s.min()),
+            'max': float(s.max()),
+            'mean': float(s.mean()),
+            'std': float(s.std()),
+        }
 
     return {
-        'tau_results': tau_results,
-        'best_tau': best['tau'],
-        'best_recall': best['recall'],
-        'scores': scores.tolist(),
+        'best': curve_point(curve, best),
+        'feasible': feasible,
+        'constraints': {
+            'min_recall': min_recall,
+            'max_fpr': max_fpr,
+            'min_precision': min_precision,
+            'max_stop_rate': max_stop_rate,
+        },
+        'n_candidates': int(len(curve['tau']) - 1),
+        **curve_auc(curve),
+        'curve': [curve_point(curve, i) for i in downsample_curve(curve, max_curve_points)],
         'score_stats': {
-            'min': float(scores.min()),
-            'max': float(scores.max()),
-            'mean': float(scores.mean()),
-            'std': float(scores.std())
-        }
+            'answerable': stats(scores[labels == ANSWERABLE]),
+            'unanswerable': stats(scores[labels == UNANSWERABLE]),
+            'unlabeled': stats(scores[labels == UNLABELED]),
+        },
     }
 
 
-def plot_score_distribution(scores, best_tau, output_path):
-    """Plot histogram of retrieval scores."""
+def plot_score_distribution(scores, labels, best_tau, output_path):
+    """Plot histogram of retrieval scores per label."""
     plt.figure(figsize=(8, 5))
-    plt.hist(scores, bins=20, alpha=0.7, edgecolor='black')
+    bins = np.histogram_bin_edges(scores, bins=40)
+    for code, name in ((ANSWERABLE, 'answerable'), (UNANSWERABLE, 'unanswerable'),
+                       (UNLABELED, 'unlabeled')):
+        s = scores[labels == code]
+        if len(s):
+            plt.hist(s, bins=bins, alpha=0.6, edgecolor='black', label=name)
     plt.axvline(best_tau, color='red', linestyle='--', linewidth=2,
                 label=f'Best τ = {best_tau:.2f}')
     plt.xlabel('Retrieval Score')
     plt.ylabel('Frequency')
-    plt.title('Retrieval Score Distribution (Answerable Set)')
+    plt.title('Retrieval Score Distribution')
     plt.legend()
     plt.tight_layout()
     plt.savefig(output_path)
@@ -91,59 +259,134 @@ def plot_score_distribution(scores, best_tau, output_path):
     print(f"Saved: {output_path}")
 
 
+def plot_curves(result, output_path):
+    """ROC (recall vs unanswerable pass-through) and precision-recall."""
+    curve = result['curve']
+    recall = [p['recall'] for p in curve]
+    fpr = [p['fpr'] for p in curve]
+    precision = [p['precision'] for p in curve]
+    best = result['best']
+
+    fig, (ax_roc, ax_pr) = plt.subplots(1, 2, figsize=(11, 5))
+    ax_roc.plot(fpr, recall, drawstyle='steps-post')
+    ax_roc.plot([0, 1], [0, 1], color='grey', linestyle=':')
+    ax_roc.scatter([best['fpr']], [best['recall']], color='red', zorder=3,
+                   label=f"τ = {best['tau']:.2f}")
+    ax_roc.set_xlabel('Unanswerable answered (FPR)')
+    ax_roc.set_ylabel('Answerable answered (recall)')
+    ax_roc.set_title(f"ROC (AUC = {result['roc_auc']})")
+    ax_roc.legend()
+
+    ax_pr.plot(recall[1:], precision[1:], drawstyle='steps-post')
+    ax_pr.scatter([best['recall']], [best['precision']], color='red', zorder=3,
+                  label=f"τ = {best['tau']:.2f}")
+    ax_pr.set_xlabel('Recall')
+    ax_pr.set_ylabel('Precision')
+    ax_pr.set_title(f"Precision-Recall (AP = {result['average_precision']})")
+    ax_pr.legend()
+
+    fig.tight_layout()
+    fig.savefig(output_path)
+    plt.close(fig)
+    print(f"Saved: {output_path}")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Tune the retrieval score threshold τ")
+    parser.add_argument("--answerable", nargs="*", default=["datasets/answerable.jsonl"],
+                        help="JSONL files of answerable queries")
+    parser.add_argument("--unanswerable", nargs="*", default=[],
+                        help="JSONL files of unanswerable queries")
+    parser.add_argument("--queries", nargs="*", default=[],
+                        help="JSONL files, labeled per row via 'answerable' (optional)")
+    parser.add_argument("--min-recall", type=float, default=0.95)
+    parser.add_argument("--max-fpr", type=float, default=None,
+                        help="max fraction of unanswerable queries answered")
+    parser.add_argument("--min-precision", type=float, default=None)
+    parser.add_argument("--max-stop-rate", type=float, default=None,
+                        help="max fraction of all queries stopped")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--max-curve-points", type=int, default=1000,
+                        help="curve points saved / plotted (the sweep uses all)")
+    args = parser.parse_args()
+
     # Paths
     corpus_path = "corpus/corpus.jsonl"
-    answerable_path = "datasets/answerable.jsonl"
+    index_path = "index/bm25"
     output_dir = Path("results/tau_tuning")
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # Load data
-    corpus = load_corpus_jsonl(corpus_path)
-    queries = load_answerable(answerable_path)
-    retriever = BM25Retriever(corpus)
+    retriever = load_or_build_retriever(corpus_path, index_path)
+    sources = (
+        [iter_queries(p, True) for p in args.answerable]
+        + [iter_queries(p, False) for p in args.unanswerable]
+        + [iter_queries(p, None) for p in args.queries]
+    )
+    scores, labels = collect_scores(retriever, sources, args.batch_size)
+    if not len(scores):
+        raise SystemExit("No queries found in the given files; nothing to tune")
 
-    print(f"\nTuning τ on {len(queries)} answerable queries")
-    print(f"Corpus: {len(corpus)} documents\n")
+    print(f"\nTuning τ on {int((labels == ANSWERABLE).sum())} answerable, "
+          f"{int((labels == UNANSWERABLE).sum())} unanswerable, "
+          f"{int((labels == UNLABELED).sum())} unlabeled queries")
+    print(f"Corpus: {retriever.index.num_docs} documents\n")
 
     # Tune
-    tau_grid = [0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4]
-
-    result = tune_tau(retriever, queries, tau_grid)
+    result = tune_tau(
+        scores, labels,
+        min_recall=args.min_recall,
+        max_fpr=args.max_fpr,
+        min_precision=args.min_precision,
+        max_stop_rate=args.max_stop_rate,
+        max_curve_points=args.max_curve_points,
+    )
 
-    # Display results
-    print("=== τ Grid Results ===\n")
-    print(f"{'τ':<8} {'Answered':<12} {'Recall':<10}")
-    print("-" * 30)
-    for r in result['tau_results']:
-        marker = " ← BEST" if r['tau'] == result['best_tau'] else ""
-        print(f"{r['tau']:<8.2f} {r['n_answered']}/{r['n_total']:<10} {r['recall']:<10.3f}{marker}")
+    # Display results (a few points along the curve)
+    print("=== τ Sweep ===\n")
+    print(f"{'τ':<10} {'Answered':<10} {'Recall':<8} {'FPR':<8} {'Prec':<8} {'Stop':<8}")
+    print("-" * 56)
+    curve = result['curve']
+    shown = {p['tau']: p for p in curve[1::max(1, len(curve) // 10)]}
+    shown[result['best']['tau']] = result['best']
+    for tau in sorted(shown, reverse=True):
+        p = shown[tau]
+        marker = " ← BEST" if tau == result['best']['tau'] else ""
+        print(f"{tau:<10.3f} {p['n_answered']:<10} {p['recall']!s:<8} {p['fpr']!s:<8} "
+              f"{p['precision']!s:<8} {p['stop_rate']!s:<8}{marker}")
 
+    best = result['best']
     print(f"\n=== Selected τ ===")
-    print(f"τ = {result['best_tau']:.2f}")
-    print(f"Recall = {result['best_recall']:.3f}")
-    print(f"\nScore stats: min={result['score_stats']['min']:.2f}, "
-          f"max={result['score_stats']['max']:.2f}, "
-          f"mean={result['score_stats']['mean']:.2f}")
+    print(f"τ = {best['tau']:.4f}")
+    print(f"Recall = {best['recall']}  FPR = {best['fpr']}  "
+          f"Precision = {best['precision']}  Stop rate = {best['stop_rate']}")
+    print(f"ROC AUC = {result['roc_auc']}  AP = {result['average_precision']}")
+    ans = result['score_stats']['answerable']
+    if ans:
+        print(f"\nAnswerable score stats: min={ans['min']:.2f}, "
+              f"max={ans['max']:.2f}, mean={ans['mean']:.2f}")
 
     # Save results
     with open(output_dir / "tau_results.json", 'w') as f:
         json.dump(result, f, indent=2)
 
+    constraints = {k: v for k, v in result['constraints'].items() if v is not None}
     with open(output_dir / "best_tau.json", 'w') as f:
         json.dump({
-            'tau': result['best_tau'],
-            'recall': result['best_recall'],
-            'constraint': 'recall >= 0.95',
-            'strategy': 'highest tau satisfying constraint'
+            'tau': best['tau'],
+            'recall': best['recall'],
+            'fpr': best['fpr'],
+            'precision': best['precision'],
+            'stop_rate': best['stop_rate'],
+            'constraint': ', '.join(f"{k} = {v}" for k, v in constraints.items()),
+            'feasible': result['feasible'],
+            'strategy': 'highest tau satisfying constraints'
         }, f, indent=2)
 
     # Plot
-    plot_score_distribution(
-        np.array(result['scores']),
-        result['best_tau'],
-        output_dir / "score_histogram.png"
-    )
+    plot_score_distribution(scores, labels, best['tau'], output_dir / "score_histogram.png")
+    if result['roc_auc'] is not None:
+        plot_curves(result, output_dir / "roc_pr.png")
 
     print(f"\nResults saved to {output_dir}/")
 